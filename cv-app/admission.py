@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from detector_pool import DetectorBusyError
+from session_store import SessionStore
+
+# Ticket of the frame being handled in this context
+_current_frame = ContextVar('frame_ticket', default=None)
+
+class FrameDropped(Exception):
+    """Raised when a frame expires, is superseded or is throttled before it reaches the model"""
+    
+    def __init__(self, reason):
+        super().__init__(f'Frame {reason} before inference')
+        self.reason = reason
+
+class OverloadedError(DetectorBusyError):
+    """Raised when the in-flight request cap is reached"""
+    pass
+
+class FrameTicket:
+    """Deadline and latest-only generation of one admitted frame"""
+    
+    def __init__(self, controller, deadline=None, session_id=None, generation=None):
+        self.controller = controller
+        self.deadline = deadline
+        self.session_id = session_id
+        self.generation = generation
+    
+    def drop_reason(self):
+        """'expired', 'superseded' or None if the frame is still wanted"""
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            return 'expired'
+        if self.generation is not None:
+            # An evicted session has no newer frame to compare with
+            latest = self.controller.latest_generation(self.session_id)
+            if latest is not None and latest != self.generation:
+                return 'superseded'
+        return None
+    
+    def check(self):
+        """Raise FrameDropped if the frame is no longer worth running"""
+        reason = self.drop_reason()
+        if reason:
+            raise FrameDropped(reason)
+
+class AdmissionController:
+    """Global in-flight cap plus per-request deadlines and latest-only sessions.
+    
+    Admitted frames carry a FrameTicket in a context variable; the
+    inference path calls check_frame() wherever a frame may have waited
+    (before decode, before inference, after getting a detector) so stale
+    frames are dropped instead of using the model. A latest-only frame is
+    superseded as soon as a newer latest-only frame from the same session
+    is admitted. Clients admitted within the last active_window seconds
+    count as active.
+    """
+    
+    def __init__(self, max_in_flight=0, session_ttl=60.0, max_sessions=1024, active_window=5.0):
+        self.max_in_flight = max_in_flight
+        self.active_window = active_window
+        self._sessions = SessionStore(session_ttl, max_sessions)
+        self._seen = OrderedDict()  # client -> last admission time, oldest first
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.dropped = {'expired': 0, 'superseded': 0, 'throttled': 0}
+    
+    @contextmanager
+    def admit(self, deadline=None, session_id=None, latest_only=False, client=None):
+        """Admit one frame for the duration of the with-block.
+        
+        deadline is an absolute time.monotonic() value. client identifies
+        the sender for active_clients(), defaulting to session_id. Raises
+        OverloadedError when max_in_flight frames are already admitted.
+        """
+        client = client or session_id
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.rejected += 1
+                raise OverloadedError(f'Too many requests in flight (max {self.max_in_flight})')
+            self.in_flight += 1
+            self.admitted += 1
+            if client:
+                now = time.monotonic()
+                self._seen[client] = now
+                self._seen.move_to_end(client)
+                self._expire_seen(now)
+        
+        generation = self._next_generation(session_id) if latest_only and session_id else None
+        token = _current_frame.set(FrameTicket(self, deadline, session_id, generation))
+        try:
+            yield
+        except FrameDropped as e:
+            with self._lock:
+                self.dropped[e.reason] += 1
+            raise
+        finally:
+            _current_frame.reset(token)
+            with self._lock:
+                self.in_flight -= 1
+    
+    def _next_generation(self, session_id):
+        state = self._sessions.get(session_id, lambda: {'latest': 0})
+        with self._lock:
+            state['latest'] += 1
+            return state['latest']
+    
+    def latest_generation(self, session_id):
+        state = self._sessions.get(session_id)
+        return state['latest'] if state else None
+    
+    def _expire_seen(self, now):
+        """Forget clients not admitted within active_window (lock held)"""
+        while self._seen and next(iter(self._seen.values())) < now - self.active_window:
+            self._seen.popitem(last=False)
+    
+    def active_clients(self):
+        """Distinct clients admitted within the last active_window seconds"""
+        with self._lock:
+            self._expire_seen(time.monotonic())
+            return len(self._seen)
+    
+    def stats(self):
+        """In-flight count, active clients and how many frames were rejected or dropped"""
+        with self._lock:
+            self._expire_seen(time.monotonic())
+            return {
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'active_clients': len(self._seen),
+                'expired': self.dropped['expired'],
+                'superseded': self.dropped['superseded'],
+                'throttled': self.dropped['throttled'],
+            }
+
+def current_frame():
+    return _current_frame.get()
+
+def check_frame():
+    """Drop the current frame if it expired or was superseded, a no-op outside admit()"""
+    ticket = _current_frame.get()
+    if ticket is not None:
+        ticket.check()
@@ -1,121 +1,954 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
-import cv2
+from flask import Flask, Response, g, has_request_context, render_template, request, jsonify, send_from_directory
+from flask_sock import Sock
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
 import numpy as np
 import os
+import json
+import struct
+import tempfile
+import atexit
 import logging
-from datetime import datetime
+import multiprocessing
+import threading
+import time
+from contextlib import contextmanager
+from detector_pool import DetectorPool, DetectorBusyError
+from inference_workers import InferenceWorkerPool
+from batch_scheduler import BatchScheduler
+from pipeline import Pipeline
+from fair_scheduler import FairScheduler, parse_session_values
+from admission import AdmissionController, FrameDropped, check_frame, current_frame
+from result_cache import ResultCache, content_key, perceptual_key, params_fingerprint
+from motion_gate import MotionGate
+from tracking import TrackerRegistry
+from metrics import MetricsRegistry, StageTimer, activate, deactivate, record, stage
+from engines import create_engine, parse_input_size
+from mock_detector import MockDetector
+from video import open_video, detect_video, ndjson
+from wire_format import PACKED_MIMETYPE, FLAG_MOCK, FLAG_CACHED, FLAG_REUSED, FLAG_TRACKED, pack_detections
+from detection import (
+    COCO_CLASSES, INPUT_SCALE, INPUT_MEAN, parse_detections, split_batch_detections,
+    jpeg_size, reduced_decode_factor, scale_detections, normalize_detections,
+    tile_grid, merge_tile_detections, detection_dicts
+)
 
 app = Flask(__name__)
+sock = Sock(app)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
+app.config['MAX_BATCH_FRAMES'] = int(os.environ.get('MAX_BATCH_FRAMES', 16))
+
+# Decode large JPEGs at 1/2, 1/4 or 1/8 scale when that still covers the
+# model input; boxes are scaled back to original pixels
+app.config['REDUCED_DECODE'] = os.environ.get('REDUCED_DECODE', 'true').lower() in ('1', 'true', 'yes', 'on')
+
+# Default post-processing settings, each can be overridden per request
+app.config['DETECTION_CONFIDENCE'] = float(os.environ.get('DETECTION_CONFIDENCE', 0.5))
+app.config['MAX_DETECTIONS'] = int(os.environ.get('MAX_DETECTIONS', 100))
+app.config['DETECTION_NMS'] = os.environ.get('DETECTION_NMS', 'false')
+app.config['NMS_THRESHOLD'] = float(os.environ.get('NMS_THRESHOLD', 0.4))
+
+# Detector engine: tensorflow (SSD MobileNet v3 .pb/.pbtxt), onnx or onnx-int8.
+# DETECTOR_MODEL/DETECTOR_CONFIG override the engine's default model paths;
+# DETECTOR_INPUT_SIZE is a square side (224, 300, 320) or WIDTHxHEIGHT.
+app.config['DETECTOR_ENGINE'] = os.environ.get('DETECTOR_ENGINE', 'tensorflow')
+app.config['DETECTOR_MODEL'] = os.environ.get('DETECTOR_MODEL')
+app.config['DETECTOR_CONFIG'] = os.environ.get('DETECTOR_CONFIG')
+app.config['DETECTOR_INPUT_SIZE'] = parse_input_size(os.environ.get('DETECTOR_INPUT_SIZE', 300))
+app.config['DETECTOR_SCALE'] = float(os.environ.get('DETECTOR_SCALE', INPUT_SCALE))
+app.config['DETECTOR_MEAN'] = float(os.environ.get('DETECTOR_MEAN', INPUT_MEAN))
+
+# Detector pool: N independent nets, each running with OPENCV_THREADS
+# intra-op threads. By default the cores are split evenly across the pool.
+app.config['DETECTOR_POOL_SIZE'] = int(os.environ.get('DETECTOR_POOL_SIZE', 1))
+app.config['OPENCV_THREADS'] = int(os.environ.get(
+    'OPENCV_THREADS', max(1, (os.cpu_count() or 1) // app.config['DETECTOR_POOL_SIZE'])
+))
+app.config['DETECTOR_ACQUIRE_TIMEOUT'] = float(os.environ.get('DETECTOR_ACQUIRE_TIMEOUT', 5.0))
+
+# Out-of-process inference: 0 runs detection in the web process. Frames are
+# resized to the model input and handed to workers through shared memory
+# slots of SHM_SLOT_BYTES each.
+app.config['INFERENCE_WORKERS'] = int(os.environ.get('INFERENCE_WORKERS', 0))
+app.config['SHM_SLOTS'] = int(os.environ.get('SHM_SLOTS', 2 * app.config['INFERENCE_WORKERS']))
+app.config['SHM_SLOT_BYTES'] = int(os.environ.get('SHM_SLOT_BYTES', 1920 * 1080 * 3))
+app.config['INFERENCE_TIMEOUT'] = float(os.environ.get('INFERENCE_TIMEOUT', 30.0))
+
+# Video files: frames decoded ahead of inference (VIDEO_PREFETCH) and the
+# directory server-side video paths must live under (unset disables them)
+app.config['VIDEO_PREFETCH'] = int(os.environ.get('VIDEO_PREFETCH', 4))
+app.config['VIDEO_ROOT'] = os.environ.get('VIDEO_ROOT')
+
+# Dynamic micro-batching: concurrent single-frame requests that arrive within
+# BATCH_WINDOW_MS of each other share one forward pass of up to BATCH_MAX_SIZE
+# frames (0 disables). Only applies to in-process inference.
+app.config['BATCH_WINDOW_MS'] = float(os.environ.get('BATCH_WINDOW_MS', 0))
+app.config['BATCH_MAX_SIZE'] = int(os.environ.get('BATCH_MAX_SIZE', 8))
+
+# Pipelined detection (PIPELINE): decode, preprocess, inference and
+# serialization run on their own threads, connected by queues holding at
+# most PIPELINE_QUEUE_SIZE frames, so one frame decodes while another is in
+# the model. PIPELINE_DECODE_THREADS decode in parallel; inference gets one
+# thread per pooled detector. Only applies to in-process inference without
+# micro-batching; tracked and tiled frames stay on the request thread.
+app.config['PIPELINE'] = os.environ.get('PIPELINE', 'false').lower() in ('1', 'true', 'yes', 'on')
+app.config['PIPELINE_QUEUE_SIZE'] = int(os.environ.get('PIPELINE_QUEUE_SIZE', 4))
+app.config['PIPELINE_DECODE_THREADS'] = int(os.environ.get('PIPELINE_DECODE_THREADS', 2))
+
+# Load shedding: at most MAX_IN_FLIGHT detection requests at once (0 = no
+# cap, extra requests get 503). Requests may carry a deadline (deadline_ms or
+# X-Deadline-Ms, falling back to DEFAULT_DEADLINE_MS, 0 = none) and ask for
+# latest-only within their session (latest=true or X-Latest-Only); frames that
+# expire or are superseded before inference are dropped with DROPPED_STATUS.
+app.config['MAX_IN_FLIGHT'] = int(os.environ.get('MAX_IN_FLIGHT', 0))
+app.config['DEFAULT_DEADLINE_MS'] = float(os.environ.get('DEFAULT_DEADLINE_MS', 0))
+
+# Fair scheduling across sessions (FAIR_SCHEDULING): while inference is busy,
+# waiting frames take turns by session (deficit round-robin) weighted by
+# SESSION_PRIORITIES (session=weight,..., default 1). A session keeps at most
+# SESSION_MAX_QUEUED waiting frames, older ones are dropped as superseded.
+# SESSION_MAX_FPS caps each session's inference rate (0 = no cap), overridden
+# per session by SESSION_FPS_CAPS (session=fps,...); frames over the cap are
+# dropped as throttled.
+app.config['FAIR_SCHEDULING'] = os.environ.get('FAIR_SCHEDULING', 'false').lower() in ('1', 'true', 'yes', 'on')
+app.config['SESSION_PRIORITIES'] = parse_session_values(os.environ.get('SESSION_PRIORITIES', ''))
+app.config['SESSION_FPS_CAPS'] = parse_session_values(os.environ.get('SESSION_FPS_CAPS', ''))
+app.config['SESSION_MAX_FPS'] = float(os.environ.get('SESSION_MAX_FPS', 0))
+app.config['SESSION_MAX_QUEUED'] = int(os.environ.get('SESSION_MAX_QUEUED', 2))
+
+# Detection result cache keyed by upload bytes (0 disables). With
+# RESULT_CACHE_PHASH, near-identical frames also hit via a perceptual hash.
+app.config['RESULT_CACHE_SIZE'] = int(os.environ.get('RESULT_CACHE_SIZE', 256))
+app.config['RESULT_CACHE_TTL'] = float(os.environ.get('RESULT_CACHE_TTL', 30.0))
+app.config['RESULT_CACHE_PHASH'] = os.environ.get('RESULT_CACHE_PHASH', 'false').lower() in ('1', 'true', 'yes', 'on')
+
+# Motion gating for clients that send a session id: frames that differ from
+# the session's last detected frame by less than MOTION_THRESHOLD (mean
+# absolute pixel difference, 0-1) reuse its detections
+app.config['MOTION_THRESHOLD'] = float(os.environ.get('MOTION_THRESHOLD', 0.02))
+app.config['MOTION_SESSION_TTL'] = float(os.environ.get('MOTION_SESSION_TTL', 60.0))
+app.config['MOTION_MAX_SESSIONS'] = int(os.environ.get('MOTION_MAX_SESSIONS', 1024))
+app.config['MOTION_MAX_REUSE_AGE'] = float(os.environ.get('MOTION_MAX_REUSE_AGE', 5.0))
+
+# Keyframe tracking for sessions that ask for it (track=true): the model runs
+# every TRACKING_INTERVAL frames (adapted between the min and max) and boxes
+# are propagated with optical flow in between
+app.config['TRACKING_INTERVAL'] = int(os.environ.get('TRACKING_INTERVAL', 5))
+app.config['TRACKING_MIN_INTERVAL'] = int(os.environ.get('TRACKING_MIN_INTERVAL', 2))
+app.config['TRACKING_MAX_INTERVAL'] = int(os.environ.get('TRACKING_MAX_INTERVAL', 15))
+app.config['TRACKING_MIN_CONFIDENCE'] = float(os.environ.get('TRACKING_MIN_CONFIDENCE', 0.5))
+
+# Tiled inference for high-resolution frames (TILING, or tiled=true per
+# request): the frame is cut into TILE_SIZE pixel squares overlapping by
+# TILE_OVERLAP (fraction of a tile), at most TILE_MAX of them, which run as
+# one batch together with a view of the whole frame
+app.config['TILING'] = os.environ.get('TILING', 'false')
+app.config['TILE_SIZE'] = int(os.environ.get('TILE_SIZE', 640))
+app.config['TILE_OVERLAP'] = float(os.environ.get('TILE_OVERLAP', 0.2))
+app.config['TILE_MAX'] = int(os.environ.get('TILE_MAX', 16))
+
+# Mock mode (no model files). Detections are reproducible for a given
+# MOCK_SEED, with a separate stream per session id; each frame gets between
+# MOCK_MIN_DETECTIONS and MOCK_MAX_DETECTIONS boxes. MOCK_LATENCY simulates
+# inference time: none, fixed (MOCK_LATENCY_MS), normal (MOCK_LATENCY_MS with
+# MOCK_LATENCY_STD_MS) or trace (replays MOCK_LATENCY_TRACE, one ms value per line)
+app.config['MOCK_SEED'] = int(os.environ.get('MOCK_SEED', 0))
+app.config['MOCK_MIN_DETECTIONS'] = int(os.environ.get('MOCK_MIN_DETECTIONS', 1))
+app.config['MOCK_MAX_DETECTIONS'] = int(os.environ.get('MOCK_MAX_DETECTIONS', 2))
+app.config['MOCK_LATENCY'] = os.environ.get('MOCK_LATENCY', 'none')
+app.config['MOCK_LATENCY_MS'] = float(os.environ.get('MOCK_LATENCY_MS', 20.0))
+app.config['MOCK_LATENCY_STD_MS'] = float(os.environ.get('MOCK_LATENCY_STD_MS', 5.0))
+app.config['MOCK_LATENCY_TRACE'] = os.environ.get('MOCK_LATENCY_TRACE')
+
+# Frame rate suggested to clients by /capabilities: the measured inference
+# capacity split between recently active clients, between SUGGESTED_MIN_FPS
+# and SUGGESTED_MAX_FPS
+app.config['SUGGESTED_MAX_FPS'] = float(os.environ.get('SUGGESTED_MAX_FPS', 15))
+app.config['SUGGESTED_MIN_FPS'] = float(os.environ.get('SUGGESTED_MIN_FPS', 1))
+
+# Dummy inferences run on each loaded detector before /detect is opened up
+app.config['MODEL_WARMUP_RUNS'] = int(os.environ.get('MODEL_WARMUP_RUNS', 2))
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Detection model paths
-MODEL_CONFIG = 'models/ssd_mobilenet_v3_large_coco_2020_01_14.pbtxt'
-MODEL_WEIGHTS = 'models/frozen_inference_graph.pb'
-CLASSES_FILE = 'models/coco.names'
-
-# COCO class names (first 20 for brevity, full list available)
-COCO_CLASSES = [
-    'person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck',
-    'boat', 'traffic light', 'fire hydrant', 'stop sign', 'parking meter', 'bench',
-    'bird', 'cat', 'dog', 'horse', 'sheep', 'cow', 'elephant', 'bear', 'zebra',
-    'giraffe', 'backpack', 'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee',
-    'skis', 'snowboard', 'sports ball', 'kite', 'baseball bat', 'baseball glove',
-    'skateboard', 'surfboard', 'tennis racket', 'bottle', 'wine glass', 'cup',
-    'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple', 'sandwich', 'orange',
-    'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair', 'couch',
-    'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse',
-    'remote', 'keyboard', 'cell phone', 'microwave', 'oven', 'toaster', 'sink',
-    'refrigerator', 'book', 'clock', 'vase', 'scissors', 'teddy bear', 'hair drier',
-    'toothbrush'
-]
-
 # Initialize detector
-detector = None
+engine = create_engine(
+    app.config['DETECTOR_ENGINE'],
+    model=app.config['DETECTOR_MODEL'],
+    config=app.config['DETECTOR_CONFIG'],
+    input_size=app.config['DETECTOR_INPUT_SIZE'],
+    scale=app.config['DETECTOR_SCALE'],
+    mean=app.config['DETECTOR_MEAN']
+)
+mock_detector = MockDetector(
+    seed=app.config['MOCK_SEED'],
+    min_detections=app.config['MOCK_MIN_DETECTIONS'],
+    max_detections=app.config['MOCK_MAX_DETECTIONS'],
+    latency=app.config['MOCK_LATENCY'],
+    latency_ms=app.config['MOCK_LATENCY_MS'],
+    latency_std_ms=app.config['MOCK_LATENCY_STD_MS'],
+    trace=app.config['MOCK_LATENCY_TRACE'],
+    session_ttl=app.config['MOTION_SESSION_TTL'],
+    max_sessions=app.config['MOTION_MAX_SESSIONS']
+)
+detector_pool = None
+worker_pool = None
+batch_scheduler = None
+pipeline = None
+fair_scheduler = None
 mock_mode = True
 
+# The model loads in the background; detection endpoints answer 503 until
+# model_ready is set. state goes loading -> warming -> ready (or failed).
+model_ready = threading.Event()
+startup = {'state': 'loading', 'load_ms': None, 'error': None}
+result_cache = ResultCache(
+    app.config['RESULT_CACHE_SIZE'], app.config['RESULT_CACHE_TTL']
+) if app.config['RESULT_CACHE_SIZE'] > 0 else None
+motion_gate = MotionGate(
+    threshold=app.config['MOTION_THRESHOLD'],
+    session_ttl=app.config['MOTION_SESSION_TTL'],
+    max_sessions=app.config['MOTION_MAX_SESSIONS'],
+    max_reuse_age=app.config['MOTION_MAX_REUSE_AGE']
+)
+tracker_registry = TrackerRegistry(
+    interval=app.config['TRACKING_INTERVAL'],
+    min_interval=app.config['TRACKING_MIN_INTERVAL'],
+    max_interval=app.config['TRACKING_MAX_INTERVAL'],
+    min_confidence=app.config['TRACKING_MIN_CONFIDENCE'],
+    session_ttl=app.config['MOTION_SESSION_TTL'],
+    max_sessions=app.config['MOTION_MAX_SESSIONS']
+)
+admission = AdmissionController(
+    max_in_flight=app.config['MAX_IN_FLIGHT'],
+    session_ttl=app.config['MOTION_SESSION_TTL'],
+    max_sessions=app.config['MOTION_MAX_SESSIONS']
+)
+metrics_registry = MetricsRegistry()
+
+# Endpoints whose requests get a stage timer and a Server-Timing header
+TIMED_ENDPOINTS = {'detect', 'detect_batch'}
+
+# Endpoints that need a warm detector
+DETECTION_ENDPOINTS = {'detect', 'detect_batch', 'detect_stream', 'detect_video_file'}
+
+# Status for frames dropped because they expired, were superseded or were throttled
+DROPPED_STATUS = 410
+
+def start_inference_workers():
+    """Start out-of-process inference workers, each loading its own model"""
+    global worker_pool
+    
+    worker_pool = InferenceWorkerPool(
+        workers=app.config['INFERENCE_WORKERS'],
+        slots=app.config['SHM_SLOTS'],
+        slot_bytes=app.config['SHM_SLOT_BYTES'],
+        engine=engine,
+        use_model=not mock_mode,
+        mock=mock_detector,
+        threads=max(1, (os.cpu_count() or 1) // app.config['INFERENCE_WORKERS']),
+        acquire_timeout=app.config['DETECTOR_ACQUIRE_TIMEOUT'],
+        task_timeout=app.config['INFERENCE_TIMEOUT'],
+        warmup_runs=app.config['MODEL_WARMUP_RUNS']
+    )
+    atexit.register(worker_pool.shutdown)
+    
+    # Workers load and warm their own models; wait until all of them report in
+    startup['state'] = 'warming'
+    while not worker_pool.ready():
+        time.sleep(0.1)
+
 def load_detector():
-    """Load OpenCV DNN detector or set mock mode"""
-    global detector, mock_mode
+    """Load a pool of OpenCV DNN detectors or set mock mode"""
+    global detector_pool, mock_mode
     
-    if os.path.exists(MODEL_WEIGHTS) and os.path.exists(MODEL_CONFIG):
+    if app.config['INFERENCE_WORKERS'] > 0:
+        mock_mode = not engine.files_present()
+        start_inference_workers()
+    elif engine.files_present():
         try:
-            detector = cv2.dnn.readNetFromTensorflow(MODEL_WEIGHTS, MODEL_CONFIG)
+            import cv2
+            cv2.setNumThreads(app.config['OPENCV_THREADS'])
+            detector_pool = DetectorPool(
+                engine.load,
+                size=app.config['DETECTOR_POOL_SIZE'],
+                acquire_timeout=app.config['DETECTOR_ACQUIRE_TIMEOUT']
+            )
             mock_mode = False
-            logger.info("OpenCV DNN model loaded successfully")
+            logger.info(
+                f"OpenCV DNN model loaded successfully: {engine.name} {engine.model} "
+                f"({app.config['DETECTOR_POOL_SIZE']} instance(s), {app.config['OPENCV_THREADS']} thread(s) each)"
+            )
+            
+            startup['state'] = 'warming'
+            detector_pool.each(lambda net: engine.warm_up(net, app.config['MODEL_WARMUP_RUNS']))
         except Exception as e:
             logger.warning(f"Failed to load model: {e}. Using mock mode.")
             mock_mode = True
     else:
         logger.info("Model files not found. Using mock detection mode.")
         mock_mode = True
+    
+    if app.config['BATCH_WINDOW_MS'] > 0 and worker_pool is None:
+        start_batch_scheduler()
+    if app.config['FAIR_SCHEDULING']:
+        start_fair_scheduler()
+    if app.config['PIPELINE']:
+        if worker_pool or batch_scheduler:
+            logger.warning("PIPELINE only applies to in-process inference without micro-batching, not starting it")
+        else:
+            start_pipeline()
 
-def mock_detect(frame):
-    """Generate mock detections for demo"""
-    height, width = frame.shape[:2]
-    detections = []
+def start_batch_scheduler():
+    """Batch concurrent single-frame requests, one batch per pooled detector"""
+    global batch_scheduler
     
-    # Generate 1-2 random detections
-    num_detections = np.random.randint(1, 3)
+    batch_scheduler = BatchScheduler(
+        detect_frames,
+        window_ms=app.config['BATCH_WINDOW_MS'],
+        max_batch=app.config['BATCH_MAX_SIZE'],
+        concurrency=app.config['DETECTOR_POOL_SIZE'],
+        timeout=app.config['INFERENCE_TIMEOUT']
+    )
+    atexit.register(batch_scheduler.shutdown)
+
+def start_fair_scheduler():
+    """Order frames waiting for inference by session, one slot per frame the backend runs at once"""
+    global fair_scheduler
     
-    common_classes = ['person', 'chair', 'cup', 'laptop', 'bottle', 'cell phone']
+    slots = inference_slots()
+    if batch_scheduler:
+        # Let enough frames through to fill a micro-batch per detector
+        slots *= app.config['BATCH_MAX_SIZE']
+    fair_scheduler = FairScheduler(
+        slots=slots,
+        max_queued=app.config['SESSION_MAX_QUEUED'],
+        default_fps=app.config['SESSION_MAX_FPS'],
+        fps_caps=app.config['SESSION_FPS_CAPS'],
+        priorities=app.config['SESSION_PRIORITIES'],
+        timeout=app.config['INFERENCE_TIMEOUT'],
+        session_ttl=app.config['MOTION_SESSION_TTL'],
+        max_sessions=app.config['MOTION_MAX_SESSIONS']
+    )
+    logger.info(f"Fair scheduling across sessions with {slots} inference slot(s)")
+
+def start_pipeline():
+    """Run decode, preprocess, inference and serialization on their own stage threads"""
+    global pipeline
     
-    for _ in range(num_detections):
-        # Random bbox
-        x = np.random.randint(0, width // 2)
-        y = np.random.randint(0, height // 2)
-        w = np.random.randint(50, min(200, width - x))
-        h = np.random.randint(50, min(200, height - y))
-        
-        # Random class
-        class_name = np.random.choice(common_classes)
-        confidence = np.random.uniform(0.7, 0.95)
-        
-        detections.append({
-            'label': class_name,
-            'confidence': round(confidence, 2),
-            'bbox': [int(x), int(y), int(w), int(h)]
-        })
+    inference_threads = inference_slots()
+    if fair_scheduler:
+        # Extra inference threads wait at the fair scheduler, so it rather
+        # than queue order picks which session's frame runs next
+        inference_threads += app.config['PIPELINE_QUEUE_SIZE']
+    pipeline = Pipeline([
+        ('decode', pipeline_decode, app.config['PIPELINE_DECODE_THREADS']),
+        ('preprocess', pipeline_preprocess, 1),
+        ('inference', pipeline_inference, inference_threads),
+        ('serialize', pipeline_serialize, 1),
+    ], queue_size=app.config['PIPELINE_QUEUE_SIZE'], timeout=app.config['INFERENCE_TIMEOUT'])
+    atexit.register(pipeline.shutdown)
+
+def load_detector_in_background():
+    """Load and warm up the detector on a thread so the server starts immediately"""
+    def run():
+        start = time.perf_counter()
+        try:
+            load_detector()
+            startup['state'] = 'ready'
+            model_ready.set()
+        except Exception as e:
+            logger.error(f"Detector startup failed: {e}")
+            startup['state'] = 'failed'
+            startup['error'] = str(e)
+        startup['load_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f"Detector startup finished in {startup['load_ms']} ms ({startup['state']})")
     
-    return detections
+    threading.Thread(target=run, name='model-loader', daemon=True).start()
+
+def wait_until_ready(timeout=None):
+    """Block until the detector is warm, returns False on timeout"""
+    return model_ready.wait(timeout)
+
+def before_fork():
+    """Stop background threads before server workers are forked from this process"""
+    if worker_pool:
+        raise RuntimeError('Inference worker processes cannot be combined with a pre-fork server')
+    if batch_scheduler:
+        batch_scheduler.shutdown()
+    if pipeline:
+        pipeline.shutdown()
 
-def dnn_detect(frame):
+def after_fork(threads):
+    """Set up a forked server worker: its own OpenCV thread count, warm nets, batch scheduler and pipeline.
+    
+    The nets themselves are inherited from the parent and shared
+    copy-on-write; only threads have to be started again.
+    """
+    global batch_scheduler, pipeline
+    
+    import cv2
+    cv2.setNumThreads(threads)
+    app.config['OPENCV_THREADS'] = threads
+    if detector_pool:
+        detector_pool.each(lambda net: engine.warm_up(net, app.config['MODEL_WARMUP_RUNS']))
+    
+    batch_scheduler = None
+    if app.config['BATCH_WINDOW_MS'] > 0:
+        start_batch_scheduler()
+    if pipeline:
+        start_pipeline()
+
+def detection_params(values=None):
+    """Build post-processing parameters from request values, falling back to app config.
+    
+    Recognised keys: confidence, classes (comma separated labels or ids),
+    max_detections, nms, nms_threshold, tiled and normalized (boxes as fractions
+    of the frame size in responses). Raises ValueError on bad input.
+    """
+    values = values or {}
+    params = {
+        'confidence': float(values.get('confidence', app.config['DETECTION_CONFIDENCE'])),
+        'classes': None,
+        'max_detections': int(values.get('max_detections', app.config['MAX_DETECTIONS'])),
+        'nms': str(values.get('nms', app.config['DETECTION_NMS'])).lower() in ('1', 'true', 'yes', 'on'),
+        'nms_threshold': float(values.get('nms_threshold', app.config['NMS_THRESHOLD'])),
+        'tiled': str(values.get('tiled', app.config['TILING'])).lower() in ('1', 'true', 'yes', 'on'),
+        'normalized': str(values.get('normalized', '')).lower() in ('1', 'true', 'yes', 'on'),
+    }
+    
+    if not 0.0 <= params['confidence'] <= 1.0:
+        raise ValueError('confidence must be between 0 and 1')
+    if not 0.0 <= params['nms_threshold'] <= 1.0:
+        raise ValueError('nms_threshold must be between 0 and 1')
+    if params['max_detections'] < 1:
+        raise ValueError('max_detections must be at least 1')
+    
+    classes = values.get('classes')
+    if classes:
+        class_ids = []
+        for name in str(classes).split(','):
+            name = name.strip()
+            if name.isdigit() and int(name) < len(COCO_CLASSES):
+                class_ids.append(int(name))
+            elif name in COCO_CLASSES:
+                class_ids.append(COCO_CLASSES.index(name))
+            else:
+                raise ValueError(f'Unknown class: {name}')
+        params['classes'] = np.array(class_ids, dtype=np.int32)
+    
+    return params
+
+def dnn_detect(frame, params=None):
     """Detect objects using OpenCV DNN"""
+    if params is None:
+        params = detection_params()
     height, width = frame.shape[:2]
     
-    # Prepare input blob
-    blob = cv2.dnn.blobFromImage(frame, 1.0/127.5, (300, 300), [127.5, 127.5, 127.5], swapRB=True, crop=False)
-    detector.setInput(blob)
+    # Prepare the input blob in a reused buffer, then run inference on a
+    # detector nobody else is using
+    with engine.input_buffer() as buffer:
+        with stage('blob'):
+            blob = buffer.fill([frame])
+        with detector_pool.acquire() as detector:
+            check_frame()
+            with stage('forward'):
+                detections = engine.forward(detector, blob)
     
-    # Run inference
-    detections = detector.forward()
+    # Process detections
+    with stage('postprocess'):
+        return parse_detections(detections[0, 0], width, height, params)
+
+def dnn_detect_batch(frames, params=None):
+    """Detect objects in several frames with a single forward pass.
     
-    results = []
+    Returns a list of detection lists in input order.
+    """
+    if params is None:
+        params = detection_params()
+    # Run inference once for the whole batch
+    with engine.input_buffer() as buffer:
+        with stage('blob'):
+            blob = buffer.fill(frames)
+        with detector_pool.acquire() as detector:
+            check_frame()
+            with stage('forward'):
+                detections = engine.forward(detector, blob)
     
-    # Process detections
-    for i in range(detections.shape[2]):
-        confidence = detections[0, 0, i, 2]
+    with stage('postprocess'):
+        return split_batch_detections(detections, frames, params)
+
+def detect_frames(frames, params_list, session_ids=None):
+    """Detect a batch of decoded frames in-process, one params dict (and session id) per frame"""
+    if mock_mode:
+        return mock_detector.detect_batch(frames, params_list, session_ids)
+    return dnn_detect_batch(frames, params_list)
+
+def decode_image(data):
+    """Decode encoded image bytes, returns None if they are not a valid image"""
+    import cv2
+    
+    nparr = np.frombuffer(data, np.uint8)
+    if nparr.size == 0:
+        return None
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+# Raw pixel upload formats -> (bytes per pixel, name of the cv2 conversion to BGR or None)
+RAW_FORMATS = {
+    'bgr': (3, None),
+    'rgb': (3, 'COLOR_RGB2BGR'),
+    'nv12': (1.5, 'COLOR_YUV2BGR_NV12'),
+    'i420': (1.5, 'COLOR_YUV2BGR_I420'),
+}
+
+def decode_image_full(data):
+    """Decode image bytes at full resolution, as (frame, 1) like decode_image_reduced"""
+    return decode_image(data), 1
+
+def raw_frame(data, width, height, pixel_format):
+    """Wrap raw pixel bytes as a BGR frame without cv2.imdecode.
+    
+    BGR buffers are reshaped in place with no copy; RGB and YUV buffers need
+    one colour conversion. Raises ValueError if the size does not match.
+    """
+    if pixel_format not in RAW_FORMATS:
+        raise ValueError(f"Unsupported frame format: {pixel_format} (use {', '.join(RAW_FORMATS)})")
+    if width <= 0 or height <= 0:
+        raise ValueError('Frame width and height must be positive')
+    
+    bytes_per_pixel, conversion = RAW_FORMATS[pixel_format]
+    if bytes_per_pixel == 1.5 and (width % 2 or height % 2):
+        raise ValueError('YUV 4:2:0 frames need even width and height')
+    expected = int(width * height * bytes_per_pixel)
+    if len(data) != expected:
+        raise ValueError(f'Expected {expected} bytes for {width}x{height} {pixel_format}, got {len(data)}')
+    
+    buf = np.frombuffer(data, np.uint8)
+    if bytes_per_pixel == 3:
+        frame = buf.reshape(height, width, 3)
+    else:
+        frame = buf.reshape(height * 3 // 2, width)
+    
+    if conversion is None:
+        return frame
+    
+    import cv2
+    return cv2.cvtColor(frame, getattr(cv2, conversion))
+
+def raw_upload_from_request():
+    """Read a raw pixel upload, returns (data, width, height, format)"""
+    try:
+        width = int(request.headers.get('X-Frame-Width', ''))
+        height = int(request.headers.get('X-Frame-Height', ''))
+    except ValueError:
+        raise ValueError('X-Frame-Width and X-Frame-Height headers are required')
+    pixel_format = request.headers.get('X-Frame-Format', 'bgr').lower()
+    return request.get_data(cache=False), width, height, pixel_format
+
+def decode_image_reduced(data):
+    """Decode image bytes at the smallest JPEG scale that covers the model input.
+    
+    Returns (frame, factor) where factor maps frame pixels back to the
+    original image. Non-JPEG images are decoded at full size.
+    """
+    factor = 1
+    if app.config['REDUCED_DECODE']:
+        size = jpeg_size(data)
+        if size:
+            factor = reduced_decode_factor(*size, min_size=engine.input_size)
+    
+    if factor == 1:
+        return decode_image(data), 1
+    
+    import cv2
+    flag = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}[factor]
+    return cv2.imdecode(np.frombuffer(data, np.uint8), flag), factor
+
+def detection_job(data, params, session_id=None, track=False, decoder=None, key_extra=b'', info=None):
+    """Detection of encoded image bytes, to run with run_job() or on the pipeline.
+    
+    Once run, job['detections'] holds the detections (None if the bytes
+    are not a valid image) and job['source'] is 'cache', 'motion',
+    'tracker' or 'inference'. A hit on the upload hash skips both decode
+    and inference; with a session id, frames that barely changed reuse the
+    session's last result, and tracked sessions only run the model on
+    keyframes. Large JPEGs are decoded at reduced size and boxes scaled
+    back afterwards, except for tiled detection, which needs the full
+    resolution. decoder(data) -> (frame, factor) replaces image decoding
+    for raw uploads. info receives the number of tiles the model ran on
+    and the image size once the frame has been decoded.
+    """
+    if mock_mode and session_id:
+        # Mock detections come from the session's own stream, so sessions never share cached results
+        key_extra += b'\0session:' + session_id.encode()
+    return {
+        'data': data,
+        'params': params,
+        'session_id': session_id,
+        'tracked': bool(session_id and track),
+        'decoder': decoder,
+        'key_extra': key_extra,
+        'info': info if info is not None else {},
+        'start_ns': time.perf_counter_ns(),
+        'detections': None,
+        'source': None,
+    }
+
+def run_job(job):
+    """Run a detection job start to finish on the calling thread"""
+    if prepare_frame(job):
+        return
+    if job['tracked']:
+        detections, job['source'] = track_frame(job['frame'], job['params'], job['session_id'], job['info'])
+        job['detections'] = scale_detections(detections, job['factor'])
+        return
+    finish_detection(job, run_detection(job['frame'], job['params'], job['info']))
+
+def prepare_frame(job):
+    """Cache lookup, decode and motion check; returns True if the job needs no inference.
+    
+    Otherwise job['frame'] holds the decoded frame for run_detection() or
+    the pipeline, followed by finish_detection().
+    """
+    data, params, session_id = job['data'], job['params'], job['session_id']
+    
+    job['key'] = None
+    if result_cache and not job['tracked']:
+        with stage('cache'):
+            job['key'] = content_key(data, params, job['key_extra'])
+            cached = result_cache.get(job['key'])
+        if cached is not None:
+            (job['detections'], job['info']['size']), job['source'] = cached, 'cache'
+            return True
+    
+    check_frame()
+    with stage('decode'):
+        decoder = job['decoder']
+        if decoder is None:
+            decoder = decode_image_full if params.get('tiled') else decode_image_reduced
+        frame, factor = decoder(data)
+    if frame is None:
+        return True
+    job['frame'], job['factor'] = frame, factor
+    # From the decoded frame, so EXIF rotation is accounted for; the JPEG header has the stored size
+    job['info']['size'] = (frame.shape[1] * factor, frame.shape[0] * factor)
+    
+    if job['tracked']:
+        return False
+    
+    if session_id:
+        job['fingerprint'] = params_fingerprint(params)
+        with stage('motion'):
+            detections, _, job['thumb'] = motion_gate.check(session_id, frame, job['fingerprint'])
+        if detections is not None:
+            job['detections'], job['source'] = scale_detections(detections, factor), 'motion'
+            return True
+    
+    job['phash_key'] = None
+    if result_cache and app.config['RESULT_CACHE_PHASH']:
+        with stage('cache'):
+            job['phash_key'] = perceptual_key(frame, params, job['key_extra'])
+            cached = result_cache.get(job['phash_key'])
+        if cached is not None:
+            result_cache.put(job['key'], cached)
+            job['detections'], job['source'] = cached[0], 'cache'
+            return True
+    return False
+
+def finish_detection(job, detections):
+    """Record a job's inference result with the motion gate and cache"""
+    if job['session_id']:
+        motion_gate.update(job['session_id'], job['frame'], job['thumb'], job['fingerprint'], detections)
+    
+    detections = scale_detections(detections, job['factor'])
+    if result_cache:
+        # Cached with the image size, so cache hits normalize without decoding
+        entry = (detections, job['info']['size'])
+        result_cache.put(job['key'], entry)
+        if job['phash_key']:
+            result_cache.put(job['phash_key'], entry)
+    job['detections'], job['source'] = detections, 'inference'
+    job['frame'] = None
+
+def source_size(data, info):
+    """(width, height) of the uploaded image as decoded, decoding it only if nothing recorded it"""
+    size = info.get('size')
+    if size is None:
+        frame = decode_image(data)
+        size = (frame.shape[1], frame.shape[0])
+    return size
+
+def output_detections(detections, params, data, info):
+    """Result dicts as the client asked for them: pixels, or normalized to the image size"""
+    if not params['normalized']:
+        return detection_dicts(detections)
+    return normalize_detections(detections, *source_size(data, info))
+
+def detect_decoded(frame, params):
+    """Result dicts for an already decoded frame, normalized if requested"""
+    detections = run_detection(frame, params)
+    if params['normalized']:
+        return normalize_detections(detections, frame.shape[1], frame.shape[0])
+    return detection_dicts(detections)
+
+def track_frame(frame, params, session_id, info=None):
+    """Detect on keyframes and propagate the session's tracks in between"""
+    tracker = tracker_registry.get(session_id)
+    
+    with tracker.lock:
+        with stage('track'):
+            gray = tracker.prepare(frame)
+        if not tracker.needs_detection(frame):
+            with stage('track'):
+                confidence = tracker.propagate(gray)
+            if confidence >= tracker.min_confidence:
+                return tracker.results(), 'tracker'
+            tracker.force_detection()
         
-        if confidence > 0.5:  # Confidence threshold
-            class_id = int(detections[0, 0, i, 1])
-            if class_id < len(COCO_CLASSES):
-                # Get bbox coordinates
-                x1 = int(detections[0, 0, i, 3] * width)
-                y1 = int(detections[0, 0, i, 4] * height)
-                x2 = int(detections[0, 0, i, 5] * width)
-                y2 = int(detections[0, 0, i, 6] * height)
-                
-                results.append({
-                    'label': COCO_CLASSES[class_id],
-                    'confidence': round(float(confidence), 2),
-                    'bbox': [x1, y1, x2 - x1, y2 - y1]
-                })
+        detections = run_detection(frame, params, info)
+        return tracker.on_detections(frame, gray, detection_dicts(detections)), 'inference'
+
+def tracking_requested(values):
+    """Whether the client asked for keyframe tracking"""
+    return str(values.get('track', '')).lower() in ('1', 'true', 'yes', 'on')
+
+def session_id_from(values, headers):
+    """Client session id from a form/query field or the X-Session-Id header"""
+    session_id = values.get('session') or headers.get('X-Session-Id')
+    return session_id[:128] if session_id else None
+
+def client_key(session_id):
+    """Who sent a frame, for counting active clients: the session id, else the remote address"""
+    if session_id:
+        return session_id
+    return request.remote_addr if has_request_context() else None
+
+def run_detection(frame, params, info=None):
+    """Run detection on a decoded frame with whichever backend is active, once it is the session's turn"""
+    check_frame()
+    with inference_turn(detection_cost(frame, params)):
+        return run_inference(frame, params, info)
+
+def run_inference(frame, params, info=None):
+    """Run detection on a decoded frame with whichever backend is active"""
+    if params.get('tiled'):
+        return detect_tiled(frame, params, info)
+    if info is not None:
+        info['tiles'] = 1
+    if worker_pool:
+        # Blob, forward and post-process all happen in the worker process
+        with stage('inference'):
+            return worker_pool.detect(frame, params, current_session())
+    if batch_scheduler:
+        # Blob, forward and post-process run on the scheduler's thread
+        start = time.perf_counter_ns()
+        frame_ticket = current_frame()
+        ticket = batch_scheduler.submit(frame, params, frame_ticket.check if frame_ticket else None,
+                                        current_session())
+        detections = batch_scheduler.result(ticket)
+        record('queue', ticket['queued_ns'])
+        record('inference', time.perf_counter_ns() - start - ticket['queued_ns'])
+        return detections
+    if mock_mode:
+        with stage('forward'):
+            return mock_detector.detect(frame, params, current_session())
+    return dnn_detect(frame, params)
+
+def detect_tiled(frame, params, info=None):
+    """Detect on overlapping tiles plus the whole frame in one batch, merged into frame coordinates"""
+    height, width = frame.shape[:2]
+    tiles = tile_grid(width, height, app.config['TILE_SIZE'], app.config['TILE_OVERLAP'], app.config['TILE_MAX'])
+    if len(tiles) == 1:
+        return run_inference(frame, {**params, 'tiled': False}, info)
+    if info is not None:
+        info['tiles'] = len(tiles)
+    
+    # The whole-frame view still finds objects too large for any one tile
+    regions = tiles + [(0, 0, width, height)]
+    crops = [frame[y:y + h, x:x + w] for x, y, w, h in regions]
+    if worker_pool:
+        # The pool shrinks each crop, the whole-frame view too, to the model input and maps boxes back
+        with stage('inference'):
+            tickets = [worker_pool.submit(crop, params, current_session()) for crop in crops]
+            tile_detections = [worker_pool.result(ticket) for ticket in tickets]
+    elif mock_mode:
+        with stage('forward'):
+            tile_detections = mock_detector.detect_batch(crops, params, current_session())
+    else:
+        tile_detections = dnn_detect_batch(crops, params)
     
-    return results
+    with stage('merge'):
+        return merge_tile_detections(tile_detections, regions, params)
+
+def pipelined(job):
+    """Whether a job can run on the pipeline; tracked and tiled frames stay on the request thread"""
+    return pipeline is not None and not job['tracked'] and not job['params'].get('tiled')
+
+def pipeline_decode(job):
+    """Pipeline stage: cache lookup, decode and motion check"""
+    job['done'] = prepare_frame(job)
+
+def pipeline_preprocess(job):
+    """Pipeline stage: model input blob, in a buffer held until inference has run"""
+    if mock_mode:
+        return
+    buffer = engine.take_input_buffer()
+    try:
+        with stage('blob'):
+            job['blob'] = buffer.fill([job['frame']])
+    except Exception:
+        engine.give_input_buffer(buffer)
+        raise
+    job['buffer'] = buffer
+
+def pipeline_inference(job):
+    """Pipeline stage: forward pass and post-processing"""
+    frame, params = job['frame'], job['params']
+    job['info']['tiles'] = 1
+    if mock_mode:
+        check_frame()
+        with inference_turn(), stage('forward'):
+            detections = mock_detector.detect(frame, params, current_session())
+    else:
+        try:
+            with inference_turn(), detector_pool.acquire() as detector:
+                check_frame()
+                with stage('forward'):
+                    output = engine.forward(detector, job['blob'])
+        finally:
+            engine.give_input_buffer(job.pop('buffer'))
+            job['blob'] = None
+        with stage('postprocess'):
+            detections = parse_detections(output[0, 0], frame.shape[1], frame.shape[0], params)
+    finish_detection(job, detections)
+
+def pipeline_serialize(job):
+    """Pipeline stage: the reply body, built by the job's serialize(job)"""
+    with stage('serialize'):
+        job['body'] = job['serialize'](job)
+
+def detection_cost(frame, params):
+    """Frames the model runs for one detection: the tiles plus the whole frame when tiled"""
+    if not params.get('tiled'):
+        return 1
+    height, width = frame.shape[:2]
+    return tiled_forwards(width, height)
+
+def tiled_forwards(width, height):
+    """Forward passes for a tiled frame of this size, a single one if it fits in one tile"""
+    tiles = tile_grid(width, height, app.config['TILE_SIZE'], app.config['TILE_OVERLAP'], app.config['TILE_MAX'])
+    return 1 if len(tiles) == 1 else len(tiles) + 1
+
+@contextmanager
+def inference_turn(cost=1):
+    """Wait for the current session's turn at the fair scheduler, a no-op without one"""
+    if fair_scheduler is None:
+        yield
+        return
+    frame_ticket = current_frame()
+    with fair_scheduler.turn(current_session(), cost, frame_ticket.check if frame_ticket else None) as waited_ns:
+        record('schedule', waited_ns)
+        yield
+
+def current_session():
+    """Session id of the frame being handled, None outside admit() or without one"""
+    ticket = current_frame()
+    return ticket.session_id if ticket else None
+
+def deadline_from(values, headers, started):
+    """Absolute monotonic deadline from deadline_ms or X-Deadline-Ms, None for no deadline.
+    
+    The budget counts from started, the time.monotonic() the request began.
+    Raises ValueError on bad input.
+    """
+    value = values.get('deadline_ms') or headers.get('X-Deadline-Ms') or app.config['DEFAULT_DEADLINE_MS']
+    deadline_ms = float(value)
+    if deadline_ms < 0:
+        raise ValueError('deadline_ms must not be negative')
+    return started + deadline_ms / 1000.0 if deadline_ms else None
+
+def latest_only_requested(values, headers):
+    """Whether older in-flight frames of the session should give way to this one"""
+    value = values.get('latest') or headers.get('X-Latest-Only', '')
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+def packed_requested():
+    """Whether the client's Accept header prefers packed binary detections over JSON"""
+    return request.accept_mimetypes.best_match(['application/json', PACKED_MIMETYPE]) == PACKED_MIMETYPE
+
+def packed_flags(source):
+    """wire_format header flags for a result from source"""
+    return (
+        (FLAG_MOCK if mock_mode else 0)
+        | (FLAG_CACHED if source == 'cache' else 0)
+        | (FLAG_REUSED if source == 'motion' else 0)
+        | (FLAG_TRACKED if source == 'tracker' else 0)
+    )
+
+def detect_body(job, packed):
+    """/detect reply body for a finished job: packed columns (see wire_format) or JSON"""
+    detections, source, info = job['detections'], job['source'], job['info']
+    if detections is None:
+        return None
+    latency_ms = round((time.perf_counter_ns() - job['start_ns']) / 1e6, 2)
+    if packed:
+        size = source_size(job['data'], info) if job['params']['normalized'] else None
+        return pack_detections(detections, latency_ms, packed_flags(source), info.get('tiles'), size)
+    return app.json.dumps({
+        'detections': output_detections(detections, job['params'], job['data'], info),
+        'normalized': job['params']['normalized'],
+        'latency_ms': latency_ms,
+        'mock_mode': mock_mode,
+        'cached': source == 'cache',
+        'reused': source == 'motion',
+        'tracked': source == 'tracker',
+        'tiles': info.get('tiles')
+    })
+
+def dropped_response(error):
+    """Response for a frame shed because it expired, was superseded or was throttled"""
+    return jsonify({'error': str(error), 'dropped': True, 'reason': error.reason}), DROPPED_STATUS
+
+def busy_response(error):
+    """503 response telling the client to back off while all detectors are busy"""
+    response = jsonify({'error': str(error)})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(error):
+    """JSON 413 like the API's other errors when an upload exceeds MAX_CONTENT_LENGTH"""
+    return jsonify({'error': f"Upload larger than {app.config['MAX_CONTENT_LENGTH']} bytes"}), 413
+
+@app.before_request
+def require_warm_detector():
+    """Turn detection requests away until the model has loaded and warmed up"""
+    if request.endpoint in DETECTION_ENDPOINTS and not model_ready.is_set():
+        return busy_response(f"Detector is {startup['state']}, retry shortly")
+
+@app.before_request
+def start_stage_timer():
+    """Time the stages of detection requests"""
+    if request.endpoint in TIMED_ENDPOINTS:
+        g.stage_timer = StageTimer()
+        g.stage_timer_token = activate(g.stage_timer)
+
+@app.after_request
+def add_server_timing(response):
+    """Report stage timings to the client and record them for /metrics"""
+    timer = g.pop('stage_timer', None)
+    if timer is not None:
+        response.headers['Server-Timing'] = timer.server_timing()
+        metrics_registry.observe_timer(timer, request.url_rule.rule, response.status_code)
+    return response
+
+@app.teardown_request
+def stop_stage_timer(exc):
+    token = g.pop('stage_timer_token', None)
+    if token is not None:
+        deactivate(token)
 
 @app.route('/')
 def index():
@@ -125,53 +958,540 @@ def index():
 @app.route('/detect', methods=['POST'])
 def detect():
     """Process image and return detections"""
+    started = time.monotonic()
     try:
-        if 'frame' not in request.files:
-            return jsonify({'error': 'No frame provided'}), 400
+        decoder = None
+        key_extra = b''
+        info = {}
+        
+        if request.mimetype == 'application/octet-stream':
+            # Raw pixels: dimensions and format come from headers
+            try:
+                with stage('read'):
+                    data, width, height, pixel_format = raw_upload_from_request()
+                with stage('decode'):
+                    frame = raw_frame(data, width, height, pixel_format)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            decoder = lambda _: (frame, 1)
+            key_extra = f'{width}x{height}:{pixel_format}'.encode()
+            info['size'] = (width, height)
+        else:
+            # Parsing the multipart body is where the upload is read
+            with stage('read'):
+                files = request.files
+            if 'frame' not in files:
+                return jsonify({'error': 'No frame provided'}), 400
+            
+            file = files['frame']
+            if file.filename == '':
+                return jsonify({'error': 'Empty file'}), 400
+            
+            # Read image
+            with stage('read'):
+                data = file.read()
         
-        file = request.files['frame']
-        if file.filename == '':
-            return jsonify({'error': 'Empty file'}), 400
+        try:
+            params = detection_params(request.values)
+            deadline = deadline_from(request.values, request.headers, started)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Read image
-        nparr = np.frombuffer(file.read(), np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        # Run detection (cache hits skip decode and inference)
+        session_id = session_id_from(request.values, request.headers)
+        job = detection_job(data, params, session_id, tracking_requested(request.values), decoder, key_extra, info)
+        packed = packed_requested()
+        with admission.admit(deadline, session_id, latest_only_requested(request.values, request.headers),
+                             client_key(session_id)):
+            if pipelined(job):
+                # Decode, inference and serialization run on the pipeline's stage threads
+                job['serialize'] = lambda job: detect_body(job, packed)
+                pipeline.run(job)
+            else:
+                run_job(job)
         
-        if frame is None:
+        if job['detections'] is None:
             return jsonify({'error': 'Invalid image'}), 400
         
-        # Run detection
-        start_time = datetime.now()
-        
-        if mock_mode:
-            detections = mock_detect(frame)
-        else:
-            detections = dnn_detect(frame)
+        if 'body' not in job:
+            with stage('serialize'):
+                job['body'] = detect_body(job, packed)
+        response = Response(job['body'], mimetype=PACKED_MIMETYPE if packed else 'application/json')
+        response.vary.add('Accept')
+        return response, 200
+    
+    except FrameDropped as e:
+        return dropped_response(e)
+    except DetectorBusyError as e:
+        return busy_response(e)
+    except HTTPException:
+        # e.g. 413 for an upload over MAX_CONTENT_LENGTH
+        raise
+    except Exception as e:
+        logger.error(f"Detection error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/detect/batch', methods=['POST'])
+def detect_batch():
+    """Process several frames in one request and return per-frame detections"""
+    started = time.monotonic()
+    try:
+        with stage('read'):
+            files = request.files.getlist('frames')
+        if not files:
+            return jsonify({'error': 'No frames provided'}), 400
         
-        latency_ms = int((datetime.now() - start_time).total_seconds() * 1000)
+        if len(files) > app.config['MAX_BATCH_FRAMES']:
+            return jsonify({
+                'error': f"Too many frames (max {app.config['MAX_BATCH_FRAMES']})"
+            }), 400
         
-        return jsonify({
-            'detections': detections,
-            'latency_ms': latency_ms,
-            'mock_mode': mock_mode
-        }), 200
+        try:
+            params = detection_params(request.values)
+            deadline = deadline_from(request.values, request.headers, started)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
+        session_id = session_id_from(request.values, request.headers)
+        with admission.admit(deadline, session_id, client=client_key(session_id)):
+            # Decode every frame, keeping per-frame decode time
+            frames = []
+            factors = []
+            sizes = []
+            decode_ms = []
+            for index, file in enumerate(files):
+                with stage('read'):
+                    data = file.read()
+                decode_start = time.perf_counter()
+                with stage('decode'):
+                    frame, factor = decode_image_reduced(data)
+                if frame is None:
+                    return jsonify({'error': f'Invalid image at index {index}'}), 400
+                frames.append(frame)
+                factors.append(factor)
+                sizes.append((frame.shape[1] * factor, frame.shape[0] * factor))
+                decode_ms.append((time.perf_counter() - decode_start) * 1000)
+            
+            # Frames may have expired while the upload was decoded
+            check_frame()
+            
+            # Run detection
+            start_time = time.perf_counter()
+            
+            with inference_turn(len(frames)):
+                if worker_pool:
+                    with stage('inference'):
+                        tickets = [worker_pool.submit(frame, params, session_id) for frame in frames]
+                        batch_detections = [worker_pool.result(ticket) for ticket in tickets]
+                elif mock_mode:
+                    with stage('forward'):
+                        batch_detections = mock_detector.detect_batch(frames, params, session_id)
+                else:
+                    batch_detections = dnn_detect_batch(frames, params)
+            
+            batch_ms = (time.perf_counter() - start_time) * 1000
+            per_frame_ms = batch_ms / len(frames)
+            
+            results = []
+            for index, detections in enumerate(batch_detections):
+                detections = scale_detections(detections, factors[index])
+                if params['normalized']:
+                    detections = normalize_detections(detections, *sizes[index])
+                else:
+                    detections = detection_dicts(detections)
+                results.append({
+                    'index': index,
+                    'detections': detections,
+                    'latency_ms': round(decode_ms[index] + per_frame_ms, 2)
+                })
+            
+            with stage('serialize'):
+                response = jsonify({
+                    'results': results,
+                    'batch_size': len(frames),
+                    'latency_ms': int(batch_ms),
+                    'mock_mode': mock_mode
+                })
+            return response, 200
+    
+    except FrameDropped as e:
+        return dropped_response(e)
+    except DetectorBusyError as e:
+        return busy_response(e)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Detection error: {str(e)}")
+        logger.error(f"Batch detection error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/detect/video', methods=['POST'])
+def detect_video_file():
+    """Detect objects in a video file, streaming one NDJSON line per processed frame.
+    
+    The video is either uploaded as the `video` field or named by `path`
+    relative to VIDEO_ROOT. `stride` runs detection on every Nth frame and
+    `max_frames` stops early; detection parameters apply as for /detect.
+    The whole stream counts as one request against MAX_IN_FLIGHT.
+    """
+    try:
+        params = detection_params(request.values)
+        stride = int(request.values.get('stride', 1))
+        max_frames = request.values.get('max_frames')
+        max_frames = int(max_frames) if max_frames else None
+        if stride < 1 or (max_frames is not None and max_frames < 1):
+            raise ValueError('stride and max_frames must be at least 1')
+        path, temporary = video_source()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        capture = open_video(path)
+    except ValueError as e:
+        if temporary:
+            os.remove(path)
+        return jsonify({'error': str(e)}), 400
+    
+    def stream():
+        # The stream owns the capture: closing it joins the decoder thread before the release
+        try:
+            session_id = session_id_from(request.values, request.headers)
+            with admission.admit(session_id=session_id, client=client_key(session_id)):
+                yield None
+                yield from ndjson(detect_video(capture, lambda frame: detect_decoded(frame, params),
+                                               stride, max_frames, app.config['VIDEO_PREFETCH']))
+        finally:
+            capture.release()
+            if temporary and os.path.exists(path):
+                os.remove(path)
+    
+    # Start the stream up to admission, so an overloaded server answers 503 before any output
+    lines = stream()
+    try:
+        next(lines)
+    except DetectorBusyError as e:
+        return busy_response(e)
+    return Response(lines, mimetype='application/x-ndjson')
+
+def video_source():
+    """Path of the video to process and whether it is a temporary upload"""
+    upload = request.files.get('video')
+    if upload and upload.filename:
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        suffix = os.path.splitext(upload.filename)[1]
+        with tempfile.NamedTemporaryFile(dir=app.config['UPLOAD_FOLDER'], suffix=suffix, delete=False) as f:
+            upload.save(f)
+        return f.name, True
+    
+    name = request.values.get('path')
+    if not name:
+        raise ValueError('No video provided')
+    if not app.config['VIDEO_ROOT']:
+        raise ValueError('Server-side video paths are disabled (set VIDEO_ROOT)')
+    root = os.path.realpath(app.config['VIDEO_ROOT'])
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        raise ValueError(f'Video not found: {name}')
+    return path, False
+
+# Stream frame header: big-endian uint32 sequence number
+STREAM_HEADER = struct.Struct('>I')
+
+@sock.route('/detect/stream')
+def detect_stream(ws):
+    """Persistent WebSocket detection channel.
+    
+    Binary messages carry a 4-byte big-endian sequence number followed by an
+    encoded image. Text messages carry a JSON object of detection parameters
+    applied to the frames that follow. Every frame is answered with a JSON
+    text message echoing its sequence number. Frames that queued up while
+    the previous one was in inference are answered as dropped, so only the
+    newest frame is processed.
+    """
+    params = detection_params()
+    session_id = session_id_from(request.args, request.headers)
+    track = tracking_requested(request.args)
+    
+    while True:
+        message = ws.receive()
+        if isinstance(message, str):
+            params = update_stream_params(ws, message, params)
+            continue
+        
+        # Latest frame wins: answer frames that queued up behind this one as dropped
+        while True:
+            newer = ws.receive(timeout=0)
+            if newer is None:
+                break
+            if isinstance(newer, str):
+                params = update_stream_params(ws, newer, params)
+                continue
+            ws.send(json.dumps({'seq': stream_seq(message), 'dropped': True}))
+            message = newer
+        
+        ws.send(json.dumps(detect_stream_frame(message, params, session_id, track)))
+
+def stream_seq(message):
+    """Sequence number of a binary stream frame, None if the header is missing"""
+    if len(message) < STREAM_HEADER.size:
+        return None
+    return STREAM_HEADER.unpack_from(message)[0]
+
+def update_stream_params(ws, message, params):
+    """Apply a JSON parameter message, keeping the old parameters on error"""
+    try:
+        values = json.loads(message)
+        if not isinstance(values, dict):
+            raise ValueError('Parameters must be a JSON object')
+        return detection_params(values)
+    except ValueError as e:
+        ws.send(json.dumps({'error': str(e)}))
+        return params
+
+def detect_stream_frame(message, params, session_id=None, track=False):
+    """Run detection on one binary stream frame and build its reply"""
+    seq = stream_seq(message)
+    if seq is None:
+        return {'seq': None, 'error': 'Missing sequence header'}
+    
+    timer = StageTimer()
+    token = activate(timer)
+    try:
+        job = detection_job(memoryview(message)[STREAM_HEADER.size:], params, session_id, track)
+        with admission.admit(session_id=session_id, client=client_key(session_id)):
+            if pipelined(job):
+                job['serialize'] = lambda job: stream_reply(job, seq)
+                pipeline.run(job)
+            else:
+                run_job(job)
+        
+        reply = job['body'] if 'body' in job else stream_reply(job, seq)
+        if job['detections'] is not None:
+            metrics_registry.observe_timer(timer, '/detect/stream', 200)
+        return reply
+    except FrameDropped as e:
+        return {'seq': seq, 'dropped': True, 'reason': e.reason}
+    except DetectorBusyError as e:
+        return {'seq': seq, 'error': str(e), 'busy': True}
+    except Exception as e:
+        logger.error(f"Stream detection error: {str(e)}")
+        return {'seq': seq, 'error': str(e)}
+    finally:
+        deactivate(token)
+
+def stream_reply(job, seq):
+    """Reply to a stream frame once its detection job has finished"""
+    detections, source, info = job['detections'], job['source'], job['info']
+    if detections is None:
+        return {'seq': seq, 'error': 'Invalid image'}
+    return {
+        'seq': seq,
+        'detections': output_detections(detections, job['params'], job['data'], info),
+        'normalized': job['params']['normalized'],
+        'latency_ms': round((time.perf_counter_ns() - job['start_ns']) / 1e6, 2),
+        'mock_mode': mock_mode,
+        'cached': source == 'cache',
+        'reused': source == 'motion',
+        'tracked': source == 'tracker',
+        'tiles': info.get('tiles')
+    }
+
 @app.route('/mode', methods=['GET'])
 def get_mode():
     """Get current detection mode"""
-    return jsonify({'mock_mode': mock_mode}), 200
+    return jsonify({
+        'mock_mode': mock_mode,
+        'mock': mock_detector.stats() if mock_mode else None,
+        'state': startup['state'],
+        'engine': engine.stats(),
+        'detector_pool': detector_pool.stats() if detector_pool else None,
+        'inference_workers': worker_pool.stats() if worker_pool else None,
+        'batch_scheduler': batch_scheduler.stats() if batch_scheduler else None,
+        'pipeline': pipeline.stats() if pipeline else None,
+        'admission': admission.stats(),
+        'fair_scheduler': fair_scheduler.stats() if fair_scheduler else None,
+        'result_cache': result_cache.stats() if result_cache else None,
+        'motion_gate': motion_gate.stats(),
+        'tracking': tracker_registry.stats()
+    }), 200
+
+@app.route('/capabilities', methods=['GET'])
+def get_capabilities():
+    """What clients should send: model input size, encodings, and a target resolution and frame rate.
+    
+    Both suggestions come from the measured per-frame inference time,
+    which gives the frames per second the backend can run, split between
+    the clients active over the last few seconds. Frames larger than the
+    model input are only shrunk again on the server, so the suggested
+    resolution is the input size. With tiling on, full resolution is
+    suggested instead while each client can still afford a tiled frame's
+    forward passes at SUGGESTED_MIN_FPS. Those are counted from the tile
+    grid of the client's native width and height if it passes them, else
+    TILE_MAX tiles plus the whole frame. The frame rate stays within the
+    FPS cap of the session given as session or X-Session-Id.
+    """
+    native = None
+    if 'width' in request.args or 'height' in request.args:
+        try:
+            native = int(request.args['width']), int(request.args['height'])
+        except (KeyError, ValueError):
+            native = None
+        if native is None or min(native) < 1:
+            return jsonify({'error': 'width and height must both be positive integers'}), 400
+    
+    width, height = engine.input_size
+    tiling = str(app.config['TILING']).lower() in ('1', 'true', 'yes', 'on')
+    forwards = tiled_forwards(*native) if native else app.config['TILE_MAX'] + 1
+    inference = inference_latency_ms()
+    clients = admission.active_clients()
+    capacity = client_capacity_fps(inference, clients)
+    full_resolution = tiling and (capacity is None or capacity / forwards >= app.config['SUGGESTED_MIN_FPS'])
+    fps = suggested_fps(capacity, forwards if full_resolution else 1)
+    session_id = session_id_from(request.args, request.headers)
+    fps_cap = fair_scheduler.fps_cap(session_id) if fair_scheduler and session_id else None
+    if fps_cap:
+        fps = min(fps, fps_cap)
+    return jsonify({
+        'ready': model_ready.is_set(),
+        'mock_mode': mock_mode,
+        'engine': engine.name,
+        'input_size': [width, height],
+        'encodings': ['image/jpeg', 'image/png', 'application/octet-stream'],
+        'raw_formats': list(RAW_FORMATS),
+        'preferred_encoding': 'image/jpeg',
+        'response_formats': ['application/json', PACKED_MIMETYPE],
+        'normalized_coordinates': True,
+        'tiling': tiling,
+        'suggested': {
+            'width': None if full_resolution else width,
+            'height': None if full_resolution else height,
+            'fps': fps,
+        },
+        'fps_cap': fps_cap,
+        'active_clients': clients,
+        'inference_ms': inference,
+        'latency_ms': request_latency_ms(),
+    }), 200
+
+def inference_slots():
+    """How many frames the active backend can run at once"""
+    if worker_pool:
+        return worker_pool.workers
+    if detector_pool:
+        return detector_pool.size
+    return 1
+
+def latency_summary(recent):
+    """Median and p95 in milliseconds of durations in seconds, None without any"""
+    if not len(recent):
+        return None
+    return {
+        'p50': round(float(np.percentile(recent, 50)) * 1000, 2),
+        'p95': round(float(np.percentile(recent, 95)) * 1000, 2),
+        'samples': len(recent),
+    }
+
+def request_latency_ms():
+    """Median and p95 of recent successful detection requests, None before any were served"""
+    return latency_summary(metrics_registry.recent_request_seconds(('/detect', '/detect/stream'), '200'))
+
+def inference_latency_ms():
+    """Median and p95 of recent per-frame model time, None before any frame went through the model"""
+    return latency_summary(metrics_registry.recent_stage_seconds(('forward', 'inference')))
+
+def client_capacity_fps(inference, clients):
+    """Frames per second the backend can run for each of clients, None before any inference"""
+    if inference is None or inference['p50'] <= 0:
+        return None
+    return inference_slots() * 1000.0 / (inference['p50'] * max(1, clients))
+
+def suggested_fps(capacity, forwards=1):
+    """Frame rate for a client with capacity frames/s whose frames take forwards model passes each"""
+    low, high = app.config['SUGGESTED_MIN_FPS'], app.config['SUGGESTED_MAX_FPS']
+    if capacity is None:
+        return high
+    return round(min(high, max(low, capacity / forwards)), 1)
+
+@app.route('/ready', methods=['GET'])
+def get_ready():
+    """Readiness probe: 200 once the detector is warm, 503 before"""
+    response = jsonify({
+        'ready': model_ready.is_set(),
+        'state': startup['state'],
+        'mock_mode': mock_mode,
+        'load_ms': startup['load_ms'],
+        'error': startup['error']
+    })
+    if model_ready.is_set():
+        return response, 200
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Stage latency histograms and component counters in Prometheus text format"""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+def component_metrics():
+    """Counters and gauges from the engine, admission, schedulers, pipeline, cache, motion gate and pool for /metrics"""
+    samples = []
+    if result_cache:
+        cache = result_cache.stats()
+        samples.append(('result_cache_hits_total', 'counter', 'Result cache hits', [({}, cache['hits'])]))
+        samples.append(('result_cache_misses_total', 'counter', 'Result cache misses', [({}, cache['misses'])]))
+    count, total = engine.latency()
+    samples.append(('engine_forwards_total', 'counter', 'Forward passes run by the detector engine',
+                    [({'engine': engine.name}, count)]))
+    samples.append(('engine_forward_seconds_total', 'counter', 'Time spent in detector engine forward passes',
+                    [({'engine': engine.name}, round(total, 9))]))
+    shedding = admission.stats()
+    samples.append(('requests_in_flight', 'gauge', 'Detection requests being handled', [({}, shedding['in_flight'])]))
+    samples.append(('requests_rejected_total', 'counter', 'Requests turned away by the in-flight cap',
+                    [({}, shedding['rejected'])]))
+    samples.append(('frames_dropped_total', 'counter', 'Frames dropped before inference',
+                    [({'reason': reason}, shedding[reason]) for reason in ('expired', 'superseded', 'throttled')]))
+    if fair_scheduler:
+        fair = fair_scheduler.stats()
+        sessions = [('', fair['anonymous'])] + list(fair['sessions'].items())
+        samples.append(('fair_scheduler_waiting', 'gauge', 'Frames waiting for their session\'s inference turn',
+                        [({}, fair['waiting'])]))
+        samples.append(('session_frames_served_total', 'counter', 'Frames given an inference turn, by session',
+                        [({'session': session_id}, entry['served']) for session_id, entry in sessions]))
+        samples.append(('session_frames_dropped_total', 'counter',
+                        'Frames throttled or dropped while waiting for a turn, by session',
+                        [({'session': session_id}, entry['dropped']) for session_id, entry in sessions]))
+    if batch_scheduler:
+        batching = batch_scheduler.stats()
+        samples.append(('batch_queue_depth', 'gauge', 'Frames waiting for a batch', [({}, batching['queue_depth'])]))
+        samples.append(('batches_total', 'counter', 'Batched forward passes by batch size',
+                        [({'size': size}, n) for size, n in batching['batch_sizes'].items()]))
+    if pipeline:
+        stages = pipeline.stats()['stages']
+        samples.append(('pipeline_queue_depth', 'gauge', 'Frames waiting in front of each pipeline stage',
+                        [({'stage': name}, entry['queue_depth']) for name, entry in stages.items()]))
+        samples.append(('pipeline_stage_occupancy', 'gauge', 'Busy share of each pipeline stage over the last 10s',
+                        [({'stage': name}, entry['occupancy']) for name, entry in stages.items()]))
+        samples.append(('pipeline_stage_busy_seconds_total', 'counter', 'Time pipeline stage threads spent working',
+                        [({'stage': name}, entry['busy_seconds']) for name, entry in stages.items()]))
+    gate = motion_gate.stats()
+    samples.append(('motion_gate_reused_total', 'counter', 'Frames answered by the motion gate', [({}, gate['reused'])]))
+    if detector_pool:
+        pool = detector_pool.stats()
+        samples.append(('detector_pool_in_use', 'gauge', 'Detectors running inference', [({}, pool['in_use'])]))
+        samples.append(('detector_pool_rejected_total', 'counter', 'Requests rejected while all detectors were busy',
+                        [({}, pool['rejected'])]))
+    return samples
+
+metrics_registry.add_collector(component_metrics)
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     """Serve static files"""
     return send_from_directory('static', filename)
 
-# Initialize detector on startup
-load_detector()
+# Load the detector in the background on startup (spawned inference workers
+# re-import this module as __mp_main__ and must not start workers of their own)
+if multiprocessing.current_process().name == 'MainProcess':
+    load_detector_in_background()
 
 if __name__ == '__main__':
     # Create necessary directories
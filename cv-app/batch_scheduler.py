@@ -0,0 +1,170 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+import numpy as np
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+class BatchScheduler:
+    """Groups concurrent single-frame requests into batched forward passes.
+    
+    A collector thread waits for a free runner, takes the oldest queued
+    frame and keeps collecting until window_ms has passed since that frame
+    arrived or max_batch frames are in hand. The batch goes to
+    run_batch(frames, params_list, session_ids), which returns one
+    detection list per frame, and every caller gets its own result back. While all runners
+    are busy frames pile up in the queue, so batches grow with load
+    instead of queueing one by one. A frame submitted with a check()
+    callable that raises by the time its batch forms is failed with that
+    error instead of taking a place in the batch.
+    """
+    
+    def __init__(self, run_batch, window_ms=5.0, max_batch=8, concurrency=1, timeout=30.0):
+        if max_batch < 1:
+            raise ValueError('max_batch must be at least 1')
+        
+        self.run_batch = run_batch
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._queue = Queue()
+        self._runners = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch-runner')
+        self._free_runners = threading.Semaphore(concurrency)
+        self._lock = threading.Lock()
+        self._batch_sizes = [0] * (max_batch + 1)  # index = batch size
+        self._queue_delay = Histogram()
+        self.dropped = 0
+        self.running = True
+        
+        self._collector = threading.Thread(target=self._collect_loop, name='batch-collector', daemon=True)
+        self._collector.start()
+        logger.info(f"Batch scheduler started (window {window_ms} ms, max batch {max_batch}, {concurrency} runner(s))")
+    
+    def submit(self, frame, params, check=None, session_id=None):
+        """Queue a frame, returns a ticket for result()"""
+        ticket = {
+            'frame': frame,
+            'params': params,
+            'session_id': session_id,
+            'check': check,
+            'event': threading.Event(),
+            'enqueued_ns': time.perf_counter_ns(),
+            'queued_ns': 0,
+            'result': None,
+            'error': None,
+        }
+        self._queue.put(ticket)
+        return ticket
+    
+    def result(self, ticket):
+        """Wait for a submitted frame's detections"""
+        if not ticket['event'].wait(self.timeout):
+            raise TimeoutError(f'Batched inference timed out after {self.timeout}s')
+        if ticket['error'] is not None:
+            raise ticket['error']
+        return ticket['result']
+    
+    def detect(self, frame, params, check=None, session_id=None):
+        """Run detection for one frame as part of whichever batch it lands in"""
+        return self.result(self.submit(frame, params, check, session_id))
+    
+    def _collect_loop(self):
+        """Form batches whenever a runner is free"""
+        while self.running:
+            self._free_runners.acquire()
+            batch = self._collect()
+            if not batch:
+                self._free_runners.release()
+                continue
+            self._runners.submit(self._run, batch)
+    
+    def _collect(self):
+        """Oldest queued frame plus whatever else arrives within the window"""
+        first = None
+        while first is None:
+            try:
+                first = self._queue.get(timeout=0.5)
+            except Empty:
+                return []
+            if not self._still_wanted(first):
+                first = None
+        
+        batch = [first]
+        deadline = first['enqueued_ns'] / 1e9 + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                # Past the window, still take frames that are already waiting
+                ticket = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except Empty:
+                break
+            if self._still_wanted(ticket):
+                batch.append(ticket)
+        return batch
+    
+    def _still_wanted(self, ticket):
+        """Fail a queued frame whose check() raises, e.g. after its deadline"""
+        if ticket['check'] is None:
+            return True
+        try:
+            ticket['check']()
+            return True
+        except Exception as e:
+            with self._lock:
+                self.dropped += 1
+            ticket['error'] = e
+            ticket['frame'] = None
+            ticket['event'].set()
+            return False
+    
+    def _run(self, batch):
+        """Run one batched forward pass and hand each caller its result"""
+        started = time.perf_counter_ns()
+        with self._lock:
+            self._batch_sizes[len(batch)] += 1
+            for ticket in batch:
+                ticket['queued_ns'] = started - ticket['enqueued_ns']
+                self._queue_delay.observe(ticket['queued_ns'] / 1e9)
+        
+        try:
+            results = self.run_batch([t['frame'] for t in batch], [t['params'] for t in batch],
+                                     [t['session_id'] for t in batch])
+            for ticket, detections in zip(batch, results):
+                ticket['result'] = detections
+        except Exception as e:
+            for ticket in batch:
+                ticket['error'] = e
+        finally:
+            self._free_runners.release()
+            for ticket in batch:
+                ticket['frame'] = None
+                ticket['event'].set()
+    
+    def stats(self):
+        """Queue depth, batch-size histogram and queueing delay"""
+        with self._lock:
+            sizes = list(self._batch_sizes)
+            recent = np.fromiter(self._queue_delay.recent, dtype=np.float64) * 1000
+            delay_count, delay_sum = self._queue_delay.count, self._queue_delay.sum
+        batches = sum(sizes)
+        return {
+            'window_ms': self.window * 1000,
+            'max_batch': self.max_batch,
+            'queue_depth': self._queue.qsize(),
+            'batches': batches,
+            'mean_batch_size': round(sum(size * n for size, n in enumerate(sizes)) / batches, 2) if batches else None,
+            'batch_sizes': {size: n for size, n in enumerate(sizes) if n},
+            'dropped': self.dropped,
+            'queue_delay_mean_ms': round(delay_sum * 1000 / delay_count, 3) if delay_count else None,
+            'queue_delay_p95_ms': round(float(np.percentile(recent, 95)), 3) if len(recent) else None,
+        }
+    
+    def shutdown(self):
+        """Stop collecting and let running batches finish"""
+        self.running = False
+        self._collector.join(timeout=1.0)
+        self._runners.shutdown(wait=True)
@@ -0,0 +1,234 @@
+"""Latency and throughput benchmarks for cv-app.
+
+Drives /detect end to end through the Flask test client and times the
+individual stages (decode, preprocess, forward, post-process) on synthetic
+frames at several resolutions, JPEG qualities and concurrency levels.
+
+    python benchmarks/bench_detect.py                      # print results
+    python benchmarks/bench_detect.py --save baseline.json # record a baseline
+    python benchmarks/bench_detect.py --compare baseline.json
+
+In compare mode the exit code is 1 if any p95 latency or throughput figure
+regressed by more than --threshold (default 10%).
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Identical frames would otherwise be answered from the result cache
+os.environ.setdefault('RESULT_CACHE_SIZE', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+import app as cv_app
+from detection import parse_detections
+
+RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080), (3840, 2160)]
+QUALITIES = [50, 80, 95]
+CONCURRENCY = [1, 2, 4]
+
+def synthetic_frame(width, height, seed=0):
+    """Textured frame so JPEG size and decode cost resemble a camera image"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (max(1, height // 8), max(1, width // 8), 3), dtype=np.uint8)
+    frame = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(8):
+        x, y = int(rng.integers(0, width - 50)), int(rng.integers(0, height - 50))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.rectangle(frame, (x, y), (x + 50 + x // 4, y + 50 + y // 4), color, -1)
+    return frame
+
+def synthetic_output(rows=100, seed=0):
+    """SSD-shaped output tensor [1, 1, rows, 7] with a realistic score spread"""
+    rng = np.random.default_rng(seed)
+    out = np.zeros((1, 1, rows, 7), dtype=np.float32)
+    out[0, 0, :, 1] = rng.integers(0, 80, rows)
+    out[0, 0, :, 2] = np.sort(rng.random(rows))[::-1]
+    corners = np.sort(rng.random((rows, 2, 2)), axis=1)
+    out[0, 0, :, 3:5] = corners[:, 0]
+    out[0, 0, :, 5:7] = corners[:, 1]
+    return out
+
+def percentiles(samples_ms):
+    """p50/p95/p99 and mean of a list of millisecond samples"""
+    samples = np.asarray(samples_ms)
+    return {
+        'p50': round(float(np.percentile(samples, 50)), 3),
+        'p95': round(float(np.percentile(samples, 95)), 3),
+        'p99': round(float(np.percentile(samples, 99)), 3),
+        'mean': round(float(samples.mean()), 3),
+    }
+
+def time_ms(fn, iterations):
+    """Run fn repeatedly and return per-call wall times in milliseconds"""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        fn()
+        samples.append((time.perf_counter_ns() - start) / 1e6)
+    return samples
+
+def bench_stages(data, iterations):
+    """Time each pipeline stage on one encoded frame"""
+    frame, _ = cv_app.decode_image_reduced(data)
+    params = cv_app.detection_params()
+    output = synthetic_output()
+    height, width = frame.shape[:2]
+    
+    # Preprocessing fills the engine's reused input buffers, as detection does
+    def preprocess():
+        with cv_app.engine.input_buffer() as buffer:
+            buffer.fill([frame])
+    
+    stages = {
+        'decode': time_ms(lambda: cv_app.decode_image_reduced(data), iterations),
+        'preprocess': time_ms(preprocess, iterations),
+    }
+    
+    if cv_app.mock_mode:
+        stages['forward'] = time_ms(lambda: cv_app.mock_detector.detect(frame, params), iterations)
+    else:
+        with cv_app.engine.input_buffer() as buffer, cv_app.detector_pool.acquire() as net:
+            blob = buffer.fill([frame])
+            stages['forward'] = time_ms(lambda: cv_app.engine.forward(net, blob), iterations)
+    
+    stages['postprocess'] = time_ms(lambda: parse_detections(output[0, 0], width, height, params), iterations)
+    return {name: percentiles(samples) for name, samples in stages.items()}
+
+def bench_endpoint(data, concurrency, requests_per_worker):
+    """Drive /detect from several threads, returns latency and frames/sec"""
+    def worker(_):
+        client = cv_app.app.test_client()
+        samples = []
+        for _ in range(requests_per_worker):
+            start = time.perf_counter_ns()
+            response = client.post('/detect', data={'frame': (io.BytesIO(data), 'frame.jpg')},
+                                   content_type='multipart/form-data')
+            samples.append((time.perf_counter_ns() - start) / 1e6)
+            if response.status_code != 200:
+                raise RuntimeError(f'/detect returned {response.status_code}: {response.get_data(as_text=True)}')
+        return samples
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = [s for batch in pool.map(worker, range(concurrency)) for s in batch]
+    elapsed = time.perf_counter() - start
+    
+    result = percentiles(samples)
+    result['fps'] = round(len(samples) / elapsed, 2)
+    return result
+
+def run(args):
+    """Run every configuration and return the results document"""
+    results = {
+        'meta': {
+            'mock_mode': cv_app.mock_mode,
+            'engine': cv_app.engine.name,
+            'model': cv_app.engine.model,
+            'input_size': list(cv_app.engine.input_size),
+            'opencv': cv2.__version__,
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'opencv_threads': cv2.getNumThreads(),
+        },
+        'cases': {},
+    }
+    
+    for width, height in args.resolutions:
+        frame = synthetic_frame(width, height)
+        for quality in args.qualities:
+            data = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+            case = f'{width}x{height}@q{quality}'
+            entry = {
+                'bytes': len(data),
+                'stages': bench_stages(data, args.iterations),
+                'endpoint': {},
+            }
+            for concurrency in args.concurrency:
+                entry['endpoint'][f'c{concurrency}'] = bench_endpoint(data, concurrency, args.requests)
+            results['cases'][case] = entry
+            print(format_case(case, entry))
+    
+    return results
+
+def format_case(case, entry):
+    """One human readable block per configuration"""
+    lines = [f'{case} ({entry["bytes"] / 1024:.0f} KiB)']
+    for name, stats in entry['stages'].items():
+        lines.append(f'  {name:<12} p50 {stats["p50"]:8.3f} ms  p95 {stats["p95"]:8.3f} ms  p99 {stats["p99"]:8.3f} ms')
+    for name, stats in entry['endpoint'].items():
+        lines.append(f'  /detect {name:<4} p50 {stats["p50"]:8.3f} ms  p95 {stats["p95"]:8.3f} ms  '
+                     f'p99 {stats["p99"]:8.3f} ms  {stats["fps"]:8.2f} fps')
+    return '\n'.join(lines)
+
+def compare(baseline, current, threshold):
+    """List regressions of current results against a baseline"""
+    regressions = []
+    for case, entry in current['cases'].items():
+        base = baseline.get('cases', {}).get(case)
+        if not base:
+            continue
+        
+        for name, stats in entry['stages'].items():
+            before = base['stages'].get(name, {}).get('p95')
+            if before and stats['p95'] > before * (1 + threshold):
+                regressions.append(f'{case} {name} p95 {before:.3f} -> {stats["p95"]:.3f} ms')
+        
+        for name, stats in entry['endpoint'].items():
+            old = base['endpoint'].get(name)
+            if not old:
+                continue
+            if stats['p95'] > old['p95'] * (1 + threshold):
+                regressions.append(f'{case} /detect {name} p95 {old["p95"]:.3f} -> {stats["p95"]:.3f} ms')
+            if stats['fps'] < old['fps'] * (1 - threshold):
+                regressions.append(f'{case} /detect {name} fps {old["fps"]:.2f} -> {stats["fps"]:.2f}')
+    
+    return regressions
+
+def parse_resolution(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resolutions', nargs='+', type=parse_resolution, default=RESOLUTIONS,
+                        help='Frame sizes as WIDTHxHEIGHT')
+    parser.add_argument('--qualities', nargs='+', type=int, default=QUALITIES, help='JPEG qualities')
+    parser.add_argument('--concurrency', nargs='+', type=int, default=CONCURRENCY, help='Concurrent clients')
+    parser.add_argument('--iterations', type=int, default=30, help='Samples per stage')
+    parser.add_argument('--requests', type=int, default=20, help='Requests per client')
+    parser.add_argument('--save', help='Write results as a JSON baseline')
+    parser.add_argument('--compare', help='Baseline JSON to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Allowed relative regression')
+    args = parser.parse_args()
+    
+    if not cv_app.wait_until_ready(120):
+        sys.exit(f"Detector did not become ready: {cv_app.startup}")
+    
+    results = run(args)
+    
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved results to {args.save}')
+    
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s) beyond {args.threshold:.0%}:')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print('No regressions')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+from collections.abc import Sequence
+import numpy as np
+
+# Detection model paths
+MODEL_CONFIG = 'models/ssd_mobilenet_v3_large_coco_2020_01_14.pbtxt'
+MODEL_WEIGHTS = 'models/frozen_inference_graph.pb'
+CLASSES_FILE = 'models/coco.names'
+
+# Network input size (width, height)
+INPUT_SIZE = (300, 300)
+
+# JPEG start-of-frame markers, which carry the image dimensions
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# COCO class names (first 20 for brevity, full list available)
+COCO_CLASSES = [
+    'person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck',
+    'boat', 'traffic light', 'fire hydrant', 'stop sign', 'parking meter', 'bench',
+    'bird', 'cat', 'dog', 'horse', 'sheep', 'cow', 'elephant', 'bear', 'zebra',
+    'giraffe', 'backpack', 'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee',
+    'skis', 'snowboard', 'sports ball', 'kite', 'baseball bat', 'baseball glove',
+    'skateboard', 'surfboard', 'tennis racket', 'bottle', 'wine glass', 'cup',
+    'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple', 'sandwich', 'orange',
+    'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair', 'couch',
+    'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse',
+    'remote', 'keyboard', 'cell phone', 'microwave', 'oven', 'toaster', 'sink',
+    'refrigerator', 'book', 'clock', 'vase', 'scissors', 'teddy bear', 'hair drier',
+    'toothbrush'
+]
+
+# Label -> COCO class id
+CLASS_IDS = {name: i for i, name in enumerate(COCO_CLASSES)}
+
+# Default input normalisation: (pixel - mean) * scale, with BGR swapped to RGB
+INPUT_SCALE = 1.0 / 127.5
+INPUT_MEAN = 127.5
+
+class Detections(Sequence):
+    """Detection results kept as columns: class ids, scores and [x, y, w, h] boxes.
+    
+    parse_detections() fills the columns straight from the model output, and
+    the packed wire format is written from them without any per-box
+    objects. Indexing or iterating gives the usual result dicts
+    ({'label', 'confidence', 'bbox'}), built only when something asks.
+    Tracker results also carry a track_ids column, None otherwise.
+    """
+    __slots__ = ('class_ids', 'scores', 'boxes', 'track_ids')
+    
+    def __init__(self, class_ids, scores, boxes, track_ids=None):
+        self.class_ids = class_ids
+        self.scores = scores
+        self.boxes = boxes
+        self.track_ids = track_ids
+    
+    @classmethod
+    def from_dicts(cls, detections):
+        """Columns from result dicts, e.g. tracker output"""
+        return cls(
+            np.array([CLASS_IDS[det['label']] for det in detections], dtype=np.int32),
+            np.array([det['confidence'] for det in detections], dtype=np.float32),
+            np.array([det['bbox'] for det in detections], dtype=np.int32).reshape(-1, 4),
+            np.array([det['track_id'] for det in detections], dtype=np.uint32)
+            if detections and all('track_id' in det for det in detections) else None,
+        )
+    
+    def __len__(self):
+        return len(self.scores)
+    
+    def __getitem__(self, index):
+        return self.to_dicts()[index]
+    
+    def __iter__(self):
+        return iter(self.to_dicts())
+    
+    def __eq__(self, other):
+        if not isinstance(other, Detections):
+            return NotImplemented
+        return (np.array_equal(self.class_ids, other.class_ids) and np.array_equal(self.scores, other.scores)
+                and np.array_equal(self.boxes, other.boxes)
+                and (self.track_ids is None) == (other.track_ids is None)
+                and (self.track_ids is None or np.array_equal(self.track_ids, other.track_ids)))
+    
+    def scaled(self, factor):
+        """Boxes multiplied by factor"""
+        return Detections(self.class_ids, self.scores, self.boxes * factor, self.track_ids)
+    
+    def to_dicts(self):
+        """Result dicts for JSON responses and the tracker"""
+        dicts = [
+            {'label': COCO_CLASSES[class_id], 'confidence': round(score, 2), 'bbox': bbox}
+            for class_id, score, bbox in zip(self.class_ids.tolist(), self.scores.tolist(), self.boxes.tolist())
+        ]
+        if self.track_ids is not None:
+            for det, track_id in zip(dicts, self.track_ids.tolist()):
+                det['track_id'] = track_id
+        return dicts
+
+def detection_dicts(detections):
+    """Result dicts for detections held either as Detections or already as dicts"""
+    return detections.to_dicts() if isinstance(detections, Detections) else detections
+
+def blob_from_frame(frame, input_size=INPUT_SIZE, scale=INPUT_SCALE, mean=INPUT_MEAN, swap_rb=True):
+    """Prepare a single frame as network input"""
+    import cv2
+    return cv2.dnn.blobFromImage(frame, scale, input_size, [mean, mean, mean], swapRB=swap_rb, crop=False)
+
+def blob_from_frames(frames, input_size=INPUT_SIZE, scale=INPUT_SCALE, mean=INPUT_MEAN, swap_rb=True):
+    """Stack several frames into one network input"""
+    import cv2
+    return cv2.dnn.blobFromImages(frames, scale, input_size, [mean, mean, mean], swapRB=swap_rb, crop=False)
+
+def jpeg_size(data):
+    """Read (width, height) from a JPEG header without decoding, None if not a JPEG"""
+    data = memoryview(data)
+    if bytes(data[:2]) != b'\xff\xd8':
+        return None
+    
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # markers without a length
+            i += 2
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height = int.from_bytes(data[i + 5:i + 7], 'big')
+            width = int.from_bytes(data[i + 7:i + 9], 'big')
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    
+    return None
+
+def png_size(data):
+    """(width, height) from the IHDR chunk of PNG bytes, None if not a PNG"""
+    if bytes(data[:8]) != b'\x89PNG\r\n\x1a\n' or len(data) < 24:
+        return None
+    return int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+
+def image_size(data):
+    """(width, height) read from a JPEG or PNG header without decoding, None for other formats"""
+    return jpeg_size(data) or png_size(data)
+
+def reduced_decode_factor(width, height, min_size=INPUT_SIZE):
+    """Largest JPEG DCT downscale (8, 4 or 2) that still covers the model input"""
+    for factor in (8, 4, 2):
+        if width // factor >= min_size[0] and height // factor >= min_size[1]:
+            return factor
+    return 1
+
+def scale_detections(detections, factor):
+    """Map boxes from a reduced-resolution frame back to original pixels"""
+    if factor == 1:
+        return detections
+    if isinstance(detections, Detections):
+        return detections.scaled(factor)
+    return [
+        {**det, 'bbox': [v * factor for v in det['bbox']]}
+        for det in detections
+    ]
+
+def normalize_detections(detections, width, height):
+    """Boxes as fractions of the frame size, so they map onto any resolution of the same view"""
+    return [
+        {**det, 'bbox': [round(det['bbox'][0] / width, 4), round(det['bbox'][1] / height, 4),
+                         round(det['bbox'][2] / width, 4), round(det['bbox'][3] / height, 4)]}
+        for det in detection_dicts(detections)
+    ]
+
+def forward(net, blob):
+    """Run one inference pass"""
+    net.setInput(blob)
+    return net.forward()
+
+def nms_indices(boxes, scores, class_ids, score_threshold, nms_threshold):
+    """Class-aware non-max suppression, returns indices of the boxes to keep.
+    
+    Boxes are [x, y, w, h] in pixels. Each class is shifted to its own region
+    of the plane so a single cv2.dnn.NMSBoxes call never suppresses across
+    classes.
+    """
+    import cv2
+    
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    
+    offset = (np.abs(boxes).max() * 2 + 1) * class_ids.astype(np.float64)
+    shifted = boxes.astype(np.float64)
+    shifted[:, 0] += offset
+    shifted[:, 1] += offset
+    keep = cv2.dnn.NMSBoxes(shifted.tolist(), scores.tolist(), score_threshold, nms_threshold)
+    return np.asarray(keep, dtype=np.int64).reshape(-1)
+
+def parse_detections(rows, width, height, params):
+    """Convert SSD output rows [image_id, class_id, score, x1, y1, x2, y2] to Detections.
+    
+    Thresholding, class filtering, box scaling and top-k selection are done
+    with NumPy masks over the whole output instead of row by row.
+    """
+    scores = rows[:, 2]
+    class_ids = rows[:, 1].astype(np.int32)
+    
+    mask = (scores > params['confidence']) & (class_ids >= 0) & (class_ids < len(COCO_CLASSES))
+    if params['classes'] is not None:
+        mask &= np.isin(class_ids, params['classes'])
+    
+    scores = scores[mask]
+    class_ids = class_ids[mask]
+    
+    # Scale normalized corners to pixels, then convert to [x, y, w, h]
+    corners = (rows[mask, 3:7] * np.array([width, height, width, height], dtype=np.float32)).astype(np.int32)
+    boxes = np.empty_like(corners)
+    boxes[:, :2] = corners[:, :2]
+    boxes[:, 2:] = corners[:, 2:] - corners[:, :2]
+    
+    if params['nms']:
+        keep = nms_indices(boxes, scores, class_ids, params['confidence'], params['nms_threshold'])
+        scores, class_ids, boxes = scores[keep], class_ids[keep], boxes[keep]
+    
+    # Highest scores first, capped at max_detections
+    order = np.argsort(-scores, kind='stable')[:params['max_detections']]
+    return Detections(class_ids[order], scores[order], boxes[order])
+
+def split_batch_detections(detections, frames, params):
+    """Split a batched SSD output into per-frame detection lists.
+    
+    SSD stacks the detections of every image in the batch into one output
+    tensor and tags each row with the index of the image it belongs to.
+    params is either shared by all frames or a list with one entry per frame.
+    """
+    rows = detections.reshape(-1, 7)
+    image_ids = rows[:, 0].astype(int)
+    if isinstance(params, dict):
+        params = [params] * len(frames)
+    
+    results = []
+    for i, frame in enumerate(frames):
+        height, width = frame.shape[:2]
+        results.append(parse_detections(rows[image_ids == i], width, height, params[i]))
+    
+    return results
+
+def tile_positions(length, tile, step):
+    """Start offsets of tiles of size tile covering length, the last one flush with the edge"""
+    if length <= tile:
+        return [0]
+    return list(range(0, length - tile, step)) + [length - tile]
+
+def tile_grid(width, height, tile_size, overlap=0.2, max_tiles=16):
+    """Overlapping square tiles [(x, y, w, h)] covering a frame.
+    
+    Neighbouring tiles share overlap (a fraction of tile_size) so objects on
+    a seam appear whole in at least one tile. If covering the frame would
+    take more than max_tiles, tiles grow until it does not. A frame no
+    larger than one tile is a single tile.
+    """
+    if tile_size < 1 or max_tiles < 1 or not 0.0 <= overlap < 1.0:
+        raise ValueError('tile_size and max_tiles must be at least 1 and overlap between 0 and 1')
+    
+    while True:
+        step = max(1, int(tile_size * (1.0 - overlap)))
+        xs = tile_positions(width, tile_size, step)
+        ys = tile_positions(height, tile_size, step)
+        if len(xs) * len(ys) <= max_tiles:
+            break
+        tile_size = int(tile_size * 1.25) + 1
+    
+    return [(x, y, min(tile_size, width), min(tile_size, height)) for y in ys for x in xs]
+
+def merge_tile_detections(tile_detections, regions, params):
+    """Shift per-tile detections into frame coordinates and suppress duplicates across tiles.
+    
+    regions holds the (x, y, w, h) each Detections was produced from.
+    Overlapping tiles report the same object more than once, so class-aware
+    NMS always runs on the merged boxes.
+    """
+    class_ids = np.concatenate([detections.class_ids for detections in tile_detections])
+    scores = np.concatenate([detections.scores for detections in tile_detections])
+    boxes = np.concatenate([
+        detections.boxes + np.array([x, y, 0, 0], dtype=np.int32)
+        for detections, (x, y, _, _) in zip(tile_detections, regions)
+    ])
+    keep = nms_indices(boxes, scores, class_ids, 0.0, params['nms_threshold'])
+    
+    # Highest scores first, capped at max_detections
+    keep = keep[np.argsort(-scores[keep], kind='stable')][:params['max_detections']]
+    return Detections(class_ids[keep], scores[keep], boxes[keep])
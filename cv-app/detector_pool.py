@@ -0,0 +1,74 @@
+import threading
+import logging
+from contextlib import contextmanager
+from queue import Queue, Empty
+
+logger = logging.getLogger(__name__)
+
+class DetectorBusyError(Exception):
+    """Raised when no detector becomes free before the acquire timeout"""
+    pass
+
+class DetectorPool:
+    """Fixed-size pool of independent detector instances.
+    
+    cv2.dnn.Net objects keep per-instance state between setInput() and
+    forward(), so they must not be shared between threads. The pool hands
+    each request its own net and blocks callers when every net is in use.
+    """
+    
+    def __init__(self, factory, size=1, acquire_timeout=5.0):
+        if size < 1:
+            raise ValueError('Pool size must be at least 1')
+        
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self._available = Queue(maxsize=size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._rejected = 0
+        
+        for _ in range(size):
+            self._available.put(factory())
+        
+        logger.info(f"Detector pool ready with {size} instance(s)")
+    
+    @contextmanager
+    def acquire(self, timeout=None):
+        """Borrow a detector for the duration of the with-block"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        try:
+            net = self._available.get(timeout=timeout)
+        except Empty:
+            with self._lock:
+                self._rejected += 1
+            raise DetectorBusyError(f'All {self.size} detectors busy')
+        
+        with self._lock:
+            self._in_use += 1
+        try:
+            yield net
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._available.put(net)
+    
+    def each(self, fn):
+        """Call fn on every detector, waiting until all of them are free"""
+        nets = [self._available.get() for _ in range(self.size)]
+        try:
+            for net in nets:
+                fn(net)
+        finally:
+            for net in nets:
+                self._available.put(net)
+    
+    def stats(self):
+        """Current pool usage"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'in_use': self._in_use,
+                'available': self.size - self._in_use,
+                'rejected': self._rejected,
+            }
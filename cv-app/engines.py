@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+import numpy as np
+from metrics import Histogram
+from preprocess import InputBuffers
+from detection import (
+    INPUT_SIZE, INPUT_SCALE, INPUT_MEAN, MODEL_CONFIG, MODEL_WEIGHTS,
+    blob_from_frame, forward, parse_detections
+)
+
+class DetectorEngine:
+    """A detector model format: how to load the net and feed it frames.
+    
+    Every engine is expected to produce SSD DetectionOutput rows
+    [1, 1, N, 7] so the shared post-processing applies unchanged. Engines
+    only hold configuration until load() is called, so they can be
+    rebuilt from spec() in worker processes. Forward-pass latency is kept
+    per engine for /mode and /metrics. Inputs are prepared in reused
+    buffers from input_buffer(); blob() allocates a new one for warm-up.
+    """
+    
+    name = None
+    default_model = None
+    default_config = None
+    
+    def __init__(self, model=None, config=None, input_size=INPUT_SIZE,
+                 scale=INPUT_SCALE, mean=INPUT_MEAN, swap_rb=True):
+        self.model = model or self.default_model
+        self.config = config or self.default_config
+        self.input_size = tuple(input_size)
+        self.scale = scale
+        self.mean = mean
+        self.swap_rb = swap_rb
+        self._latency = Histogram()
+        self._lock = threading.Lock()
+        self._buffers = InputBuffers(self.input_size, scale, mean, swap_rb)
+    
+    def files_present(self):
+        """Whether the model (and config, if the format has one) are on disk"""
+        return all(os.path.exists(path) for path in (self.model, self.config) if path)
+    
+    def read_net(self):
+        raise NotImplementedError
+    
+    def load(self):
+        """Load a fresh net instance"""
+        return self.read_net()
+    
+    def blob(self, frame):
+        return blob_from_frame(frame, self.input_size, self.scale, self.mean, self.swap_rb)
+    
+    def input_buffer(self):
+        """Context manager lending a preallocated InputBuffer, see preprocess"""
+        return self._buffers.acquire()
+    
+    def take_input_buffer(self):
+        """Borrow an InputBuffer across threads; return it with give_input_buffer()"""
+        return self._buffers.take()
+    
+    def give_input_buffer(self, buffer):
+        self._buffers.give(buffer)
+    
+    def forward(self, net, blob):
+        """Run one inference pass, recording its latency"""
+        start = time.perf_counter_ns()
+        output = forward(net, blob)
+        self.record_forward(time.perf_counter_ns() - start)
+        return output
+    
+    def record_forward(self, elapsed_ns):
+        with self._lock:
+            self._latency.observe(elapsed_ns / 1e9)
+    
+    def detect(self, net, frame, params, size=None):
+        """Full single-frame pipeline on a net owned by the caller.
+        
+        size is the (width, height) boxes are scaled to, when frame was
+        resized from a larger original; the frame's own size by default.
+        """
+        width, height = size or (frame.shape[1], frame.shape[0])
+        with self.input_buffer() as buffer:
+            output = self.forward(net, buffer.fill([frame]))
+        return parse_detections(output[0, 0], width, height, params)
+    
+    def warm_up(self, net, runs=2):
+        """Run dummy inferences so the first real frame skips one-time graph setup"""
+        width, height = self.input_size
+        blob = self.blob(np.zeros((height, width, 3), dtype=np.uint8))
+        for _ in range(runs):
+            forward(net, blob)
+    
+    def spec(self):
+        """Arguments for create_engine() that rebuild this engine elsewhere"""
+        return {
+            'name': self.name,
+            'model': self.model,
+            'config': self.config,
+            'input_size': self.input_size,
+            'scale': self.scale,
+            'mean': self.mean,
+            'swap_rb': self.swap_rb,
+        }
+    
+    def stats(self):
+        """Engine settings and forward-pass latency"""
+        with self._lock:
+            recent = np.fromiter(self._latency.recent, dtype=np.float64) * 1000
+            count, total = self._latency.count, self._latency.sum
+        return {
+            'name': self.name,
+            'model': self.model,
+            'input_size': list(self.input_size),
+            'input_buffers': self._buffers.created,
+            'forwards': count,
+            'mean_ms': round(total * 1000 / count, 3) if count else None,
+            'p50_ms': round(float(np.percentile(recent, 50)), 3) if len(recent) else None,
+            'p95_ms': round(float(np.percentile(recent, 95)), 3) if len(recent) else None,
+        }
+    
+    def latency(self):
+        """(count, sum in seconds) of forward passes, for /metrics"""
+        with self._lock:
+            return self._latency.count, self._latency.sum
+
+class TensorflowEngine(DetectorEngine):
+    """Frozen TensorFlow graph plus text graph config (SSD MobileNet v3)"""
+    
+    name = 'tensorflow'
+    default_model = MODEL_WEIGHTS
+    default_config = MODEL_CONFIG
+    
+    def read_net(self):
+        import cv2
+        return cv2.dnn.readNetFromTensorflow(self.model, self.config)
+
+class OnnxEngine(DetectorEngine):
+    """ONNX export of an SSD-style detector"""
+    
+    name = 'onnx'
+    default_model = 'models/ssd_mobilenet.onnx'
+    
+    def read_net(self):
+        import cv2
+        return cv2.dnn.readNetFromONNX(self.model)
+
+class OnnxInt8Engine(OnnxEngine):
+    """int8-quantized ONNX model, run on OpenCV's own CPU backend.
+    
+    Quantized layers are only implemented by the default OpenCV backend, so
+    it is selected explicitly rather than left to whatever cv2 was built with.
+    """
+    
+    name = 'onnx-int8'
+    default_model = 'models/ssd_mobilenet_int8.onnx'
+    
+    def load(self):
+        import cv2
+        net = self.read_net()
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        return net
+
+ENGINES = {engine.name: engine for engine in (TensorflowEngine, OnnxEngine, OnnxInt8Engine)}
+
+def create_engine(name='tensorflow', **kwargs):
+    """Build an engine by name, raises ValueError for unknown engines"""
+    if name not in ENGINES:
+        raise ValueError(f"Unknown detector engine: {name} (use {', '.join(ENGINES)})")
+    return ENGINES[name](**kwargs)
+
+def parse_input_size(value):
+    """'300' -> (300, 300), '320x240' -> (320, 240)"""
+    value = str(value).lower()
+    if 'x' in value:
+        width, height = value.split('x')
+    else:
+        width = height = value
+    size = (int(width), int(height))
+    if min(size) < 1:
+        raise ValueError('Input size must be positive')
+    return size
@@ -0,0 +1,256 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+from admission import FrameDropped
+from detector_pool import DetectorBusyError
+from metrics import Histogram
+from session_store import SessionStore
+
+# Frames a capped session may send back to back before its FPS cap applies
+BURST = 2.0
+
+class SessionQueue:
+    """Waiting frames, DRR deficit, FPS token bucket and counters of one session"""
+    
+    def __init__(self, priority=1.0, fps_cap=0.0):
+        self.priority = priority
+        self.fps_cap = fps_cap
+        self.waiting = deque()
+        self.deficit = 0.0
+        self.credited = False  # deficit already topped up for the current turn
+        self.active = False    # in the scheduler's round-robin list
+        self.tokens = BURST
+        self.refilled = time.monotonic()
+        self.served = 0
+        self.dropped = 0
+        self.throttled = 0
+        self.wait = Histogram(window=256)
+    
+    def take_token(self, now):
+        """Whether a frame is within the FPS cap, using up a token if so"""
+        if not self.fps_cap:
+            return True
+        self.tokens = min(BURST, self.tokens + (now - self.refilled) * self.fps_cap)
+        self.refilled = now
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+    
+    def stats(self):
+        recent = np.fromiter(self.wait.recent, dtype=np.float64) * 1000
+        return {
+            'priority': self.priority,
+            'fps_cap': self.fps_cap or None,
+            'queued': len(self.waiting),
+            'served': self.served,
+            'dropped': self.dropped,
+            'throttled': self.throttled,
+            'wait_mean_ms': round(self.wait.sum * 1000 / self.wait.count, 3) if self.wait.count else None,
+            'wait_p95_ms': round(float(np.percentile(recent, 95)), 3) if len(recent) else None,
+        }
+
+class FairScheduler:
+    """Deficit round-robin over client sessions in front of inference.
+    
+    At most slots frames run inference at once. While all slots are taken,
+    frames wait in a queue per session, and whenever a slot frees up the
+    next frame is picked round-robin over the sessions with frames waiting:
+    on its turn a session's deficit grows by quantum x priority, and it
+    starts frames while the deficit covers their cost. Under contention a
+    session with priority 2 gets twice the inference of one with priority
+    1, however fast either of them sends, so a busy camera cannot starve
+    the others. A session keeps at most max_queued waiting frames; a newer
+    frame displaces the oldest, which is dropped as superseded. Sessions
+    with an FPS cap are throttled by a token bucket before they queue.
+    Frames without a session id share one queue with no cap.
+    """
+    
+    def __init__(self, slots=1, quantum=1.0, max_queued=2, default_fps=0.0, fps_caps=None, priorities=None,
+                 timeout=30.0, session_ttl=60.0, max_sessions=1024):
+        if slots < 1:
+            raise ValueError('Fair scheduler needs at least one slot')
+        if quantum <= 0 or max_queued < 1:
+            raise ValueError('quantum must be positive and max_queued at least 1')
+        priorities = priorities or {}
+        if any(priority <= 0 for priority in priorities.values()):
+            raise ValueError('Session priorities must be positive')
+        
+        self.slots = slots
+        self.quantum = quantum
+        self.max_queued = max_queued
+        self.default_fps = default_fps
+        self.fps_caps = fps_caps or {}
+        self.priorities = priorities
+        self.timeout = timeout
+        self._sessions = SessionStore(session_ttl, max_sessions)
+        self._anonymous = SessionQueue()
+        self._active = deque()  # sessions with waiting frames, in round-robin order
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.served = 0
+        self.dropped = 0
+    
+    def _session(self, session_id):
+        if not session_id:
+            return self._anonymous
+        return self._sessions.get(session_id, lambda: SessionQueue(
+            self.priorities.get(session_id, 1.0), self.fps_cap(session_id)
+        ))
+    
+    def fps_cap(self, session_id):
+        """Frame rate cap that applies to session_id, None for no cap"""
+        return self.fps_caps.get(session_id, self.default_fps) or None
+    
+    @contextmanager
+    def turn(self, session_id=None, cost=1, check=None):
+        """Hold an inference slot for the with-block once it is session_id's turn, yields the ns waited.
+        
+        cost is the number of frames the block runs through the model.
+        Raises FrameDropped when the session is over its FPS cap, when a
+        newer frame from the session displaces this one while it waits, or
+        when check() raises by the time its turn comes, and
+        DetectorBusyError if no turn comes within timeout seconds.
+        """
+        session = self._session(session_id)
+        waiter = self._enqueue(session, session_id, cost, check)
+        if not waiter['event'].wait(self.timeout):
+            with self._lock:
+                timed_out = not waiter['event'].is_set()
+                if timed_out:
+                    session.waiting.remove(waiter)
+                    self._drop(session)
+            if timed_out:
+                raise DetectorBusyError(f'No inference slot within {self.timeout}s')
+        if waiter['error'] is not None:
+            raise waiter['error']
+        
+        try:
+            yield waiter['waited_ns']
+        finally:
+            with self._lock:
+                self._grant_next()
+    
+    def _enqueue(self, session, session_id, cost, check):
+        """Start a frame right away if a slot is free, otherwise queue it behind its session"""
+        waiter = {
+            'event': threading.Event(),
+            'cost': cost,
+            'check': check,
+            'enqueued_ns': time.perf_counter_ns(),
+            'waited_ns': 0,
+            'error': None,
+        }
+        with self._lock:
+            if not session.take_token(time.monotonic()):
+                session.throttled += 1
+                self._drop(session)
+                raise FrameDropped('throttled')
+            
+            if self.in_use < self.slots and not self._active:
+                self.in_use += 1
+                self._grant(session, waiter)
+                return waiter
+            
+            if session_id and len(session.waiting) >= self.max_queued:
+                self._fail(session, session.waiting.popleft(), FrameDropped('superseded'))
+            session.waiting.append(waiter)
+            if not session.active:
+                session.active = True
+                self._active.append(session)
+        return waiter
+    
+    def _grant(self, session, waiter):
+        """Give a waiter the slot it is taking over (lock held)"""
+        waiter['waited_ns'] = time.perf_counter_ns() - waiter['enqueued_ns']
+        session.wait.observe(waiter['waited_ns'] / 1e9)
+        session.served += 1
+        self.served += 1
+        waiter['event'].set()
+    
+    def _fail(self, session, waiter, error):
+        """Drop a waiting frame with error (lock held)"""
+        self._drop(session)
+        waiter['error'] = error
+        waiter['event'].set()
+    
+    def _drop(self, session):
+        session.dropped += 1
+        self.dropped += 1
+    
+    def _grant_next(self):
+        """Hand a released slot to the next frame still wanted, or free it (lock held)"""
+        while True:
+            session, waiter = self._pick()
+            if waiter is None:
+                self.in_use -= 1
+                return
+            try:
+                if waiter['check'] is not None:
+                    waiter['check']()
+            except Exception as e:
+                self._fail(session, waiter, e)
+                continue
+            self._grant(session, waiter)
+            return
+    
+    def _pick(self):
+        """Next waiting frame in deficit round-robin order, (None, None) if there is none (lock held)"""
+        while self._active:
+            session = self._active[0]
+            if not session.waiting:
+                # Emptied by timeouts or displacement
+                self._retire(session)
+                continue
+            if not session.credited:
+                session.deficit += self.quantum * session.priority
+                session.credited = True
+            if session.deficit >= session.waiting[0]['cost']:
+                waiter = session.waiting.popleft()
+                session.deficit -= waiter['cost']
+                if not session.waiting:
+                    self._retire(session)
+                return session, waiter
+            # Turn over: the deficit carries to the session's next turn
+            session.credited = False
+            self._active.rotate(-1)
+        return None, None
+    
+    def _retire(self, session):
+        """Take an idle session out of the round; idle sessions keep no deficit (lock held)"""
+        self._active.popleft()
+        session.active = False
+        session.credited = False
+        session.deficit = 0.0
+    
+    def stats(self):
+        """Slot use and per-session served, dropped and waiting counts"""
+        sessions = self._sessions.items()
+        with self._lock:
+            return {
+                'slots': self.slots,
+                'in_use': self.in_use,
+                'waiting': sum(len(session.waiting) for session in self._active),
+                'active_sessions': len(self._active),
+                'served': self.served,
+                'dropped': self.dropped,
+                'quantum': self.quantum,
+                'max_queued': self.max_queued,
+                'default_fps': self.default_fps or None,
+                'sessions': {session_id: session.stats() for session_id, session in sessions},
+                'anonymous': self._anonymous.stats(),
+            }
+
+def parse_session_values(value):
+    """'cam-1=2,cam-2=0.5' -> {'cam-1': 2.0, 'cam-2': 0.5}; raises ValueError on bad input"""
+    values = {}
+    for item in str(value or '').split(','):
+        if not item.strip():
+            continue
+        session_id, sep, number = item.partition('=')
+        if not sep or not session_id.strip():
+            raise ValueError(f'Expected session=value, got {item!r}')
+        values[session_id.strip()] = float(number)
+    return values
@@ -0,0 +1,294 @@
+import itertools
+import logging
+import multiprocessing
+import threading
+from multiprocessing import connection, shared_memory
+from queue import Queue, Empty
+import numpy as np
+from detector_pool import DetectorBusyError
+from engines import create_engine
+from mock_detector import MockDetector
+
+logger = logging.getLogger(__name__)
+
+class WorkerCrashedError(Exception):
+    """Raised when the worker process handling a frame dies before answering"""
+    pass
+
+def _worker_main(conn, shm_name, slot_bytes, engine_spec, use_model, threads, warmup_runs, mock_spec):
+    """Inference loop run inside each worker process"""
+    import cv2
+    from engines import create_engine
+    from mock_detector import MockDetector
+    
+    cv2.setNumThreads(threads)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    engine = create_engine(**engine_spec)
+    net = engine.load() if use_model else None
+    mock = MockDetector(**mock_spec) if net is None else None
+    if net is not None:
+        engine.warm_up(net, warmup_runs)
+    
+    # Task id None tells the pool this worker is warm and can take frames
+    conn.send((None, True, None, 0))
+    
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        
+        task_id, slot, shape, size, params, session_id = task
+        try:
+            frame = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+            forward_s = engine.latency()[1]
+            if net is not None:
+                detections = engine.detect(net, frame, params, size)
+            else:
+                detections = mock.detect(frame, params, session_id, size)
+            del frame
+            # Forward time goes back so the front end can keep engine stats
+            forward_ns = int((engine.latency()[1] - forward_s) * 1e9)
+            conn.send((task_id, True, detections, forward_ns))
+        except Exception as e:
+            conn.send((task_id, False, str(e), 0))
+    
+    shm.close()
+
+class InferenceWorkerPool:
+    """Runs detection in separate processes, each with its own loaded model.
+    
+    Decoded frames are copied into a ring of fixed-size slots in one
+    shared memory segment, so only the slot index and frame shape are
+    pickled. Frames are resized to the model input on the way in, which
+    the model would do anyway, so any frame fits a slot that holds one
+    input-sized frame; boxes still come back in the original frame's
+    pixels. Every worker talks to the front end over its own pipe; when a
+    worker dies the pipe hits EOF, the frame it was handling fails and the
+    worker is restarted without taking down the web process. Workers only
+    receive frames once they have loaded and warmed up their model.
+    """
+    
+    def __init__(self, workers=2, slots=None, slot_bytes=1920 * 1080 * 3, engine=None, use_model=True,
+                 mock=None, threads=1, acquire_timeout=5.0, task_timeout=30.0, warmup_runs=2):
+        if workers < 1:
+            raise ValueError('Need at least one worker')
+        
+        self.workers = workers
+        self.engine = engine or create_engine()
+        self.slots = slots or workers * 2
+        self.slot_bytes = slot_bytes
+        self.use_model = use_model
+        self.mock = mock or MockDetector()
+        self.threads = threads
+        self.acquire_timeout = acquire_timeout
+        self.task_timeout = task_timeout
+        self.warmup_runs = warmup_runs
+        
+        self._ctx = multiprocessing.get_context('spawn')
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slots * slot_bytes)
+        self._free_slots = Queue()
+        for slot in range(self.slots):
+            self._free_slots.put(slot)
+        
+        self._queue = Queue()   # (task_id, slot, shape, size, params, session_id) waiting for a worker
+        self._idle = Queue()    # (worker_id, generation) of workers ready for a frame
+        self._processes = [None] * workers
+        self._conns = [None] * workers
+        self._generations = [0] * workers  # bumped on restart so idle entries of dead workers go stale
+        self._assigned = [set() for _ in range(workers)]  # task_ids each worker is processing
+        self._warm = [False] * workers
+        self._pending = {}  # task_id -> ticket {'event', 'slot', 'ok', 'result'}
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count(1)
+        self._restarts = 0
+        self.running = True
+        
+        for worker_id in range(workers):
+            self._start_worker(worker_id)
+        
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._dispatcher.start()
+        self._collector = threading.Thread(target=self._collect_loop, daemon=True)
+        self._collector.start()
+        logger.info(f"Inference worker pool started ({workers} workers, {self.slots} slots)")
+    
+    def _start_worker(self, worker_id):
+        """Spawn (or respawn) one worker process"""
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self._shm.name, self.slot_bytes, self.engine.spec(), self.use_model,
+                  self.threads, self.warmup_runs, self.mock.spec()),
+            daemon=True
+        )
+        process.start()
+        # Only the child keeps its end open, so a dead worker shows up as EOF
+        child_conn.close()
+        
+        self._processes[worker_id] = process
+        self._conns[worker_id] = parent_conn
+        self._warm[worker_id] = False
+    
+    def ready(self):
+        """Whether every worker has loaded and warmed up its model"""
+        return all(self._warm)
+    
+    def submit(self, frame, params, session_id=None):
+        """Copy a frame into a free slot and queue it, returns a ticket for result().
+        
+        session_id picks the mock detector's random stream when there is no model.
+        """
+        size = (frame.shape[1], frame.shape[0])
+        if frame.dtype == np.uint8 and size != self.engine.input_size:
+            # Same bilinear resize as blob preparation, so the worker's own resize is a no-op
+            import cv2
+            frame = cv2.resize(frame, self.engine.input_size, interpolation=cv2.INTER_LINEAR)
+        if frame.dtype != np.uint8 or frame.nbytes > self.slot_bytes:
+            raise ValueError(f'Frame does not fit a {self.slot_bytes} byte shared memory slot')
+        
+        try:
+            slot = self._free_slots.get(timeout=self.acquire_timeout)
+        except Empty:
+            raise DetectorBusyError(f'All {self.slots} frame slots busy')
+        
+        view = np.ndarray(frame.shape, dtype=np.uint8, buffer=self._shm.buf, offset=slot * self.slot_bytes)
+        view[...] = frame
+        del view
+        
+        ticket = {'event': threading.Event(), 'slot': slot, 'ok': False, 'result': None}
+        with self._lock:
+            task_id = next(self._task_ids)
+            self._pending[task_id] = ticket
+        self._queue.put((task_id, slot, frame.shape, size, params, session_id))
+        return ticket
+    
+    def result(self, ticket):
+        """Wait for a submitted frame's detections"""
+        if not ticket['event'].wait(self.task_timeout):
+            # The slot is released by the collector if the worker answers later
+            raise TimeoutError(f'Inference timed out after {self.task_timeout}s')
+        
+        if not ticket['ok']:
+            raise ticket['result']
+        return ticket['result']
+    
+    def detect(self, frame, params, session_id=None):
+        """Run detection for one frame in a worker process"""
+        return self.result(self.submit(frame, params, session_id))
+    
+    def _finish(self, task_id, ok, result):
+        """Complete a pending task and release its slot"""
+        with self._lock:
+            ticket = self._pending.pop(task_id, None)
+        if ticket is None:
+            return
+        ticket['ok'] = ok
+        ticket['result'] = result
+        self._free_slots.put(ticket['slot'])
+        ticket['event'].set()
+    
+    def _dispatch_loop(self):
+        """Hand queued frames to idle workers"""
+        while self.running:
+            try:
+                task = self._queue.get(timeout=1)
+            except Empty:
+                continue
+            
+            conn = None
+            while self.running and conn is None:
+                try:
+                    worker_id, generation = self._idle.get(timeout=1)
+                except Empty:
+                    continue
+                with self._lock:
+                    # Entries left by a worker that has since been restarted are skipped
+                    if generation == self._generations[worker_id]:
+                        self._assigned[worker_id].add(task[0])
+                        conn = self._conns[worker_id]
+            if conn is None:
+                break
+            
+            try:
+                conn.send(task)
+            except (OSError, ValueError):
+                # Worker died between frames; the collector restarts it
+                with self._lock:
+                    self._assigned[worker_id].discard(task[0])
+                self._finish(task[0], False, WorkerCrashedError('Inference worker unavailable'))
+    
+    def _collect_loop(self):
+        """Route worker results back to waiting requests and restart dead workers"""
+        while self.running:
+            conns = {conn: worker_id for worker_id, conn in enumerate(self._conns)}
+            for conn in connection.wait(list(conns), timeout=0.5):
+                worker_id = conns[conn]
+                try:
+                    task_id, ok, payload, forward_ns = conn.recv()
+                except (EOFError, OSError):
+                    self._restart_worker(worker_id)
+                    continue
+                
+                with self._lock:
+                    self._assigned[worker_id].discard(task_id)
+                    generation = self._generations[worker_id]
+                self._idle.put((worker_id, generation))
+                if task_id is None:
+                    self._warm[worker_id] = True
+                    continue
+                if forward_ns:
+                    self.engine.record_forward(forward_ns)
+                self._finish(task_id, ok, payload if ok else RuntimeError(payload))
+    
+    def _restart_worker(self, worker_id):
+        """Fail the frames a dead worker was handed and start a replacement"""
+        if not self.running:
+            return
+        
+        process = self._processes[worker_id]
+        process.join(timeout=1)
+        logger.warning(f"Inference worker {worker_id} died (exit code {process.exitcode}), restarting")
+        
+        with self._lock:
+            self._generations[worker_id] += 1
+            assigned, self._assigned[worker_id] = self._assigned[worker_id], set()
+        for task_id in assigned:
+            self._finish(task_id, False, WorkerCrashedError('Inference worker crashed while processing frame'))
+        
+        self._conns[worker_id].close()
+        self._restarts += 1
+        self._start_worker(worker_id)
+    
+    def stats(self):
+        """Current worker pool usage"""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'workers': self.workers,
+            'alive': sum(1 for p in self._processes if p.is_alive()),
+            'warm': sum(self._warm),
+            'busy': sum(1 for tasks in self._assigned if tasks),
+            'slots': self.slots,
+            'free_slots': self._free_slots.qsize(),
+            'pending': pending,
+            'restarts': self._restarts,
+        }
+    
+    def shutdown(self):
+        """Stop workers and release the shared memory segment"""
+        if not self.running:
+            return
+        
+        self.running = False
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._shm.close()
+        self._shm.unlink()
+        logger.info("Inference worker pool stopped")
@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import numpy as np
+
+# Histogram bucket upper bounds in seconds (0.1 ms .. 5 s)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Timer of the request (or stream frame) being handled in this context
+_current_timer = ContextVar('stage_timer', default=None)
+
+class StageTimer:
+    """Per-request stage durations measured with perf_counter_ns"""
+    
+    def __init__(self):
+        self.started_ns = time.perf_counter_ns()
+        self.stages = {}  # name -> nanoseconds, in the order stages ran
+    
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter_ns() - start)
+    
+    def add(self, name, elapsed_ns):
+        """Record a duration measured elsewhere, such as on another thread"""
+        self.stages[name] = self.stages.get(name, 0) + elapsed_ns
+    
+    def total_ns(self):
+        return time.perf_counter_ns() - self.started_ns
+    
+    def server_timing(self):
+        """Server-Timing header value, durations in milliseconds"""
+        parts = [f'{name};dur={ns / 1e6:.3f}' for name, ns in self.stages.items()]
+        parts.append(f'total;dur={self.total_ns() / 1e6:.3f}')
+        return ', '.join(parts)
+
+def activate(timer):
+    """Make timer the target of stage() in this context, returns a reset token"""
+    return _current_timer.set(timer)
+
+def deactivate(token):
+    _current_timer.reset(token)
+
+def record(name, elapsed_ns):
+    """Add a duration to the active request timer, if there is one"""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.add(name, elapsed_ns)
+
+@contextmanager
+def stage(name):
+    """Time a block against the active request timer, a no-op without one"""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+class Histogram:
+    """Cumulative Prometheus-style histogram plus a rolling window for quantiles"""
+    
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=1024):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+    
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+class MetricsRegistry:
+    """Stage and request latency histograms rendered in Prometheus text format"""
+    
+    def __init__(self, prefix='cvapp', window=1024):
+        self.prefix = prefix
+        self.window = window
+        self._stages = {}    # stage -> Histogram
+        self._requests = {}  # (endpoint, status) -> Histogram
+        self._collectors = []
+        self._lock = threading.Lock()
+    
+    def observe_timer(self, timer, endpoint=None, status=None):
+        """Record every stage of a finished request"""
+        with self._lock:
+            for name, ns in timer.stages.items():
+                self._histogram(self._stages, name).observe(ns / 1e9)
+            if endpoint is not None:
+                self._histogram(self._requests, (endpoint, str(status))).observe(timer.total_ns() / 1e9)
+    
+    def _histogram(self, table, key):
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram(window=self.window)
+        return histogram
+    
+    def recent_stage_seconds(self, stages):
+        """Recent durations of any of the named stages, as one array"""
+        with self._lock:
+            windows = [list(histogram.recent) for name, histogram in self._stages.items() if name in stages]
+        return np.array([value for window in windows for value in window], dtype=np.float64)
+    
+    def recent_request_seconds(self, endpoints, status=None):
+        """Recent end-to-end durations of requests to any of endpoints, as one array"""
+        with self._lock:
+            windows = [list(histogram.recent) for (endpoint, code), histogram in self._requests.items()
+                       if endpoint in endpoints and (status is None or code == status)]
+        return np.array([value for window in windows for value in window], dtype=np.float64)
+    
+    def add_collector(self, collect):
+        """Register a callable returning [(name, type, help, [(labels, value)])]"""
+        self._collectors.append(collect)
+    
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            self._render_histograms(lines, 'stage_duration_seconds', 'Time spent in each detection stage',
+                                    {name: {'stage': name} for name in self._stages}, self._stages)
+            self._render_histograms(lines, 'request_duration_seconds', 'End-to-end request time',
+                                    {key: {'endpoint': key[0], 'status': key[1]} for key in self._requests},
+                                    self._requests)
+            
+            name = f'{self.prefix}_stage_duration_recent_seconds'
+            lines.append(f'# HELP {name} Stage time quantiles over the last {self.window} observations')
+            lines.append(f'# TYPE {name} summary')
+            for stage_name, histogram in self._stages.items():
+                recent = np.fromiter(histogram.recent, dtype=np.float64)
+                for quantile in (0.5, 0.95, 0.99):
+                    value = float(np.quantile(recent, quantile)) if len(recent) else 0.0
+                    lines.append(f'{name}{{stage="{stage_name}",quantile="{quantile}"}} {value:.9f}')
+                lines.append(f'{name}_sum{{stage="{stage_name}"}} {float(recent.sum()):.9f}')
+                lines.append(f'{name}_count{{stage="{stage_name}"}} {len(recent)}')
+        
+        for collect in self._collectors:
+            for metric, metric_type, help_text, samples in collect():
+                name = f'{self.prefix}_{metric}'
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+        
+        return '\n'.join(lines) + '\n'
+    
+    def _render_histograms(self, lines, metric, help_text, labels_by_key, table):
+        name = f'{self.prefix}_{metric}'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for key, histogram in table.items():
+            labels = labels_by_key[key]
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels({**labels, "le": bound})} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels({**labels, "le": "+Inf"})} {histogram.count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum:.9f}')
+            lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+
+def format_labels(labels):
+    """{'a': 1} -> '{a="1"}', escaping values such as client session ids"""
+    if not labels:
+        return ''
+    body = ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+    return '{' + body + '}'
+
+def escape_label(value):
+    """Backslash, double quote and newline escaped as the text format requires"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
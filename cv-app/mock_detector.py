@@ -0,0 +1,149 @@
+import threading
+import time
+import zlib
+import numpy as np
+from detection import COCO_CLASSES, parse_detections
+from session_store import SessionStore
+
+# Classes the mock detector reports, like a desk camera would
+MOCK_CLASSES = ('person', 'chair', 'cup', 'laptop', 'bottle', 'cell phone')
+
+LATENCY_MODES = ('none', 'fixed', 'normal', 'trace')
+
+class MockDetector:
+    """Seeded stand-in for the model, for demos and load tests without model files.
+    
+    Every session draws from its own random stream seeded by (seed, session
+    id), so replaying a session's frames gives the same detections no
+    matter how other sessions interleave with it. Frames without a session
+    share one stream. Boxes are generated as SSD output rows in one
+    vectorized step and go through the regular post-processing, so
+    detection parameters apply as with the real model. Each call can sleep
+    for a simulated inference time: fixed, normally distributed, or
+    replayed in order from a recorded trace.
+    """
+    
+    def __init__(self, seed=0, min_detections=1, max_detections=2, latency='none',
+                 latency_ms=0.0, latency_std_ms=0.0, trace=None, session_ttl=60.0, max_sessions=1024):
+        if not 0 <= min_detections <= max_detections:
+            raise ValueError('Need 0 <= min_detections <= max_detections')
+        if latency not in LATENCY_MODES:
+            raise ValueError(f"Unknown mock latency: {latency} (use {', '.join(LATENCY_MODES)})")
+        
+        self.seed = seed
+        self.min_detections = min_detections
+        self.max_detections = max_detections
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.latency_std_ms = latency_std_ms
+        self.trace = trace
+        self._trace_ms = load_trace(trace) if latency == 'trace' else None
+        self._trace_index = 0
+        self._class_ids = np.array([COCO_CLASSES.index(name) for name in MOCK_CLASSES], dtype=np.float32)
+        self._sessions = SessionStore(session_ttl, max_sessions)
+        self._shared = self._rng(None)
+        self._latency_rng = np.random.default_rng([seed, 1])
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.simulated_ms = 0.0
+    
+    def _rng(self, session_id):
+        key = zlib.crc32(session_id.encode()) if session_id else 0
+        return np.random.default_rng([self.seed, 0, key])
+    
+    def rows(self, rng, count):
+        """count frames of SSD output rows [image_id, class_id, score, x1, y1, x2, y2]"""
+        per_frame = rng.integers(self.min_detections, self.max_detections + 1, size=count)
+        n = int(per_frame.sum())
+        rows = np.empty((n, 7), dtype=np.float32)
+        rows[:, 0] = np.repeat(np.arange(count), per_frame)
+        rows[:, 1] = rng.choice(self._class_ids, size=n)
+        rows[:, 2] = rng.uniform(0.7, 0.95, size=n)
+        rows[:, 3:5] = rng.uniform(0.0, 0.5, size=(n, 2))
+        rows[:, 5:7] = np.minimum(rows[:, 3:5] + rng.uniform(0.15, 0.6, size=(n, 2)), 1.0)
+        return rows
+    
+    def detect(self, frame, params, session_id=None, size=None):
+        """Mock detections for one frame, boxes scaled to size (width, height) if given"""
+        return self.detect_batch([frame], params, session_id, [size])[0]
+    
+    def detect_batch(self, frames, params, session_id=None, sizes=None):
+        """Mock detections for several frames, simulating one batched forward pass.
+        
+        params and session_id are either shared by all frames or lists with
+        one entry per frame, so a micro-batch can mix sessions. Each frame
+        draws from its own session's stream, so how frames are batched does
+        not change their detections. sizes optionally gives the (width,
+        height) each frame's boxes are scaled to.
+        """
+        if isinstance(params, dict):
+            params = [params] * len(frames)
+        if not isinstance(session_id, (list, tuple)):
+            session_id = [session_id] * len(frames)
+        streams = [self._stream(frame_session) for frame_session in session_id]
+        
+        with self._lock:
+            frame_rows = [self.rows(rng, 1) for rng in streams]
+            delay_ms = self.sample_latency()
+            self.frames += len(frames)
+            self.simulated_ms += delay_ms
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000.0)
+        
+        sizes = sizes or [None] * len(frames)
+        results = []
+        for frame, rows, frame_params, size in zip(frames, frame_rows, params, sizes):
+            width, height = size or (frame.shape[1], frame.shape[0])
+            results.append(parse_detections(rows, width, height, frame_params))
+        return results
+    
+    def _stream(self, session_id):
+        """Random stream of session_id, the shared one without a session"""
+        if not session_id:
+            return self._shared
+        return self._sessions.get(session_id, lambda: self._rng(session_id))
+    
+    def sample_latency(self):
+        """Next simulated inference time in milliseconds (lock held)"""
+        if self.latency == 'fixed':
+            return self.latency_ms
+        if self.latency == 'normal':
+            return max(0.0, float(self._latency_rng.normal(self.latency_ms, self.latency_std_ms)))
+        if self.latency == 'trace':
+            value = self._trace_ms[self._trace_index]
+            self._trace_index = (self._trace_index + 1) % len(self._trace_ms)
+            return value
+        return 0.0
+    
+    def spec(self):
+        """Arguments that rebuild this detector elsewhere, e.g. in a worker process"""
+        return {
+            'seed': self.seed,
+            'min_detections': self.min_detections,
+            'max_detections': self.max_detections,
+            'latency': self.latency,
+            'latency_ms': self.latency_ms,
+            'latency_std_ms': self.latency_std_ms,
+            'trace': self.trace,
+        }
+    
+    def stats(self):
+        """Settings and how much inference time has been simulated"""
+        with self._lock:
+            frames, simulated_ms = self.frames, self.simulated_ms
+        return {
+            **self.spec(),
+            'frames': frames,
+            'sessions': len(self._sessions),
+            'simulated_ms': round(simulated_ms, 3),
+        }
+
+def load_trace(path):
+    """Latencies in milliseconds from a file with one value per line ('#' starts a comment)"""
+    if not path:
+        raise ValueError('Trace latency needs a trace file')
+    with open(path) as f:
+        values = [float(line.split('#')[0]) for line in f if line.split('#')[0].strip()]
+    if not values or min(values) < 0:
+        raise ValueError(f'Trace {path} has no usable latencies')
+    return values
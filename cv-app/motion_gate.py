@@ -0,0 +1,81 @@
+import threading
+import time
+from session_store import SessionStore
+
+class MotionGate:
+    """Per-session frame differencing that lets static scenes skip inference.
+    
+    For each session we keep a small grayscale thumbnail of the last frame
+    that actually went through the model, along with its detections. A new
+    frame is compared against that thumbnail rather than the immediately
+    previous frame, so slow drift still adds up and eventually triggers a
+    fresh detection. Sessions idle for longer than session_ttl are evicted
+    and at most max_sessions are kept.
+    """
+    
+    def __init__(self, threshold=0.02, session_ttl=60.0, max_sessions=1024,
+                 max_reuse_age=5.0, thumb_size=(64, 48)):
+        self.threshold = threshold
+        self.max_reuse_age = max_reuse_age
+        self.thumb_size = thumb_size
+        self._sessions = SessionStore(session_ttl, max_sessions)
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.evaluated = 0
+    
+    def thumbnail(self, frame):
+        """Downscaled grayscale copy used for differencing"""
+        import cv2
+        
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return cv2.resize(gray, self.thumb_size, interpolation=cv2.INTER_AREA)
+    
+    def check(self, session_id, frame, fingerprint):
+        """Compare a frame with the session's last detected frame.
+        
+        Returns (detections, score, thumb). Detections is the previous result
+        if the scene has not changed enough, otherwise None and the caller
+        should run inference and then call update() with the same thumb.
+        """
+        import cv2
+        
+        thumb = self.thumbnail(frame)
+        now = time.monotonic()
+        state = self._sessions.get(session_id)
+        
+        with self._lock:
+            self.evaluated += 1
+        if state is None:
+            return None, None, thumb
+        
+        if (state['shape'] != frame.shape or state['fingerprint'] != fingerprint
+                or now - state['detected_at'] > self.max_reuse_age):
+            return None, None, thumb
+        
+        score = float(cv2.absdiff(thumb, state['thumb']).mean()) / 255.0
+        if score >= self.threshold:
+            return None, score, thumb
+        
+        with self._lock:
+            self.reused += 1
+        return state['detections'], score, thumb
+    
+    def update(self, session_id, frame, thumb, fingerprint, detections):
+        """Remember the frame that detections were computed from"""
+        self._sessions.put(session_id, {
+            'thumb': thumb,
+            'shape': frame.shape,
+            'fingerprint': fingerprint,
+            'detections': detections,
+            'detected_at': time.monotonic(),
+        })
+    
+    def stats(self):
+        """Session count and how often inference was skipped"""
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'evaluated': self.evaluated,
+                'reused': self.reused,
+                'threshold': self.threshold,
+            }
@@ -0,0 +1,201 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextvars import copy_context
+from queue import Queue, Full
+from detector_pool import DetectorBusyError
+
+logger = logging.getLogger(__name__)
+
+class PipelineFullError(DetectorBusyError):
+    """Raised when the first stage's queue stays full for the whole submit timeout"""
+    pass
+
+class PipelineStage:
+    """Worker threads running one step of a Pipeline, fed by a bounded queue.
+    
+    Occupancy is the share of the stage's worker time spent running jobs
+    over the last window seconds; a stage near 1.0 with a full queue in
+    front of it is the bottleneck.
+    """
+    
+    def __init__(self, name, fn, workers=1, queue_size=4, window=10.0):
+        if workers < 1:
+            raise ValueError(f'Stage {name} needs at least one worker')
+        
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue = Queue(maxsize=queue_size)
+        self.window_ns = int(window * 1e9)
+        self.started_ns = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._active = {}       # worker thread -> start of the job it is running
+        self._recent = deque()  # (finished_ns, busy_ns) of jobs in the window
+        self.processed = 0
+        self.failed = 0
+        self.busy_ns = 0
+    
+    def begin(self):
+        start = time.perf_counter_ns()
+        with self._lock:
+            self._active[threading.get_ident()] = start
+        return start
+    
+    def finish(self, start, failed=False):
+        now = time.perf_counter_ns()
+        with self._lock:
+            del self._active[threading.get_ident()]
+            self._recent.append((now, now - start))
+            self.processed += 1
+            self.failed += failed
+            self.busy_ns += now - start
+    
+    def occupancy(self):
+        """Busy share of this stage's workers over the recent window, 0.0 to 1.0"""
+        now = time.perf_counter_ns()
+        since = now - self.window_ns
+        with self._lock:
+            while self._recent and self._recent[0][0] <= since:
+                self._recent.popleft()
+            busy = sum(min(busy_ns, finished - since) for finished, busy_ns in self._recent)
+            busy += sum(now - max(start, since) for start in self._active.values())
+        span = min(self.window_ns, now - self.started_ns) * self.workers
+        return min(1.0, busy / span) if span > 0 else 0.0
+    
+    def stats(self):
+        """Queue depth, occupancy and jobs run"""
+        occupancy = self.occupancy()
+        with self._lock:
+            processed, failed, busy_ns, active = self.processed, self.failed, self.busy_ns, len(self._active)
+        return {
+            'workers': self.workers,
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'active': active,
+            'occupancy': round(occupancy, 3),
+            'processed': processed,
+            'failed': failed,
+            'busy_seconds': round(busy_ns / 1e9, 6),
+            'mean_ms': round(busy_ns / 1e6 / processed, 3) if processed else None,
+        }
+
+class Pipeline:
+    """Runs jobs through a fixed sequence of stages, each on its own threads.
+    
+    Stages are connected by bounded queues. When a stage falls behind, the
+    queue in front of it fills up and the stage before it blocks handing
+    jobs on, so work backs up to submit() instead of piling up in memory,
+    while jobs further along keep moving: one job can be decoded while
+    another is in the model. A job is a dict that each stage function
+    fn(job) fills in further. Stage functions run in a copy of the
+    submitter's context, so stage timers and admission tickets apply as on
+    the request thread. A stage that sets job['done'] sends the job
+    straight to the last stage; one that raises fails the job with its
+    error.
+    """
+    
+    def __init__(self, stages, queue_size=4, timeout=30.0, window=10.0):
+        """stages is a list of (name, fn, workers)"""
+        if not stages:
+            raise ValueError('A pipeline needs at least one stage')
+        
+        self.timeout = timeout
+        self.stages = [PipelineStage(name, fn, workers, queue_size, window) for name, fn, workers in stages]
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        
+        self._threads = []
+        for index, stage in enumerate(self.stages):
+            threads = [threading.Thread(target=self._work, args=(index,), name=f'pipeline-{stage.name}-{n}',
+                                        daemon=True) for n in range(stage.workers)]
+            for thread in threads:
+                thread.start()
+            self._threads.append(threads)
+        logger.info("Pipeline started: " + ' -> '.join(f'{s.name} ({s.workers})' for s in self.stages))
+    
+    def submit(self, job):
+        """Queue a job dict at the first stage, returns it for result()"""
+        job['event'] = threading.Event()
+        job['context'] = copy_context()
+        job['error'] = None
+        job['done'] = False
+        with self._lock:
+            self.submitted += 1
+        try:
+            self.stages[0].queue.put(job, timeout=self.timeout)
+        except Full:
+            with self._lock:
+                self.submitted -= 1
+                self.rejected += 1
+            raise PipelineFullError(f'Pipeline queue full for {self.timeout}s')
+        return job
+    
+    def result(self, job):
+        """Wait for a submitted job to leave the last stage"""
+        if not job['event'].wait(self.timeout):
+            raise TimeoutError(f'Pipeline job timed out after {self.timeout}s')
+        if job['error'] is not None:
+            raise job['error']
+        return job
+    
+    def run(self, job):
+        """Send a job through every stage and wait for it"""
+        return self.result(self.submit(job))
+    
+    def _work(self, index):
+        """Stage worker loop: run jobs from the stage's queue and hand them on"""
+        stage = self.stages[index]
+        last = len(self.stages) - 1
+        while True:
+            job = stage.queue.get()
+            if job is None:
+                break
+            
+            start = stage.begin()
+            try:
+                job['context'].run(stage.fn, job)
+            except Exception as e:
+                job['error'] = e
+            stage.finish(start, job['error'] is not None)
+            
+            if job['error'] is not None or index == last:
+                with self._lock:
+                    self.completed += 1
+                    self.failed += job['error'] is not None
+                job['context'] = None
+                job['event'].set()
+            else:
+                # Blocks while the next stage is backed up
+                self.stages[last if job['done'] else index + 1].queue.put(job)
+    
+    def stats(self):
+        """Per-stage queue depth and occupancy, plus the busiest stage"""
+        stages = {stage.name: stage.stats() for stage in self.stages}
+        busiest = max(stages, key=lambda name: stages[name]['occupancy'])
+        with self._lock:
+            submitted, completed, failed, rejected = self.submitted, self.completed, self.failed, self.rejected
+        return {
+            'submitted': submitted,
+            'in_flight': submitted - completed,
+            'completed': completed,
+            'failed': failed,
+            'rejected': rejected,
+            'bottleneck': busiest if stages[busiest]['occupancy'] > 0 else None,
+            'stages': stages,
+        }
+    
+    def shutdown(self):
+        """Stop the stages front to back, each once the jobs queued ahead of it are done"""
+        for stage, threads in zip(self.stages, self._threads):
+            for _ in threads:
+                try:
+                    stage.queue.put(None, timeout=1.0)
+                except Full:
+                    pass
+            for thread in threads:
+                thread.join(timeout=1.0)
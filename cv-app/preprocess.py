@@ -0,0 +1,85 @@
+import threading
+from contextlib import contextmanager
+import numpy as np
+from detection import blob_from_frames
+
+class InputBuffer:
+    """One preallocated resize buffer plus an NCHW float32 blob, grown to the largest batch seen"""
+    
+    def __init__(self, input_size, scale, mean, swap_rb):
+        width, height = input_size
+        self.input_size = (width, height)
+        self.scale = np.float32(scale)
+        self.mean = np.float32(mean)
+        self.swap_rb = swap_rb
+        self.resized = np.empty((height, width, 3), dtype=np.uint8)
+        self.blob = np.empty((1, 3, height, width), dtype=np.float32)
+    
+    def fill(self, frames):
+        """Write frames into the blob, returns a view valid until the buffer is released.
+        
+        Same steps and float32 arithmetic as cv2.dnn.blobFromImages with
+        crop=False: bilinear resize of the 8-bit frame, then (pixel - mean)
+        * scale per channel, with B and R swapped when swap_rb is set.
+        """
+        import cv2
+        
+        if not self.supports(frames):
+            return blob_from_frames(frames, self.input_size, float(self.scale), float(self.mean), self.swap_rb)
+        if len(frames) > len(self.blob):
+            self.blob = np.empty((len(frames),) + self.blob.shape[1:], dtype=np.float32)
+        
+        for i, frame in enumerate(frames):
+            if frame.shape[1::-1] != self.input_size:
+                frame = cv2.resize(frame, self.input_size, dst=self.resized, interpolation=cv2.INTER_LINEAR)
+            channels = frame.transpose(2, 0, 1)
+            if self.swap_rb:
+                channels = channels[::-1]
+            np.subtract(channels, self.mean, out=self.blob[i], dtype=np.float32)
+            np.multiply(self.blob[i], self.scale, out=self.blob[i], dtype=np.float32)
+        return self.blob[:len(frames)]
+    
+    @staticmethod
+    def supports(frames):
+        """Whether frames are 8-bit BGR images; anything else goes through blobFromImages"""
+        return all(frame.dtype == np.uint8 and frame.ndim == 3 and frame.shape[2] == 3 for frame in frames)
+
+class InputBuffers:
+    """Free list of InputBuffers so concurrent requests never share one.
+    
+    A buffer is created only when every existing one is in use, so the
+    number allocated settles at the peak number of frames being prepared
+    at once and requests after that allocate nothing.
+    """
+    
+    def __init__(self, input_size, scale, mean, swap_rb=True):
+        self.input_size = tuple(input_size)
+        self.scale = scale
+        self.mean = mean
+        self.swap_rb = swap_rb
+        self._free = []
+        self._lock = threading.Lock()
+        self.created = 0
+    
+    def take(self):
+        """A free buffer, created if all are in use; hand it back with give()"""
+        with self._lock:
+            buffer = self._free.pop() if self._free else None
+            if buffer is None:
+                self.created += 1
+        if buffer is None:
+            buffer = InputBuffer(self.input_size, self.scale, self.mean, self.swap_rb)
+        return buffer
+    
+    def give(self, buffer):
+        with self._lock:
+            self._free.append(buffer)
+    
+    @contextmanager
+    def acquire(self):
+        """Borrow a buffer for the duration of the with-block"""
+        buffer = self.take()
+        try:
+            yield buffer
+        finally:
+            self.give(buffer)
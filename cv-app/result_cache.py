@@ -0,0 +1,102 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+def content_key(data, params, extra=b''):
+    """Cache key for raw upload bytes under the given detection parameters.
+    
+    extra distinguishes uploads whose meaning depends on more than their
+    bytes, such as raw pixel buffers with their dimensions and format.
+    """
+    digest = hashlib.blake2b(data, digest_size=16)
+    digest.update(params_fingerprint(params))
+    digest.update(extra)
+    return 'b:' + digest.hexdigest()
+
+def perceptual_key(frame, params, extra=b''):
+    """Cache key for a decoded frame that survives re-encoding and sensor noise.
+    
+    Uses a 64-bit average hash of the frame shrunk to 8x8 grayscale, plus the
+    frame size since boxes are returned in pixel coordinates. extra is as
+    for content_key().
+    """
+    import cv2
+    
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (8, 8), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small > small.mean()).tobytes()
+    digest = hashlib.blake2b(bits, digest_size=16)
+    digest.update(repr(frame.shape).encode())
+    digest.update(params_fingerprint(params))
+    digest.update(extra)
+    return 'p:' + digest.hexdigest()
+
+def params_fingerprint(params):
+    """Stable bytes for the detection parameters that change the result"""
+    classes = params.get('classes')
+    return repr((
+        params.get('confidence'),
+        None if classes is None else tuple(int(c) for c in classes),
+        params.get('max_detections'),
+        params.get('nms'),
+        params.get('nms_threshold'),
+        params.get('tiled'),
+    )).encode()
+
+class ResultCache:
+    """Bounded LRU cache of detection results with a time-to-live"""
+    
+    def __init__(self, max_size=256, ttl=30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        """Return the cached value or None, refreshing its LRU position"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries when full"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        """Drop all entries and reset counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+    
+    def stats(self):
+        """Hit/miss counters for sizing the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
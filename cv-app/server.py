@@ -0,0 +1,234 @@
+"""Pre-fork production server.
+
+    python server.py --workers 4 --port 5000
+
+The master process imports the app and loads and warms up the model once,
+then forks worker processes that inherit the loaded nets copy-on-write and
+accept connections from one shared listening socket. Each worker gets its
+own OpenCV thread count and, where the OS supports it, its own set of CPU
+cores, so workers do not oversubscribe the machine. The master restarts
+workers that exit or stop sending heartbeats.
+"""
+import argparse
+import gc
+import logging
+import mmap
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+
+logger = logging.getLogger('server')
+
+# Per-worker heartbeat slot in shared memory: time.monotonic() of the last beat
+HEARTBEAT = struct.Struct('d')
+
+def worker_cpus(worker_id, workers, cpus):
+    """Cores pinned to one worker: an even, contiguous share of cpus"""
+    cpus = sorted(cpus)
+    if len(cpus) < workers:
+        return [cpus[worker_id % len(cpus)]]
+    share = len(cpus) // workers
+    return cpus[worker_id * share:(worker_id + 1) * share]
+
+class PreforkServer:
+    """Master process that forks, watches and restarts HTTP worker processes"""
+    
+    def __init__(self, app_module, host='0.0.0.0', port=5000, workers=2, threads=None, pin_cpus=True,
+                 heartbeat_interval=1.0, heartbeat_timeout=30.0, graceful_timeout=10.0):
+        if workers < 1:
+            raise ValueError('Need at least one worker')
+        
+        self.app_module = app_module
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        self.pin_cpus = pin_cpus and hasattr(os, 'sched_setaffinity')
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.graceful_timeout = graceful_timeout
+        self._cpus = sorted(os.sched_getaffinity(0)) if self.pin_cpus else None
+        self._pids = [None] * workers
+        self._started = [0.0] * workers
+        self._fast_exits = [0] * workers  # consecutive exits soon after starting
+        self._heartbeats = mmap.mmap(-1, HEARTBEAT.size * workers)
+        self._socket = None
+        self.restarts = 0
+        self.running = False
+    
+    def bind(self):
+        """Open the listening socket every worker accepts from"""
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(128)
+        self._socket.set_inheritable(True)
+        self.port = self._socket.getsockname()[1]
+    
+    def run(self):
+        """Fork the workers and supervise them until SIGTERM or SIGINT"""
+        if self._socket is None:
+            self.bind()
+        
+        self.app_module.before_fork()
+        # Keep objects created so far out of the collector, so workers do not
+        # copy their pages just by walking them
+        gc.freeze()
+        
+        self.running = True
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        logger.info(f"Serving on {self.host}:{self.port} with {self.workers} workers, "
+                    f"{self.threads} OpenCV thread(s) each")
+        
+        for worker_id in range(self.workers):
+            self.spawn(worker_id)
+        
+        while self.running:
+            self.check_workers()
+            time.sleep(self.heartbeat_interval / 2)
+        
+        self.stop_workers()
+        self._socket.close()
+    
+    def _handle_stop(self, signum, frame):
+        self.running = False
+    
+    def spawn(self, worker_id):
+        """Fork one worker process"""
+        self._beat(worker_id)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self._worker_main(worker_id)
+                code = 0
+            except BaseException:
+                logger.exception(f"Worker {worker_id} failed")
+                code = 1
+            # Never fall back into the master's code or its atexit handlers
+            os._exit(code)
+        
+        self._pids[worker_id] = pid
+        self._started[worker_id] = time.monotonic()
+        logger.info(f"Worker {worker_id} started (pid {pid})")
+    
+    def check_workers(self):
+        """Reap exited workers, kill silent ones and start replacements"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid in self._pids:
+                worker_id = self._pids.index(pid)
+                self._pids[worker_id] = None
+                logger.warning(f"Worker {worker_id} (pid {pid}) exited with status {status}")
+                if self.running:
+                    self.restart(worker_id)
+        
+        now = time.monotonic()
+        for worker_id, pid in enumerate(self._pids):
+            if pid is not None and now - self._last_beat(worker_id) > self.heartbeat_timeout:
+                logger.warning(f"Worker {worker_id} (pid {pid}) missed heartbeats, killing it")
+                os.kill(pid, signal.SIGKILL)
+    
+    def restart(self, worker_id):
+        """Start a replacement, backing off while a worker keeps dying on startup"""
+        if time.monotonic() - self._started[worker_id] < 5.0:
+            self._fast_exits[worker_id] += 1
+        else:
+            self._fast_exits[worker_id] = 0
+        if self._fast_exits[worker_id] > 1:
+            time.sleep(min(2 ** self._fast_exits[worker_id], 30))
+        self.restarts += 1
+        self.spawn(worker_id)
+    
+    def stop_workers(self):
+        """Ask every worker to finish, then kill those that do not within graceful_timeout"""
+        for pid in self._pids:
+            if pid is not None:
+                os.kill(pid, signal.SIGTERM)
+        
+        deadline = time.monotonic() + self.graceful_timeout
+        while any(self._pids) and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid in self._pids:
+                self._pids[self._pids.index(pid)] = None
+            elif pid == 0:
+                time.sleep(0.05)
+        
+        for pid in self._pids:
+            if pid is not None:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+    
+    def _beat(self, worker_id):
+        HEARTBEAT.pack_into(self._heartbeats, worker_id * HEARTBEAT.size, time.monotonic())
+    
+    def _last_beat(self, worker_id):
+        return HEARTBEAT.unpack_from(self._heartbeats, worker_id * HEARTBEAT.size)[0]
+    
+    def _worker_main(self, worker_id):
+        """Body of a forked worker: pin cores, set up the app and serve requests"""
+        from werkzeug.serving import make_server
+        
+        # Ctrl-C reaches the whole process group; the master decides when workers stop
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        if self.pin_cpus:
+            os.sched_setaffinity(0, worker_cpus(worker_id, self.workers, self._cpus))
+        self.app_module.after_fork(self.threads)
+        
+        httpd = make_server(self.host, self.port, self.app_module.app, threaded=True,
+                            fd=self._socket.fileno())
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=httpd.shutdown).start())
+        
+        def beat():
+            while True:
+                self._beat(worker_id)
+                time.sleep(self.heartbeat_interval)
+        
+        threading.Thread(target=beat, name='heartbeat', daemon=True).start()
+        httpd.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', 2)),
+                        help='Worker processes to fork')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('WORKER_OPENCV_THREADS', 0)),
+                        help='OpenCV threads per worker (default: cores / workers)')
+    parser.add_argument('--no-pin', action='store_true', help='Do not pin workers to CPU cores')
+    parser.add_argument('--heartbeat-timeout', type=float, default=float(os.environ.get('WORKER_TIMEOUT', 30)),
+                        help='Seconds without a heartbeat before a worker is killed')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    
+    # The master only loads and warms the model; a single OpenCV thread keeps
+    # it from starting a thread pool that forked workers would inherit broken
+    os.environ['OPENCV_THREADS'] = '1'
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as cv_app
+    
+    server = PreforkServer(cv_app, args.host, args.port, args.workers, args.threads or None,
+                           pin_cpus=not args.no_pin, heartbeat_timeout=args.heartbeat_timeout)
+    server.bind()
+    
+    if not cv_app.wait_until_ready(300):
+        sys.exit(f"Detector did not become ready: {cv_app.startup}")
+    server.run()
+
+if __name__ == '__main__':
+    main()
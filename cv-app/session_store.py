@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import OrderedDict
+
+class SessionStore:
+    """Per-session state with idle-timeout and size-bounded eviction.
+    
+    Sessions are kept in last-seen order, so both the idle sweep and the
+    size cap only ever need to look at the front of the dict.
+    """
+    
+    def __init__(self, session_ttl=60.0, max_sessions=1024):
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session_id -> (last_seen, state)
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+    
+    def get(self, session_id, factory=None):
+        """Return a session's state, creating it with factory() if given"""
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                if factory is None:
+                    return None
+                entry = (now, factory())
+            self._store(session_id, now, entry[1])
+            return entry[1]
+    
+    def put(self, session_id, state):
+        """Replace a session's state"""
+        with self._lock:
+            self._store(session_id, time.monotonic(), state)
+    
+    def _store(self, session_id, now, state):
+        """Insert as most recently seen and enforce the size cap (lock held)"""
+        self._sessions[session_id] = (now, state)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+    
+    def _sweep(self, now):
+        """Evict idle sessions, at most once per second (lock held)"""
+        if now - self._last_sweep < 1.0:
+            return
+        self._last_sweep = now
+        while self._sessions:
+            last_seen, _ = next(iter(self._sessions.values()))
+            if now - last_seen <= self.session_ttl:
+                break
+            self._sessions.popitem(last=False)
+    
+    def items(self):
+        """Snapshot of (session_id, state) pairs, least recently seen first"""
+        with self._lock:
+            return [(session_id, state) for session_id, (_, state) in self._sessions.items()]
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Let `pytest tests` import the app modules without python -m or an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
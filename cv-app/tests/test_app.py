@@ -0,0 +1,987 @@
+import io
+import json
+import os
+import re
+import signal
+import socket
+import urllib.request
+import struct
+import subprocess
+import sys
+import threading
+import time
+import pytest
+import cv2
+import numpy as np
+import app as cv_app
+from detector_pool import DetectorPool, DetectorBusyError
+from inference_workers import InferenceWorkerPool, WorkerCrashedError
+from result_cache import ResultCache
+from engines import create_engine, parse_input_size
+from batch_scheduler import BatchScheduler
+from pipeline import Pipeline
+from fair_scheduler import FairScheduler, parse_session_values
+from admission import AdmissionController, FrameDropped, OverloadedError, current_frame
+from metrics import StageTimer, activate, deactivate, stage
+from detection import Detections, tile_grid, merge_tile_detections, image_size
+from mock_detector import MockDetector
+from server import worker_cpus
+from preprocess import InputBuffers
+from wire_format import PACKED_MIMETYPE, FLAG_MOCK, FLAG_NORMALIZED, FLAG_TRACKED, FLAG_TRACK_IDS, HEADER, pack_detections, unpack_detections
+
+def make_jpeg(width=320, height=240):
+    """Encode a synthetic frame as JPEG bytes"""
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    cv2.rectangle(frame, (40, 40), (width // 2, height // 2), (0, 255, 0), -1)
+    ok, buf = cv2.imencode('.jpg', frame)
+    assert ok
+    return buf.tobytes()
+
+@pytest.fixture
+def client():
+    cv_app.app.config['TESTING'] = True
+    assert cv_app.wait_until_ready(10)
+    if cv_app.result_cache:
+        cv_app.result_cache.clear()
+    with cv_app.app.test_client() as client:
+        yield client
+
+def test_mode(client):
+    """Test mode endpoint"""
+    response = client.get('/mode')
+    assert response.status_code == 200
+    assert 'mock_mode' in response.get_json()
+
+def test_detect_mock(client):
+    """Test single frame detection in mock mode"""
+    response = client.post('/detect', data={
+        'frame': (io.BytesIO(make_jpeg()), 'frame.jpg')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert isinstance(data['detections'], list)
+    assert 'latency_ms' in data
+
+def test_detect_invalid_image(client):
+    """Test that garbage bytes are rejected"""
+    response = client.post('/detect', data={
+        'frame': (io.BytesIO(b'not an image'), 'frame.jpg')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+def test_detect_batch(client):
+    """Test batched detection keeps input order"""
+    response = client.post('/detect/batch', data={
+        'frames': [(io.BytesIO(make_jpeg()), f'frame{i}.jpg') for i in range(3)]
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['batch_size'] == 3
+    assert [r['index'] for r in data['results']] == [0, 1, 2]
+
+def test_detect_batch_too_many(client):
+    """Test batch size limit"""
+    limit = cv_app.app.config['MAX_BATCH_FRAMES']
+    response = client.post('/detect/batch', data={
+        'frames': [(io.BytesIO(make_jpeg(32, 32)), f'f{i}.jpg') for i in range(limit + 1)]
+    }, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+def test_dnn_detect_batch_splits_by_image(monkeypatch):
+    """Test batched SSD output is split back into per-frame results"""
+    class FakeNet:
+        def setInput(self, blob):
+            self.batch = blob.shape[0]
+        
+        def forward(self):
+            # One 'person' row per image, tagged with its image id
+            rows = [[i, 0, 0.9, 0.1, 0.1, 0.5, 0.5] for i in range(self.batch)]
+            return np.array(rows, dtype=np.float32).reshape(1, 1, -1, 7)
+    
+    monkeypatch.setattr(cv_app, 'detector_pool', DetectorPool(FakeNet))
+    frames = [np.zeros((100, 200, 3), np.uint8), np.zeros((50, 50, 3), np.uint8)]
+    results = cv_app.dnn_detect_batch(frames)
+    assert len(results) == 2
+    assert results[0][0]['bbox'] == [20, 10, 80, 40]
+    assert results[1][0]['bbox'] == [5, 5, 20, 20]
+
+def test_parse_detections_filters_and_scales():
+    """Test thresholding, class filtering, scaling and top-k"""
+    rows = np.array([
+        [0, 0, 0.6, 0.1, 0.1, 0.5, 0.5],   # person
+        [0, 2, 0.9, 0.0, 0.0, 0.2, 0.4],   # car
+        [0, 2, 0.3, 0.0, 0.0, 0.2, 0.4],   # below threshold
+        [0, 999, 0.9, 0.0, 0.0, 0.2, 0.4], # unknown class
+    ], dtype=np.float32)
+    results = cv_app.parse_detections(rows, 200, 100, cv_app.detection_params())
+    assert [r['label'] for r in results] == ['car', 'person']
+    assert results[0]['bbox'] == [0, 0, 40, 40]
+    
+    params = cv_app.detection_params({'classes': 'person', 'max_detections': '1'})
+    results = cv_app.parse_detections(rows, 200, 100, params)
+    assert [r['label'] for r in results] == ['person']
+
+def test_parse_detections_nms():
+    """Test duplicate boxes of the same class are suppressed"""
+    rows = np.array([
+        [0, 0, 0.9, 0.10, 0.10, 0.50, 0.50],
+        [0, 0, 0.8, 0.11, 0.11, 0.51, 0.51],  # duplicate person
+        [0, 2, 0.7, 0.10, 0.10, 0.50, 0.50],  # car at same spot is kept
+    ], dtype=np.float32)
+    params = cv_app.detection_params({'nms': 'true'})
+    results = cv_app.parse_detections(rows, 100, 100, params)
+    assert [r['label'] for r in results] == ['person', 'car']
+
+def test_detect_invalid_params(client):
+    """Test bad post-processing parameters are rejected"""
+    response = client.post('/detect', data={
+        'frame': (io.BytesIO(make_jpeg()), 'frame.jpg'),
+        'confidence': '2'
+    }, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+def test_detector_pool_back_pressure():
+    """Test pool hands out distinct nets and rejects when exhausted"""
+    pool = DetectorPool(object, size=2, acquire_timeout=0.01)
+    with pool.acquire() as first, pool.acquire() as second:
+        assert first is not second
+        assert pool.stats()['available'] == 0
+        with pytest.raises(DetectorBusyError):
+            with pool.acquire():
+                pass
+    assert pool.stats() == {'size': 2, 'in_use': 0, 'available': 2, 'rejected': 1}
+
+def test_inference_workers_survive_crash():
+    """Test frames round-trip through shared memory and a dead worker is replaced"""
+    pool = InferenceWorkerPool(workers=1, slots=2, slot_bytes=300 * 300 * 3, use_model=False)
+    
+    def wait_for(condition):
+        deadline = time.monotonic() + 20
+        while not condition(pool.stats()):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    
+    try:
+        frame = np.zeros((240, 320, 3), np.uint8)
+        params = cv_app.detection_params()
+        assert isinstance(pool.detect(frame, params), Detections)
+        
+        # Dies while idle: the replacement still takes one frame at a time and no slot leaks
+        pool._processes[0].kill()
+        wait_for(lambda stats: stats['restarts'] == 1 and stats['warm'] == 1)
+        tickets = [pool.submit(frame, params) for _ in range(2)]
+        assert all(isinstance(pool.result(ticket), Detections) for ticket in tickets)
+        assert pool.stats()['free_slots'] == 2 and pool.stats()['pending'] == 0
+        
+        # Dies while holding a frame: the frame fails instead of timing out
+        os.kill(pool._processes[0].pid, signal.SIGSTOP)
+        ticket = pool.submit(frame, params)
+        wait_for(lambda stats: stats['busy'] == 1)
+        pool._processes[0].kill()
+        with pytest.raises(WorkerCrashedError):
+            pool.result(ticket)
+        
+        assert isinstance(pool.detect(frame, params), Detections)
+        stats = pool.stats()
+        assert stats['restarts'] == 2 and stats['free_slots'] == 2 and stats['pending'] == 0
+        
+        # Frames larger than a slot are resized to the model input, boxes stay in their pixels
+        detections = pool.detect(np.zeros((2160, 3840, 3), np.uint8), params)
+        assert len(detections) and (detections.boxes[:, 0] + detections.boxes[:, 2]).max() > 300
+        corners = detections.boxes[:, :2] + detections.boxes[:, 2:]
+        assert (detections.boxes[:, :2] >= 0).all() and (corners <= (3840, 2160)).all()
+    finally:
+        pool.shutdown()
+
+def test_stream_frame_reply():
+    """Test stream frames echo their sequence number"""
+    params = cv_app.detection_params()
+    reply = cv_app.detect_stream_frame(struct.pack('>I', 7) + make_jpeg(), params)
+    assert reply['seq'] == 7
+    assert isinstance(reply['detections'], list)
+    
+    assert cv_app.detect_stream_frame(struct.pack('>I', 8) + b'junk', params)['error'] == 'Invalid image'
+    assert cv_app.detect_stream_frame(b'\x00', params)['seq'] is None
+
+def test_detect_cache_hit(client):
+    """Test identical uploads are answered from the result cache"""
+    image = make_jpeg()
+    first = client.post('/detect', data={'frame': (io.BytesIO(image), 'frame.jpg')},
+                        content_type='multipart/form-data').get_json()
+    second = client.post('/detect', data={'frame': (io.BytesIO(image), 'frame.jpg')},
+                         content_type='multipart/form-data').get_json()
+    assert first['cached'] is False
+    assert second['cached'] is True
+    assert second['detections'] == first['detections']
+    assert cv_app.result_cache.stats()['hits'] == 1
+    
+    # Mock sessions keep their own detection streams, even for identical bytes
+    replies = [client.post('/detect', data={'frame': (io.BytesIO(image), 'frame.jpg'), 'session': session},
+                           content_type='multipart/form-data').get_json() for session in ('cache-a', 'cache-b')]
+    assert [reply['cached'] for reply in replies] == [False, not cv_app.mock_mode]
+    if cv_app.mock_mode:
+        expected = MockDetector(**cv_app.mock_detector.spec()).detect(np.zeros((240, 320, 3), np.uint8),
+                                                                      cv_app.detection_params(), 'cache-b')
+        assert replies[1]['detections'] == expected.to_dicts()
+
+def test_result_cache_lru_and_ttl(monkeypatch):
+    """Test least recently used entries are evicted and expired entries miss"""
+    cache = ResultCache(max_size=2, ttl=10)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.stats()['evictions'] == 1
+    
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+    assert cache.get('a') is None
+
+def test_detect_motion_gate_reuses_static_scene(client):
+    """Test a session's nearly identical frame reuses detections"""
+    frame = np.zeros((240, 320, 3), np.uint8)
+    cv2.rectangle(frame, (40, 40), (160, 120), (0, 255, 0), -1)
+    moved = frame.copy()
+    moved[0, 0] = 255  # different bytes, same scene
+    changed = np.full((240, 320, 3), 200, np.uint8)
+    
+    replies = []
+    for image in (frame, moved, changed):
+        ok, buf = cv2.imencode('.png', image)
+        replies.append(client.post('/detect', data={
+            'frame': (io.BytesIO(buf.tobytes()), 'frame.png'),
+            'session': 'cam-1'
+        }, content_type='multipart/form-data').get_json())
+    
+    assert [r['reused'] for r in replies] == [False, True, False]
+    assert replies[1]['detections'] == replies[0]['detections']
+
+def test_detect_tracking_between_keyframes(client, monkeypatch):
+    """Test only keyframes run the detector and track ids stay stable"""
+    calls = []
+    def fake_detection(frame, params, info=None):
+        calls.append(1)
+        return [{'label': 'person', 'confidence': 0.9, 'bbox': [100, 100, 80, 80]}]
+    monkeypatch.setattr(cv_app, 'run_detection', fake_detection)
+    
+    rng = np.random.default_rng(0)
+    scene = cv2.GaussianBlur((rng.random((240, 320)) * 255).astype(np.uint8), (5, 5), 0)
+    replies = []
+    for _ in range(4):
+        ok, buf = cv2.imencode('.png', cv2.cvtColor(scene, cv2.COLOR_GRAY2BGR))
+        replies.append(client.post('/detect', data={
+            'frame': (io.BytesIO(buf.tobytes()), 'frame.png'),
+            'session': 'tracked-cam',
+            'track': 'true'
+        }, content_type='multipart/form-data').get_json())
+    
+    assert len(calls) == 1
+    assert [r['tracked'] for r in replies] == [False, True, True, True]
+    assert {r['detections'][0]['track_id'] for r in replies} == {1}
+    
+    # Packed replies keep the track ids, on keyframes as well as tracker frames
+    packed = []
+    for _ in range(2):
+        packed.append(unpack_detections(client.post('/detect', data={
+            'frame': (io.BytesIO(buf.tobytes()), 'frame.png'),
+            'session': 'packed-cam',
+            'track': 'true'
+        }, content_type='multipart/form-data', headers={'Accept': PACKED_MIMETYPE}).data))
+    assert [header['flags'] & (FLAG_TRACKED | FLAG_TRACK_IDS) for header, _ in packed] == [
+        FLAG_TRACK_IDS, FLAG_TRACKED | FLAG_TRACK_IDS]
+    assert [unpacked.to_dicts() for _, unpacked in packed] == [
+        [{'label': 'person', 'confidence': 0.9, 'bbox': [100, 100, 80, 80], 'track_id': 1}]] * 2
+
+def test_reduced_decode_rescales_boxes(client, monkeypatch):
+    """Test large JPEGs decode at reduced size and boxes map back to full size"""
+    seen = []
+    def fake_detection(frame, params, info=None):
+        seen.append(frame.shape)
+        return [{'label': 'person', 'confidence': 0.9, 'bbox': [10, 20, 30, 40]}]
+    monkeypatch.setattr(cv_app, 'run_detection', fake_detection)
+    
+    image = make_jpeg(2560, 1440)
+    assert cv_app.jpeg_size(image) == (2560, 1440)
+    assert cv_app.reduced_decode_factor(2560, 1440) == 4
+    
+    data = client.post('/detect', data={'frame': (io.BytesIO(image), 'frame.jpg')},
+                       content_type='multipart/form-data').get_json()
+    assert seen == [(360, 640, 3)]
+    assert data['detections'][0]['bbox'] == [40, 80, 120, 160]
+
+def test_normalized_boxes_follow_exif_rotation(client, monkeypatch):
+    """Test normalized boxes use the decoded size of a rotated JPEG, on cache hits too"""
+    result = [{'label': 'person', 'confidence': 0.9, 'bbox': [10, 500, 300, 100]}]
+    monkeypatch.setattr(cv_app, 'run_detection', lambda frame, params, info=None: result)
+    monkeypatch.setattr(cv_app.mock_detector, 'detect_batch', lambda frames, params, session_id=None: [result])
+    monkeypatch.setattr(cv_app, 'dnn_detect_batch', lambda frames, params: [result])
+    
+    # EXIF orientation 6: stored landscape, decoded as portrait
+    tiff = b'II*\0' + struct.pack('<IHHHIHHI', 8, 1, 0x0112, 3, 1, 6, 0, 0)
+    image = make_jpeg(2560, 1440)
+    image = image[:2] + b'\xff\xe1' + struct.pack('>H', len(tiff) + 8) + b'Exif\0\0' + tiff + image[2:]
+    assert cv_app.jpeg_size(image) == (2560, 1440)
+    
+    expected = [0.0278, 0.7812, 0.8333, 0.1562]
+    for _ in range(2):
+        data = client.post('/detect', data={'frame': (io.BytesIO(image), 'frame.jpg'), 'normalized': 'true'},
+                           content_type='multipart/form-data').get_json()
+        assert data['detections'][0]['bbox'] == expected
+    assert data['cached'] is True
+    
+    header, unpacked = unpack_detections(client.post('/detect', data={
+        'frame': (io.BytesIO(image), 'frame.jpg'), 'normalized': 'true'
+    }, content_type='multipart/form-data', headers={'Accept': PACKED_MIMETYPE}).data)
+    assert np.allclose(unpacked.boxes, [expected], atol=1e-4)
+    
+    data = client.post('/detect/batch', data={'frames': [(io.BytesIO(image), 'frame.jpg')], 'normalized': 'true'},
+                       content_type='multipart/form-data').get_json()
+    assert data['results'][0]['detections'][0]['bbox'] == expected
+
+def test_detect_raw_pixels(client, monkeypatch):
+    """Test raw BGR and NV12 uploads skip image decoding"""
+    seen = []
+    def fake_detection(frame, params, info=None):
+        seen.append(frame)
+        return []
+    monkeypatch.setattr(cv_app, 'run_detection', fake_detection)
+    
+    frame = np.random.default_rng(0).integers(0, 255, (240, 320, 3), dtype=np.uint8)
+    response = client.post('/detect', data=frame.tobytes(), headers={
+        'Content-Type': 'application/octet-stream',
+        'X-Frame-Width': '320', 'X-Frame-Height': '240', 'X-Frame-Format': 'bgr'
+    })
+    assert response.status_code == 200
+    assert np.array_equal(seen[0], frame)
+    
+    yuv = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420)
+    response = client.post('/detect', data=yuv.tobytes(), headers={
+        'Content-Type': 'application/octet-stream',
+        'X-Frame-Width': '320', 'X-Frame-Height': '240', 'X-Frame-Format': 'i420'
+    })
+    assert response.status_code == 200
+    assert seen[1].shape == (240, 320, 3)
+    
+    response = client.post('/detect', data=b'\x00' * 10, headers={
+        'Content-Type': 'application/octet-stream',
+        'X-Frame-Width': '320', 'X-Frame-Height': '240'
+    })
+    assert response.status_code == 400
+    
+    monkeypatch.setitem(cv_app.app.config, 'MAX_CONTENT_LENGTH', 1024)
+    response = client.post('/detect', data=frame.tobytes(), headers={
+        'Content-Type': 'application/octet-stream',
+        'X-Frame-Width': '320', 'X-Frame-Height': '240'
+    })
+    assert response.status_code == 413
+    assert 'error' in response.get_json()
+
+def test_detect_server_timing_and_metrics(client):
+    """Test stage timings are reported in Server-Timing and on /metrics"""
+    response = client.post('/detect', data={
+        'frame': (io.BytesIO(make_jpeg()), 'frame.jpg')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    timing = dict(part.split(';dur=') for part in response.headers['Server-Timing'].split(', '))
+    for name in ('read', 'decode', 'forward', 'serialize', 'total'):
+        assert float(timing[name]) >= 0
+    
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE cvapp_stage_duration_seconds histogram' in text
+    assert 'cvapp_stage_duration_seconds_bucket{stage="decode",le="+Inf"}' in text
+    assert 'cvapp_request_duration_seconds_count{endpoint="/detect",status="200"}' in text
+
+def test_detect_waits_for_warm_detector(client, monkeypatch):
+    """Test /ready and /detect answer 503 until the detector is warm"""
+    response = client.get('/ready')
+    assert response.status_code == 200
+    assert response.get_json()['state'] == 'ready'
+    
+    monkeypatch.setattr(cv_app, 'model_ready', threading.Event())
+    monkeypatch.setitem(cv_app.startup, 'state', 'warming')
+    response = client.get('/ready')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    
+    response = client.post('/detect', data={
+        'frame': (io.BytesIO(make_jpeg()), 'frame.jpg')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 503
+    assert 'Retry-After' in response.headers
+    assert client.get('/mode').status_code == 200
+
+def test_import_does_not_load_opencv(tmp_path):
+    """Test the app imports without cv2 so / and /mode serve immediately"""
+    # Run outside the app directory so no model files are found and the
+    # background loader settles in mock mode
+    script = (f"import sys; sys.path.insert(0, {cv_app.app.root_path!r}); import app; "
+              "app.wait_until_ready(10); print('cv2' in sys.modules)")
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                            cwd=tmp_path, check=True)
+    assert result.stdout.strip() == 'False'
+
+def test_engines_configure_input_and_track_latency():
+    """Test engine selection, input size and per-engine forward stats"""
+    class FakeNet:
+        def setInput(self, blob):
+            self.shape = blob.shape
+        
+        def forward(self):
+            return np.array([[0, 0, 0.9, 0.1, 0.1, 0.5, 0.5]], dtype=np.float32).reshape(1, 1, -1, 7)
+    
+    assert parse_input_size('224') == (224, 224)
+    assert parse_input_size('320x240') == (320, 240)
+    with pytest.raises(ValueError):
+        create_engine('caffe')
+    
+    engine = create_engine('onnx-int8', model='models/none.onnx', input_size=(320, 320))
+    assert not engine.files_present()
+    net = FakeNet()
+    detections = engine.detect(net, np.zeros((240, 320, 3), np.uint8), cv_app.detection_params())
+    assert net.shape == (1, 3, 320, 320)
+    assert detections[0]['bbox'] == [32, 24, 128, 96]
+    
+    stats = engine.stats()
+    assert stats['name'] == 'onnx-int8'
+    assert stats['forwards'] == 1 and stats['p50_ms'] is not None
+
+def test_batch_scheduler_groups_concurrent_frames():
+    """Test concurrent frames share batches and each caller gets its own result"""
+    sizes = []
+    def run_batch(frames, params_list, session_ids):
+        sizes.append(len(frames))
+        time.sleep(0.01)
+        return [[{'label': params['id']}] for params in params_list]
+    
+    scheduler = BatchScheduler(run_batch, window_ms=20, max_batch=4)
+    frame = np.zeros((10, 10, 3), np.uint8)
+    results = [None] * 8
+    def caller(i):
+        results[i] = scheduler.detect(frame, {'id': i})
+    
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    scheduler.shutdown()
+    
+    assert results == [[{'label': i}] for i in range(8)]
+    assert max(sizes) > 1 and max(sizes) <= 4 and sum(sizes) == 8
+    stats = scheduler.stats()
+    assert stats['batches'] == len(sizes)
+    assert stats['queue_delay_mean_ms'] is not None
+
+def test_load_shedding_deadlines_latest_only_and_cap(client):
+    """Test expired and superseded frames are dropped and the in-flight cap holds"""
+    response = client.post('/detect', data={
+        'frame': (io.BytesIO(make_jpeg()), 'frame.jpg'), 'deadline_ms': '0.001'
+    }, content_type='multipart/form-data')
+    assert response.status_code == cv_app.DROPPED_STATUS
+    assert response.get_json()['reason'] == 'expired'
+    
+    controller = AdmissionController(max_in_flight=2)
+    with controller.admit(session_id='cam', latest_only=True):
+        older = current_frame()
+        with controller.admit(session_id='cam', latest_only=True):
+            current_frame().check()
+            with pytest.raises(OverloadedError):
+                with controller.admit():
+                    pass
+        with pytest.raises(FrameDropped) as dropped:
+            older.check()
+    assert dropped.value.reason == 'superseded'
+    assert controller.stats()['rejected'] == 1
+
+def test_detect_video_streams_ndjson(client, tmp_path, monkeypatch):
+    """Test a video upload is answered with one NDJSON line per strided frame"""
+    path = str(tmp_path / 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (320, 240))
+    for i in range(10):
+        frame = np.full((240, 320, 3), i * 20, np.uint8)
+        writer.write(frame)
+    writer.release()
+    
+    with open(path, 'rb') as f:
+        response = client.post('/detect/video', data={
+            'video': (f, 'clip.avi'), 'stride': '3'
+        }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    
+    assert records[0]['video']['stride'] == 3
+    assert [r['frame'] for r in records[1:-1]] == [0, 3, 6, 9]
+    assert records[2]['timestamp_ms'] == 300.0
+    assert all(isinstance(r['detections'], list) for r in records[1:-1])
+    assert records[-1]['done'] and records[-1]['frames_processed'] == 4
+    assert cv_app.admission.stats()['in_flight'] == 0
+    
+    # A video stream counts against the in-flight cap and its upload is still removed
+    upload_folder = tmp_path / 'uploads'
+    monkeypatch.setitem(cv_app.app.config, 'UPLOAD_FOLDER', str(upload_folder))
+    monkeypatch.setattr(cv_app, 'admission', AdmissionController(max_in_flight=1))
+    with cv_app.admission.admit():
+        with open(path, 'rb') as f:
+            response = client.post('/detect/video', data={'video': (f, 'clip.avi')},
+                                   content_type='multipart/form-data')
+    assert response.status_code == 503
+    assert os.listdir(upload_folder) == []
+    
+    response = client.post('/detect/video', data={'path': 'clip.avi'})
+    assert response.status_code == 400
+
+def test_tiled_detection_merges_tiles(client, monkeypatch):
+    """Test tiles cover the frame and duplicate boxes from overlapping tiles are merged"""
+    tiles = tile_grid(1920, 1080, 640, overlap=0.25, max_tiles=16)
+    assert len(tiles) == 8
+    assert max(x + w for x, y, w, h in tiles) == 1920
+    assert max(y + h for x, y, w, h in tiles) == 1080
+    assert len(tile_grid(1920, 1080, 640, max_tiles=2)) <= 2
+    assert tile_grid(320, 240, 640) == [(0, 0, 320, 240)]
+    
+    params = cv_app.detection_params()
+    same_car = Detections.from_dicts([{'label': 'car', 'confidence': 0.9, 'bbox': [600, 10, 50, 40]}])
+    shifted = Detections.from_dicts([{'label': 'car', 'confidence': 0.8, 'bbox': [120, 10, 50, 40]}])
+    merged = merge_tile_detections([same_car, shifted], [(0, 0, 640, 640), (480, 0, 640, 640)], params)
+    assert merged == same_car
+    
+    response = client.post('/detect', data={
+        'frame': (io.BytesIO(make_jpeg(1920, 1080)), 'frame.jpg'), 'tiled': 'true'
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['tiles'] == 8
+    for det in data['detections']:
+        x, y, w, h = det['bbox']
+        assert 0 <= x and x + w <= 1920 and 0 <= y and y + h <= 1080
+    
+    # Worker processes get every tile and the whole 4K view through slots that only hold one model input
+    pool = InferenceWorkerPool(workers=1, slot_bytes=300 * 300 * 3, use_model=False)
+    monkeypatch.setattr(cv_app, 'worker_pool', pool)
+    try:
+        response = client.post('/detect', data={
+            'frame': (io.BytesIO(make_jpeg(3840, 2160)), 'frame.jpg'), 'tiled': 'true'
+        }, content_type='multipart/form-data')
+    finally:
+        pool.shutdown()
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['tiles'] > 1 and data['detections']
+    for det in data['detections']:
+        x, y, w, h = det['bbox']
+        assert 0 <= x and x + w <= 3840 and 0 <= y and y + h <= 2160
+
+def test_detect_packed_binary_response(client):
+    """Test Accept negotiates packed binary columns that decode to the JSON result"""
+    rows = np.array([
+        [0, 2, 0.91, 0.05, 0.1, 0.8, 0.85],
+        [0, 0, 0.6, 0.5, 0.25, 0.7, 0.85],
+    ], dtype=np.float32)
+    detections = cv_app.parse_detections(rows, 400, 200, cv_app.detection_params())
+    data = pack_detections(detections, 12.5, FLAG_MOCK, 1)
+    assert len(data) == HEADER.size + 2 * (4 + 16 + 2)
+    header, unpacked = unpack_detections(data)
+    assert header == {'flags': FLAG_MOCK, 'tiles': 1, 'count': 2, 'latency_ms': 12.5}
+    assert unpacked == detections
+    assert unpacked.to_dicts() == [
+        {'label': 'car', 'confidence': 0.91, 'bbox': [20, 20, 300, 150]},
+        {'label': 'person', 'confidence': 0.6, 'bbox': [200, 50, 80, 120]},
+    ]
+    
+    header, unpacked = unpack_detections(pack_detections(detections, size=(400, 200)))
+    assert header['flags'] == FLAG_NORMALIZED
+    assert np.allclose(unpacked.boxes, [[0.05, 0.1, 0.75, 0.75], [0.5, 0.25, 0.2, 0.6]])
+    
+    response = client.post('/detect', data={
+        'frame': (io.BytesIO(make_jpeg()), 'frame.jpg')
+    }, content_type='multipart/form-data', headers={'Accept': PACKED_MIMETYPE})
+    assert response.status_code == 200
+    assert response.mimetype == PACKED_MIMETYPE
+    assert 'Accept' in response.headers['Vary']
+    header, unpacked = unpack_detections(response.data)
+    assert header['count'] == len(unpacked)
+    assert header['flags'] & FLAG_MOCK == (FLAG_MOCK if cv_app.mock_mode else 0)
+    
+    response = client.post('/detect', data={
+        'frame': (io.BytesIO(make_jpeg()), 'frame.jpg'), 'normalized': 'true'
+    }, content_type='multipart/form-data', headers={'Accept': PACKED_MIMETYPE})
+    header, unpacked = unpack_detections(response.data)
+    assert header['flags'] & FLAG_NORMALIZED
+    assert ((unpacked.boxes >= 0) & (unpacked.boxes <= 1)).all()
+    
+    response = client.post('/detect', data={
+        'frame': (io.BytesIO(make_jpeg()), 'frame.jpg')
+    }, content_type='multipart/form-data', headers={'Accept': '*/*'})
+    assert response.mimetype == 'application/json'
+
+def test_mock_detector_is_seeded_per_session(tmp_path):
+    """Test mock detections replay per session and latency follows the configured model"""
+    frame = np.zeros((240, 320, 3), np.uint8)
+    params = cv_app.detection_params()
+    
+    first = MockDetector(seed=7, min_detections=3, max_detections=3)
+    a = [first.detect(frame, params, 'cam-a') for _ in range(3)]
+    
+    second = MockDetector(seed=7, min_detections=3, max_detections=3)
+    second.detect(frame, params, 'cam-b')
+    assert [second.detect(frame, params, 'cam-a') for _ in range(3)] == a
+    assert all(len(detections) == 3 for detections in a)
+    assert MockDetector(seed=8).detect(frame, params, 'cam-a') != a[0]
+    for det in a[0]:
+        x, y, w, h = det['bbox']
+        assert 0 <= x and x + w <= 320 and 0 <= y and y + h <= 240
+    
+    trace = tmp_path / 'latency.txt'
+    trace.write_text('# ms\n1.5\n0\n')
+    replay = MockDetector(latency='trace', trace=str(trace))
+    assert [replay.sample_latency() for _ in range(3)] == [1.5, 0.0, 1.5]
+    assert MockDetector(latency='fixed', latency_ms=4).sample_latency() == 4
+    with pytest.raises(ValueError):
+        MockDetector(latency='uniform')
+
+def test_mock_sessions_through_workers_and_batching(monkeypatch):
+    """Test worker processes and micro-batches keep each session on its own mock stream"""
+    frame = np.zeros((240, 320, 3), np.uint8)
+    params = cv_app.detection_params()
+    spec = cv_app.mock_detector.spec()
+    
+    def session_results(sessions):
+        results = []
+        for session_id in sessions:
+            with cv_app.admission.admit(session_id=session_id):
+                results.append(cv_app.run_inference(frame, params))
+        return results
+    
+    def expected(sessions):
+        mock = MockDetector(**spec)
+        return [mock.detect(frame, params, session_id) for session_id in sessions]
+    
+    monkeypatch.setattr(cv_app, 'batch_scheduler', BatchScheduler(cv_app.detect_frames, window_ms=1))
+    try:
+        sessions = ['batch-a', 'batch-b', 'batch-a']
+        assert session_results(sessions) == expected(sessions)
+    finally:
+        cv_app.batch_scheduler.shutdown()
+    
+    pool = InferenceWorkerPool(workers=1, slot_bytes=300 * 300 * 3, use_model=False, mock=MockDetector(**spec))
+    monkeypatch.setattr(cv_app, 'worker_pool', pool)
+    try:
+        sessions = ['worker-a', 'worker-b', 'worker-a']
+        assert session_results(sessions) == expected(sessions)
+    finally:
+        pool.shutdown()
+
+def test_prefork_server_restarts_workers(tmp_path):
+    """Test forked workers serve from one socket, are replaced when killed and stop on SIGTERM"""
+    assert worker_cpus(1, 2, range(8)) == [4, 5, 6, 7]
+    assert worker_cpus(3, 4, [0, 1]) == [1]
+    
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(cv_app.__file__), 'server.py'),
+         '--host', '127.0.0.1', '--port', str(port), '--workers', '2'],
+        cwd=tmp_path, stderr=subprocess.PIPE, text=True
+    )
+    started = []
+    
+    def read_log():
+        for line in server.stderr:
+            match = re.search(r'Worker (\d) started \(pid (\d+)\)', line)
+            if match:
+                started.append((int(match.group(1)), int(match.group(2))))
+    
+    threading.Thread(target=read_log, daemon=True).start()
+    try:
+        deadline = time.monotonic() + 20
+        while len(started) < 2:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        
+        while True:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/ready', timeout=2) as response:
+                    assert response.status == 200
+                break
+            except OSError:
+                assert time.monotonic() < deadline
+                time.sleep(0.1)
+        
+        os.kill(started[0][1], signal.SIGKILL)
+        while len(started) < 3:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        assert started[2][0] == started[0][0] and started[2][1] != started[0][1]
+        
+        server.terminate()
+        assert server.wait(15) == 0
+    finally:
+        if server.poll() is None:
+            server.kill()
+
+def test_capabilities_and_normalized_boxes(client, monkeypatch):
+    """Test clients are told the model input and an adaptive frame rate, and can get normalized boxes"""
+    data = client.get('/capabilities').get_json()
+    assert data['input_size'] == list(cv_app.engine.input_size)
+    assert data['suggested']['width'] == cv_app.engine.input_size[0]
+    assert data['preferred_encoding'] == 'image/jpeg'
+    low, high = cv_app.app.config['SUGGESTED_MIN_FPS'], cv_app.app.config['SUGGESTED_MAX_FPS']
+    assert low <= data['suggested']['fps'] <= high
+    
+    assert cv_app.suggested_fps(None) == high
+    assert cv_app.suggested_fps(0.01) == low
+    assert cv_app.suggested_fps(1000.0) == high
+    assert cv_app.suggested_fps(10.0, forwards=5) == max(low, 2.0)
+    assert cv_app.client_capacity_fps({'p50': 50.0}, 4) == cv_app.inference_slots() * 5.0
+    
+    # Active clients are sessions, or addresses without one, seen within the window
+    controller = AdmissionController(active_window=5.0)
+    for session_id, address in (('cam-1', None), ('cam-2', None), ('cam-1', None), (None, '10.0.0.7'), (None, None)):
+        with controller.admit(session_id=session_id, client=address):
+            pass
+    assert controller.active_clients() == 3
+    
+    # Tiled full resolution is only suggested while inference keeps up with the clients
+    monkeypatch.setitem(cv_app.app.config, 'TILING', 'true')
+    monkeypatch.setattr(cv_app.admission, 'active_clients', lambda: 2)
+    for p50, full_resolution in ((1.0, True), (1000.0, False)):
+        monkeypatch.setattr(cv_app, 'inference_latency_ms', lambda: {'p50': p50, 'p95': p50, 'samples': 1})
+        data = client.get('/capabilities').get_json()
+        assert data['active_clients'] == 2
+        assert (data['suggested']['width'] is None) == full_resolution
+    assert data['suggested']['fps'] == low
+    
+    # The forward passes come from the tile grid of the client's native size, TILE_MAX tiles without one
+    assert [cv_app.tiled_forwards(*size) for size in ((640, 480), (1920, 1080), (3840, 2160))] == [1, 9, 16]
+    monkeypatch.setattr(cv_app, 'inference_latency_ms', lambda: {'p50': 50.0, 'p95': 50.0, 'samples': 1})
+    slots = cv_app.inference_slots()
+    for query, forwards in (('?width=640&height=480', 1), ('?width=1920&height=1080', 9),
+                            ('?width=3840&height=2160', 16), ('', cv_app.app.config['TILE_MAX'] + 1)):
+        data = client.get('/capabilities' + query).get_json()
+        capacity = slots * 10.0
+        full_resolution = capacity / forwards >= low
+        assert (data['suggested']['width'] is None) == full_resolution
+        assert data['suggested']['fps'] == cv_app.suggested_fps(capacity, forwards if full_resolution else 1)
+    for query in ('?width=1920', '?width=0&height=1080', '?width=wide&height=1080'):
+        assert client.get('/capabilities' + query).status_code == 400
+    
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 6)
+    assert controller.active_clients() == 0
+    
+    ok, png = cv2.imencode('.png', np.zeros((48, 64, 3), np.uint8))
+    assert image_size(png.tobytes()) == (64, 48)
+    assert image_size(make_jpeg(640, 480)) == (640, 480)
+    
+    response = client.post('/detect', data={
+        'frame': (io.BytesIO(make_jpeg(640, 480)), 'frame.jpg'), 'normalized': 'true'
+    }, content_type='multipart/form-data')
+    data = response.get_json()
+    assert data['normalized'] is True
+    for det in data['detections']:
+        x, y, w, h = det['bbox']
+        assert 0 <= x <= 1 and 0 <= y <= 1 and 0 < x + w <= 1 and 0 < y + h <= 1
+
+def test_input_buffers_match_blob_from_image():
+    """Test reused preprocessing buffers give bit-identical blobs without new allocations"""
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (h, w, 3), dtype=np.uint8) for w, h in ((640, 480), (300, 300), (97, 203))]
+    
+    for size, swap_rb in (((300, 300), True), ((320, 240), False)):
+        buffers = InputBuffers(size, 1 / 127.5, 127.5, swap_rb)
+        for _ in range(2):
+            with buffers.acquire() as buffer:
+                expected = cv2.dnn.blobFromImages(frames, 1 / 127.5, size, [127.5] * 3, swapRB=swap_rb, crop=False)
+                assert np.array_equal(buffer.fill(frames), expected)
+                single = buffer.fill(frames[:1])
+                assert np.array_equal(single, expected[:1])
+                assert np.shares_memory(single, buffer.blob)
+        assert buffers.created == 1
+    
+    with buffers.acquire() as buffer:
+        gray = np.zeros((240, 320), np.uint8)
+        assert buffer.fill([gray]).shape == (1, 1, 240, 320)
+
+def test_pipeline_stages_overlap_and_report_bottleneck():
+    """Test pipelined jobs overlap across stages, skip ahead when done and surface errors"""
+    def decode(job):
+        if job['id'] == 'bad':
+            raise ValueError('Invalid image')
+        job['done'] = job['id'] == 'cached'
+    
+    def infer(job):
+        with stage('forward'):
+            time.sleep(0.02)
+        job['result'] = job['id']
+    
+    pipeline = Pipeline([('decode', decode, 1), ('inference', infer, 1), ('serialize', lambda job: None, 1)],
+                        queue_size=2)
+    results = {}
+    def caller(i):
+        results[i] = pipeline.run({'id': i})['result']
+    
+    started = time.perf_counter()
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {i: i for i in range(6)}
+    assert time.perf_counter() - started < 6 * 0.02 + 0.1
+    
+    # Stage functions run in the submitter's context
+    timer = StageTimer()
+    token = activate(timer)
+    try:
+        assert 'result' not in pipeline.run({'id': 'cached'})
+        pipeline.run({'id': 'timed'})
+    finally:
+        deactivate(token)
+    assert timer.stages['forward'] >= 0.02 * 1e9
+    with pytest.raises(ValueError):
+        pipeline.run({'id': 'bad'})
+    
+    stats = pipeline.stats()
+    pipeline.shutdown()
+    assert stats['bottleneck'] == 'inference'
+    assert stats['completed'] == 9 and stats['failed'] == 1 and stats['in_flight'] == 0
+    assert stats['stages']['decode']['processed'] == 9
+    assert stats['stages']['inference']['processed'] == 7
+    assert stats['stages']['serialize']['processed'] == 8
+    assert stats['stages']['inference']['occupancy'] > stats['stages']['decode']['occupancy']
+    assert all(entry['queue_depth'] == 0 and entry['queue_size'] == 2 for entry in stats['stages'].values())
+
+def test_detect_pipelined(client, monkeypatch):
+    """Test /detect and stream frames run on the pipeline with per-stage stats"""
+    monkeypatch.setattr(cv_app, 'pipeline', None)
+    cv_app.start_pipeline()
+    try:
+        responses = [None] * 4
+        def post(i):
+            with cv_app.app.test_client() as c:
+                responses[i] = c.post('/detect', data={
+                    'frame': (io.BytesIO(make_jpeg(320 + 16 * i)), 'frame.jpg')
+                }, content_type='multipart/form-data')
+        
+        threads = [threading.Thread(target=post, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for response in responses:
+            assert response.status_code == 200
+            assert response.get_json()['detections']
+            assert 'decode;' in response.headers['Server-Timing']
+            assert 'forward;' in response.headers['Server-Timing']
+        
+        response = client.post('/detect', data={
+            'frame': (io.BytesIO(b'not an image'), 'frame.jpg')
+        }, content_type='multipart/form-data')
+        assert response.status_code == 400
+        
+        # Same bytes as the first upload: answered from the cache, skipping preprocess and inference
+        message = struct.pack('>I', 7) + make_jpeg()
+        reply = cv_app.detect_stream_frame(message, cv_app.detection_params())
+        assert reply['seq'] == 7 and reply['detections'] and reply['cached']
+        
+        stats = client.get('/mode').get_json()['pipeline']
+        assert stats['completed'] == 6 and stats['failed'] == 0
+        assert set(stats['stages']) == {'decode', 'preprocess', 'inference', 'serialize'}
+        assert stats['stages']['inference']['processed'] == 4
+        assert stats['stages']['serialize']['processed'] == 6
+        metrics = client.get('/metrics').get_data(as_text=True)
+        assert 'cvapp_pipeline_queue_depth{stage="inference"} 0' in metrics
+        assert 'cvapp_pipeline_stage_occupancy{stage="decode"}' in metrics
+    finally:
+        cv_app.pipeline.shutdown()
+
+def test_fair_scheduler_round_robin_priorities_and_caps():
+    """Test waiting frames take turns by session weighted by priority, with bounded queues and FPS caps"""
+    scheduler = FairScheduler(slots=1, max_queued=3, priorities={'b': 2}, fps_caps={'capped': 1})
+    assert parse_session_values('a=2, b=0.5') == {'a': 2.0, 'b': 0.5}
+    with pytest.raises(ValueError):
+        parse_session_values('a')
+    
+    order = []
+    dropped = []
+    def frame(session_id, name, check=None):
+        try:
+            with scheduler.turn(session_id, check=check):
+                order.append(name)
+        except FrameDropped as e:
+            dropped.append((name, e.reason))
+    
+    def expired():
+        raise FrameDropped('expired')
+    
+    def wait_for(condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            assert time.monotonic() < deadline
+            time.sleep(0.001)
+    
+    # Hold the only slot while frames queue up, one at a time so their order is known
+    release = threading.Event()
+    def holder():
+        with scheduler.turn('holder'):
+            release.wait()
+    threads = [threading.Thread(target=holder)]
+    threads[0].start()
+    wait_for(lambda: scheduler.in_use == 1)
+    frames = [('a', 'a1'), ('a', 'a2'), ('a', 'a3'), ('b', 'b1'), ('b', 'b2'), ('b', 'b3'), ('c', 'c1', expired),
+              ('a', 'a4')]
+    for i, args in enumerate(frames):
+        threads.append(threading.Thread(target=frame, args=args))
+        threads[-1].start()
+        wait_for(lambda: scheduler.stats()['waiting'] + scheduler.dropped == i + 1)
+    
+    release.set()
+    for thread in threads:
+        thread.join()
+    # b has twice a's priority; a1 was displaced by a4, c1 expired while waiting
+    assert order == ['a2', 'b1', 'b2', 'a3', 'b3', 'a4']
+    assert sorted(dropped) == [('a1', 'superseded'), ('c1', 'expired')]
+    
+    frame('capped', 'x1')
+    frame('capped', 'x2')
+    frame('capped', 'x3')
+    assert dropped[-1] == ('x3', 'throttled')
+    
+    stats = scheduler.stats()
+    assert stats['in_use'] == 0 and stats['waiting'] == 0
+    assert stats['sessions']['a']['served'] == 3 and stats['sessions']['a']['dropped'] == 1
+    assert stats['sessions']['b']['served'] == 3 and stats['sessions']['b']['priority'] == 2
+    assert stats['sessions']['capped']['served'] == 2 and stats['sessions']['capped']['throttled'] == 1
+    assert stats['sessions']['a']['wait_p95_ms'] > 0
+
+def test_detect_fair_scheduling_caps_sessions(client, monkeypatch):
+    """Test a capped session's extra frames are dropped as throttled without affecting other sessions"""
+    monkeypatch.setattr(cv_app, 'fair_scheduler', FairScheduler(slots=1, fps_caps={'cam-capped': 0.5}))
+    rng = np.random.default_rng(0)
+    def post(session_id):
+        ok, buf = cv2.imencode('.jpg', rng.integers(0, 256, (240, 320, 3), dtype=np.uint8))
+        return client.post('/detect', data={
+            'frame': (io.BytesIO(buf.tobytes()), 'frame.jpg'), 'session': session_id
+        }, content_type='multipart/form-data')
+    
+    responses = [post('cam-capped') for _ in range(3)]
+    assert [response.status_code for response in responses] == [200, 200, cv_app.DROPPED_STATUS]
+    assert responses[2].get_json()['reason'] == 'throttled'
+    assert 'schedule;' in responses[0].headers['Server-Timing']
+    assert post('cam-free').status_code == 200
+    
+    stats = client.get('/mode').get_json()['fair_scheduler']
+    assert stats['sessions']['cam-capped']['served'] == 2
+    assert stats['sessions']['cam-capped']['throttled'] == 1
+    assert stats['sessions']['cam-free']['served'] == 1
+    capabilities = client.get('/capabilities?session=cam-capped').get_json()
+    assert capabilities['fps_cap'] == 0.5 and capabilities['suggested']['fps'] == 0.5
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert 'cvapp_session_frames_served_total{session="cam-capped"} 2' in metrics
+    assert 'cvapp_session_frames_dropped_total{session="cam-capped"} 1' in metrics
@@ -0,0 +1,214 @@
+import threading
+import numpy as np
+from session_store import SessionStore
+
+# Frames are tracked at reduced resolution; boxes stay in original pixels
+TRACK_MAX_SIDE = 320
+
+# Forward-backward optical flow error (in tracking pixels) for a point to count
+MAX_FB_ERROR = 1.0
+
+def iou(a, b):
+    """Intersection over union of two [x, y, w, h] boxes"""
+    x1 = max(a[0], b[0])
+    y1 = max(a[1], b[1])
+    x2 = min(a[0] + a[2], b[0] + b[2])
+    y2 = min(a[1] + a[3], b[1] + b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union > 0 else 0.0
+
+class SessionTracker:
+    """Keyframe detection with optical-flow tracking in between for one session.
+    
+    The model runs every `interval` frames. In between, each box is moved by
+    the median motion of feature points tracked with pyramidal Lucas-Kanade
+    flow, checked forward and backward. A track's confidence is the share of
+    its points that survive that check; when the weakest track falls below
+    min_confidence a re-detect is forced and the interval is halved.
+    Intervals that complete cleanly grow it again up to max_interval.
+    """
+    
+    def __init__(self, interval=5, min_interval=2, max_interval=15, min_confidence=0.5):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.min_confidence = min_confidence
+        self.lock = threading.Lock()
+        self.tracks = []
+        self.prev_gray = None
+        self.shape = None
+        self.scale = 1.0
+        self.frames_since_detect = 0
+        self.next_id = 1
+        self.forced = 0
+        self._force_pending = False
+    
+    def prepare(self, frame):
+        """Downscaled grayscale frame used for flow"""
+        import cv2
+        
+        height, width = frame.shape[:2]
+        self.scale = min(1.0, TRACK_MAX_SIDE / max(height, width))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        if self.scale < 1.0:
+            gray = cv2.resize(gray, (int(width * self.scale), int(height * self.scale)),
+                              interpolation=cv2.INTER_AREA)
+        return gray
+    
+    def needs_detection(self, frame):
+        """Whether this frame should be a keyframe"""
+        return (self.prev_gray is None or frame.shape != self.shape
+                or self.frames_since_detect >= self.interval)
+    
+    def on_detections(self, frame, gray, detections):
+        """Start a new interval from fresh detections, keeping track ids.
+        
+        Detections are matched greedily to existing tracks of the same label
+        by IoU; unmatched detections get new ids, unmatched tracks end.
+        """
+        if self._force_pending:
+            self._force_pending = False
+        elif self.prev_gray is not None and self.frames_since_detect >= self.interval:
+            # A full interval went by without a forced re-detect
+            self.interval = min(self.max_interval, self.interval + 1)
+        
+        candidates = []
+        for d_index, det in enumerate(detections):
+            for t_index, track in enumerate(self.tracks):
+                if track['label'] == det['label']:
+                    overlap = iou(track['bbox'], det['bbox'])
+                    if overlap >= 0.3:
+                        candidates.append((overlap, d_index, t_index))
+        candidates.sort(reverse=True)
+        
+        assigned = {}
+        used_tracks = set()
+        for _, d_index, t_index in candidates:
+            if d_index in assigned or t_index in used_tracks:
+                continue
+            assigned[d_index] = self.tracks[t_index]['track_id']
+            used_tracks.add(t_index)
+        
+        tracks = []
+        for d_index, det in enumerate(detections):
+            track_id = assigned.get(d_index)
+            if track_id is None:
+                track_id = self.next_id
+                self.next_id += 1
+            tracks.append({
+                'track_id': track_id,
+                'label': det['label'],
+                'confidence': det['confidence'],
+                'bbox': [float(v) for v in det['bbox']],
+            })
+        
+        self.tracks = tracks
+        self.prev_gray = gray
+        self.shape = frame.shape
+        self.frames_since_detect = 0
+        return self.results()
+    
+    def propagate(self, gray):
+        """Move every track to the new frame, returns the weakest track confidence"""
+        import cv2
+        
+        self.frames_since_detect += 1
+        if not self.tracks:
+            self.prev_gray = gray
+            return 1.0
+        
+        points, owners = [], []
+        for index, track in enumerate(self.tracks):
+            track_points = self._track_points(track['bbox'])
+            points.append(track_points)
+            owners.extend([index] * len(track_points))
+        points = np.concatenate(points).astype(np.float32).reshape(-1, 1, 2)
+        owners = np.array(owners)
+        
+        forward, status_f, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, points, None)
+        backward, status_b, _ = cv2.calcOpticalFlowPyrLK(gray, self.prev_gray, forward, None)
+        fb_error = np.linalg.norm((points - backward).reshape(-1, 2), axis=1)
+        good = (status_f.ravel() == 1) & (status_b.ravel() == 1) & (fb_error < MAX_FB_ERROR)
+        
+        start = points.reshape(-1, 2)
+        end = forward.reshape(-1, 2)
+        weakest = 1.0
+        for index, track in enumerate(self.tracks):
+            mine = owners == index
+            kept = good & mine
+            confidence = kept.sum() / max(1, mine.sum())
+            weakest = min(weakest, confidence)
+            if kept.sum() < 3:
+                continue
+            
+            dx, dy = np.median(end[kept] - start[kept], axis=0) / self.scale
+            # Scale change from the spread of points around their centroid
+            spread_before = np.linalg.norm(start[kept] - start[kept].mean(axis=0), axis=1)
+            spread_after = np.linalg.norm(end[kept] - end[kept].mean(axis=0), axis=1)
+            valid = spread_before > 1e-3
+            zoom = float(np.median(spread_after[valid] / spread_before[valid])) if valid.any() else 1.0
+            
+            x, y, w, h = track['bbox']
+            cx, cy = x + w / 2 + dx, y + h / 2 + dy
+            w, h = w * zoom, h * zoom
+            track['bbox'] = [cx - w / 2, cy - h / 2, w, h]
+        
+        self.prev_gray = gray
+        return weakest
+    
+    def _track_points(self, bbox):
+        """Feature points inside a box in tracking coordinates, falling back to a grid"""
+        import cv2
+        
+        x, y, w, h = [v * self.scale for v in bbox]
+        height, width = self.prev_gray.shape[:2]
+        x1, y1 = max(0, int(x)), max(0, int(y))
+        x2, y2 = min(width, int(x + w)), min(height, int(y + h))
+        
+        if x2 - x1 >= 8 and y2 - y1 >= 8:
+            corners = cv2.goodFeaturesToTrack(self.prev_gray[y1:y2, x1:x2], maxCorners=20,
+                                              qualityLevel=0.01, minDistance=3)
+            if corners is not None and len(corners) >= 3:
+                return corners.reshape(-1, 2) + (x1, y1)
+        
+        xs = np.linspace(x + w * 0.2, x + w * 0.8, 4)
+        ys = np.linspace(y + h * 0.2, y + h * 0.8, 4)
+        return np.array([(px, py) for py in ys for px in xs])
+    
+    def force_detection(self):
+        """Tracking lost confidence: re-detect now and shorten the interval"""
+        self.forced += 1
+        self._force_pending = True
+        self.interval = max(self.min_interval, self.interval // 2)
+        self.frames_since_detect = self.interval
+    
+    def results(self):
+        """Tracks in the detection response format, plus their track ids"""
+        return [{
+            'label': track['label'],
+            'confidence': track['confidence'],
+            'bbox': [int(round(v)) for v in track['bbox']],
+            'track_id': track['track_id'],
+        } for track in self.tracks]
+
+class TrackerRegistry:
+    """Session id -> SessionTracker, with idle eviction"""
+    
+    def __init__(self, interval=5, min_interval=2, max_interval=15, min_confidence=0.5,
+                 session_ttl=60.0, max_sessions=1024):
+        self.settings = {
+            'interval': interval,
+            'min_interval': min_interval,
+            'max_interval': max_interval,
+            'min_confidence': min_confidence,
+        }
+        self._sessions = SessionStore(session_ttl, max_sessions)
+    
+    def get(self, session_id):
+        """Tracker for a session, created on first use"""
+        return self._sessions.get(session_id, lambda: SessionTracker(**self.settings))
+    
+    def stats(self):
+        """Number of sessions being tracked"""
+        return {'sessions': len(self._sessions), **self.settings}
@@ -0,0 +1,195 @@
+"""Object detection over video files, streamed as NDJSON.
+
+    python video.py footage.mp4 --stride 5 > detections.ndjson
+
+The first line describes the video, then one line per processed frame
+({"frame", "timestamp_ms", "detections"}), then a summary line. Frames are
+decoded on a background thread a few frames ahead of inference, so decode
+and detection overlap while memory stays bounded.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from queue import Queue, Full
+
+_END = object()
+
+def open_video(path):
+    """Open a video file, raises ValueError if OpenCV cannot read it"""
+    import cv2
+    
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        capture.release()
+        raise ValueError('Could not open video')
+    return capture
+
+def video_info(capture):
+    """Frame rate, frame count and size reported by the container"""
+    import cv2
+    
+    return {
+        'fps': round(capture.get(cv2.CAP_PROP_FPS), 3),
+        'frame_count': int(capture.get(cv2.CAP_PROP_FRAME_COUNT)),
+        'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    }
+
+def read_frames(capture, stride=1, max_frames=None):
+    """Yield (index, timestamp_ms, frame) for every stride-th frame.
+    
+    Skipped frames are only grabbed, not converted to BGR. The caller
+    keeps ownership of the capture and releases it.
+    """
+    import cv2
+    
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    index = 0
+    emitted = 0
+    while max_frames is None or emitted < max_frames:
+        if index % stride:
+            if not capture.grab():
+                break
+            index += 1
+            continue
+        
+        ok, frame = capture.read()
+        if not ok:
+            break
+        timestamp_ms = index * 1000.0 / fps if fps > 0 else capture.get(cv2.CAP_PROP_POS_MSEC)
+        yield index, timestamp_ms, frame
+        emitted += 1
+        index += 1
+
+def prefetch(items, depth=4):
+    """Run an iterator on a background thread, keeping up to depth items ready.
+    
+    Errors from the iterator are re-raised in the consumer. Closing the
+    returned generator stops the producer, closes the source iterator and
+    waits for the producer thread to exit, so whatever the source reads
+    from can be released safely afterwards.
+    """
+    queue = Queue(maxsize=depth)
+    stop = threading.Event()
+    
+    def put(entry):
+        while not stop.is_set():
+            try:
+                queue.put(entry, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+    
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    break
+            put((_END, None))
+        except Exception as e:
+            put((_END, e))
+        finally:
+            close = getattr(items, 'close', None)
+            if close:
+                close()
+    
+    producer = threading.Thread(target=produce, name='video-decoder', daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+def detect_video(capture, detect, stride=1, max_frames=None, prefetch_depth=4):
+    """Yield the video info, one result per processed frame, then a summary.
+    
+    detect(frame) returns the detections for one decoded frame. Errors
+    end the stream with an {"error"} record. The caller releases capture
+    once the generator is finished or closed.
+    """
+    yield {'video': {**video_info(capture), 'stride': stride}}
+    
+    started = time.perf_counter()
+    processed = 0
+    frames = prefetch(read_frames(capture, stride, max_frames), prefetch_depth)
+    try:
+        for index, timestamp_ms, frame in frames:
+            yield {
+                'frame': index,
+                'timestamp_ms': round(timestamp_ms, 1),
+                'detections': detect(frame),
+            }
+            processed += 1
+    except Exception as e:
+        yield {'error': str(e), 'frames_processed': processed}
+        return
+    finally:
+        frames.close()
+    
+    elapsed = time.perf_counter() - started
+    yield {
+        'done': True,
+        'frames_processed': processed,
+        'elapsed_ms': round(elapsed * 1000, 1),
+        'fps': round(processed / elapsed, 2) if elapsed > 0 else None,
+    }
+
+def ndjson(records):
+    """Serialise records as newline-delimited JSON"""
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', help='Video file to process')
+    parser.add_argument('--stride', type=int, default=1, help='Run detection on every Nth frame')
+    parser.add_argument('--max-frames', type=int, help='Stop after this many processed frames')
+    parser.add_argument('--confidence', help='Minimum detection confidence')
+    parser.add_argument('--classes', help='Comma separated class names or ids to keep')
+    parser.add_argument('--normalized', action='store_true', help='Boxes as fractions of the frame size')
+    parser.add_argument('--output', help='Write NDJSON here instead of stdout')
+    args = parser.parse_args()
+    
+    if args.stride < 1:
+        parser.error('--stride must be at least 1')
+    
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as cv_app
+    
+    values = {key: value for key, value in (('confidence', args.confidence), ('classes', args.classes),
+                                            ('normalized', args.normalized)) if value}
+    try:
+        params = cv_app.detection_params(values)
+        capture = open_video(args.video)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    if not cv_app.wait_until_ready(120):
+        sys.exit(f"Detector did not become ready: {cv_app.startup}")
+    
+    records = detect_video(capture, lambda frame: cv_app.detect_decoded(frame, params),
+                           args.stride, args.max_frames, cv_app.app.config['VIDEO_PREFETCH'])
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for line in ndjson(records):
+            out.write(line)
+            out.flush()
+    finally:
+        records.close()
+        capture.release()
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Compact binary encoding of detection results.
+
+A response is a fixed header followed by the detections as columns, each a
+little-endian array with one entry per detection:
+
+    header     magic b'CVD2', flags uint16, tiles uint16, count uint32, latency_ms float32
+    scores     float32[count]
+    boxes      int32[count][4] x, y, w, h in pixels, float32 fractions with FLAG_NORMALIZED
+    track_ids  uint32[count], only with FLAG_TRACK_IDS
+    class_ids  uint16[count]
+
+Flags are FLAG_MOCK, FLAG_CACHED, FLAG_REUSED, FLAG_TRACKED, FLAG_NORMALIZED
+and FLAG_TRACK_IDS. class_id indexes COCO_CLASSES and tiles is 0 when the
+result was reused. Tracked sessions carry track ids on keyframes as well as
+on tracker frames, so FLAG_TRACK_IDS is separate from FLAG_TRACKED. Columns are ordered so every one starts aligned to its
+element size.
+"""
+import struct
+import numpy as np
+from detection import Detections
+
+PACKED_MIMETYPE = 'application/x-detections'
+MAGIC = b'CVD2'
+HEADER = struct.Struct('<4sHHIf')
+
+FLAG_MOCK = 1
+FLAG_CACHED = 2
+FLAG_REUSED = 4
+FLAG_TRACKED = 8
+FLAG_NORMALIZED = 16
+FLAG_TRACK_IDS = 32
+
+def pack_detections(detections, latency_ms=0.0, flags=0, tiles=None, size=None):
+    """Encode Detections (or result dicts) as header plus columns.
+    
+    With size=(width, height), boxes are written as fractions of it and
+    FLAG_NORMALIZED is set. Detections with track ids get the track_ids
+    column and FLAG_TRACK_IDS.
+    """
+    if not isinstance(detections, Detections):
+        detections = Detections.from_dicts(detections)
+    if size:
+        width, height = size
+        boxes = (detections.boxes / np.array([width, height, width, height], dtype=np.float32)).astype('<f4')
+        flags |= FLAG_NORMALIZED
+    else:
+        boxes = detections.boxes.astype('<i4', copy=False)
+    columns = [detections.scores.astype('<f4', copy=False).tobytes(), boxes.tobytes()]
+    if detections.track_ids is not None:
+        columns.append(detections.track_ids.astype('<u4', copy=False).tobytes())
+        flags |= FLAG_TRACK_IDS
+    columns.append(detections.class_ids.astype('<u2', copy=False).tobytes())
+    header = HEADER.pack(MAGIC, flags, tiles or 0, len(detections), latency_ms)
+    return b''.join([header] + columns)
+
+def unpack_detections(data):
+    """Decode a packed response, returns (header dict, Detections) with read-only columns"""
+    magic, flags, tiles, count, latency_ms = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('Not a packed detection response')
+    box_dtype = '<f4' if flags & FLAG_NORMALIZED else '<i4'
+    offset = HEADER.size
+    scores = np.frombuffer(data, dtype='<f4', count=count, offset=offset)
+    offset += scores.nbytes
+    boxes = np.frombuffer(data, dtype=box_dtype, count=count * 4, offset=offset).reshape(-1, 4)
+    offset += boxes.nbytes
+    track_ids = None
+    if flags & FLAG_TRACK_IDS:
+        track_ids = np.frombuffer(data, dtype='<u4', count=count, offset=offset)
+        offset += track_ids.nbytes
+    class_ids = np.frombuffer(data, dtype='<u2', count=count, offset=offset)
+    header = {'flags': flags, 'tiles': tiles or None, 'count': count, 'latency_ms': latency_ms}
+    return header, Detections(class_ids, scores, boxes, track_ids)